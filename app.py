@@ -5,21 +5,41 @@ import asyncio
 import sys
 import json
 import uuid
-from datetime import datetime, timedelta, timezone
+import time
+import sqlite3
+import threading
+import socket
+import hashlib
+import hmac
+import math
+import heapq
+import gzip
+import csv
+import io
+import tempfile
+from array import array
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Tuple, Any, Iterator, Callable
 from aiohttp import web, ClientSession
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-from aiogram.filters import Command
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType, DefaultKeyBuilder
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, Update, FSInputFile
+from aiogram import BaseMiddleware
+from aiogram.filters import Command, CommandObject
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
 
 # ============================================================================
 # КОНФИГУРАЦИЯ И ИНИЦИАЛИЗАЦИЯ
 # ============================================================================
 
+STARTUP_STARTED = time.perf_counter()
+
 PORT = int(os.getenv('PORT', 10000))
 TOKEN = os.getenv('TOKEN')
 RENDER_URL = os.getenv('RENDER_URL', '')
@@ -29,9 +49,46 @@ if not TOKEN:
 
 TUTOR_ID = 1339816111
 
-bot = Bot(token=TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+# polling - один процесс (по умолчанию); webhook - прием вебхуков + обработка;
+# worker - только обработка очереди апдейтов
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WORKER_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or hashlib.sha256(TOKEN.encode()).hexdigest()[:32]
+
+LEASE_TTL = 30
+LEASE_RENEW_INTERVAL = 10
+QUEUE_POLL_INTERVAL = 0.2
+QUEUE_BATCH_SIZE = 50
+
+# Подписи ссылок на календари (.ics) и число одновременно отдаваемых календарей
+ICS_SECRET = os.getenv('ICS_SECRET') or hashlib.sha256(f"ics:{TOKEN}".encode()).hexdigest()
+ICS_MAX_CONCURRENT = int(os.getenv('ICS_MAX_CONCURRENT', 4))
+ICS_CHUNK_EVENTS = 200
+
+# JSON API для сайта: /api/lessons открывается только с API_TOKEN; данные перепроверяются
+# на диске не чаще раза в API_REVALIDATE_INTERVAL секунд
+API_TOKEN = os.getenv('API_TOKEN', '')
+API_REVALIDATE_INTERVAL = 1.0
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+# Список заявок у репетитора и рассылка итогов массового подтверждения
+PENDING_PAGE_SIZE = 8
+NOTIFY_CONCURRENCY = 8
+# Массовые рассылки идут не быстрее SEND_RATE сообщений в секунду (лимит Telegram - около 30)
+SEND_RATE = 20
+SEND_RETRIES = 3
+# Выгрузка для бухгалтерии (/export и /api/export) пишется кусками по столько строк
+EXPORT_CHUNK_ROWS = 500
+
+# Другой адрес Bot API - например, локальный fake_telegram.py для нагрузочных тестов
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+
+if TELEGRAM_API_URL:
+    bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=TOKEN)
 
 SUBJECTS = ["Математика", "Физика", "Химия"]
 
@@ -59,7 +116,9 @@ DAYS_RU = {
 
 MSK_TIMEZONE = timezone(timedelta(hours=3))
 
-if os.path.exists('/app'):
+if os.getenv('DATA_DIR'):
+    DATA_DIR = Path(os.getenv('DATA_DIR'))
+elif os.path.exists('/app'):
     DATA_DIR = Path('/app/bot_data')
 else:
     DATA_DIR = Path.cwd() / 'bot_data'
@@ -74,17 +133,58 @@ PENDING_RESCHEDULES_FILE = DATA_DIR / "pending_reschedules.json"
 PENDING_CANCELS_FILE = DATA_DIR / "pending_cancels.json"
 PENDING_TUTOR_RESCHEDULES_FILE = DATA_DIR / "pending_tutor_reschedules.json"
 MESSAGE_LOG_FILE = DATA_DIR / "message_log.json"
+FSM_DB_FILE = DATA_DIR / "fsm_storage.sqlite3"
+TUTORS_FILE = DATA_DIR / "tutors.json"
+STUDENT_ROUTES_FILE = DATA_DIR / "student_routes.json"
+COORDINATION_DB_FILE = DATA_DIR / "coordination.sqlite3"
+TUTORS_DIR = DATA_DIR / "tutors"
+
+# Запись входящих апдейтов для реплея (replay.py): RECORD_UPDATES=1 или путь к файлу
+RECORD_UPDATES = os.getenv('RECORD_UPDATES', '')
+RECORD_FILE = Path(RECORD_UPDATES) if RECORD_UPDATES not in ('', '0', '1') else DATA_DIR / "requests.jsonl"
+RECORD_SALT = os.getenv('RECORD_SALT') or hashlib.sha256(f"record:{TOKEN}".encode()).hexdigest()
+
+# Заявка без ответа истекает через сутки
+REQUEST_TTL = 86400
+EXPIRY_CHECK_INTERVAL = 30
+# Как часто из sent_reminders.json удаляются напоминания о прошедших занятиях, сек
+REMINDER_CLEANUP_INTERVAL = 600
+# Сколько держится слот, предложенный ученику из листа ожидания
+WAITLIST_OFFER_TTL = int(os.getenv("WAITLIST_OFFER_TTL", "900"))
+
+# Запись открыта на столько недель вперед (текущая неделя - первая)
+BOOKING_HORIZON_WEEKS = max(1, int(os.getenv('BOOKING_HORIZON_WEEKS', 4)))
+
+# Длительность еженедельной серии на выбор репетитора, недель (0 - без даты окончания)
+SERIES_DURATION_WEEKS = (4, 8, 12, 0)
+
+# Сколько рекомендуемых слотов показывать ученику при выборе дня
+SUGGESTION_COUNT = 3
+
+# Занятия старше этого срока переносятся из confirmed_lessons.json в архив
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))
+
+# Снимок статистики (stats.json) пишется на диск не чаще раза в STATS_FLUSH_INTERVAL секунд
+STATS_FLUSH_INTERVAL = 30
+STATS_ROLLING_WEEKS = 4
+
+FSM_FLUSH_INTERVAL = 2
+FSM_STATE_TTL = 3 * 86400
+FSM_MEMORY_IDLE = 900
+FSM_EXPIRE_INTERVAL = 60
 
-STUDENT_CACHE = {}
-SENT_REMINDERS = set()
 
 # ============================================================================
 # ФУНКЦИИ РАБОТЫ С JSON
 # ============================================================================
 
+# Сколько раз читался каждый файл - для отчета о запуске
+FILE_READS: Dict[str, int] = {}
+
 def load_json(filepath):
     try:
         if filepath.exists():
+            FILE_READS[str(filepath)] = FILE_READS.get(str(filepath), 0) + 1
             with open(filepath, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 print(f"✅ Загружено: {filepath.name} ({len(data)} записей)")
@@ -93,59 +193,493 @@ def load_json(filepath):
         print(f"⚠️ Ошибка при загрузке {filepath}: {e}")
     return {}
 
-def save_json(filepath, data):
+def save_json(filepath, data, allow_empty: bool = False) -> bool:
+    """True - данные на диске; False - запись отменена или не удалась, файл остался прежним"""
+    tmp_path = filepath.with_name(filepath.name + ".tmp")
     try:
         filepath.parent.mkdir(parents=True, exist_ok=True)
         
-        if not data and filepath.name not in ["pending_requests.json", "pending_reschedules.json", "pending_cancels.json", "pending_tutor_reschedules.json"]:
+        if not data and not allow_empty and filepath.name not in ["pending_requests.json", "pending_reschedules.json", "pending_cancels.json", "pending_tutor_reschedules.json", "sent_reminders.json", "slot_holds.json", "waitlist.json"]:
             print(f"⚠️ ВНИМАНИЕ: Попытка сохранить пустые данные в {filepath.name}")
             if filepath.name in ["schedule.json", "confirmed_lessons.json"]:
                 print(f" ⛔ ОТМЕНЕНО: Сохранение отменено для защиты данных")
-                return
+                return False
         
-        with open(filepath, 'w', encoding='utf-8') as f:
+        # Запись во временный файл и подмена целиком: если место на диске кончится
+        # посреди записи, останется прежняя версия файла, а не обрезанный JSON
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, filepath)
         
         if filepath.exists():
             file_size = filepath.stat().st_size
             print(f"✅ Сохранено: {filepath.name} ({file_size} байт, {len(data)} записей)")
+        return True
     except Exception as e:
+        tmp_path.unlink(missing_ok=True)
         print(f"❌ КРИТИЧЕСКАЯ ОШИБКА при сохранении {filepath}: {e}")
         import traceback
         traceback.print_exc()
+        return False
 
-def cleanup_stale_requests():
-    now = datetime.now(tz=MSK_TIMEZONE)
+# ============================================================================
+# МОДЕЛИ ДАННЫХ
+# ============================================================================
+
+def parse_datetime(value) -> Optional[datetime]:
+    """ISO-строка в aware datetime; время без часового пояса считается московским"""
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        try:
+            dt = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return None
+    
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=MSK_TIMEZONE)
+    return dt
+
+class Record:
+    """Запись JSON-файла: даты разбираются один раз при загрузке, а незнакомые ключи
+    хранятся в extra и записываются обратно без потерь"""
+    
+    __slots__ = ()
     
-    for filepath in [PENDING_FILE, PENDING_RESCHEDULES_FILE, PENDING_CANCELS_FILE, PENDING_TUTOR_RESCHEDULES_FILE]:
-        data = load_json(filepath)
-        stale_ids = []
+    DATETIME_FIELDS: Tuple[str, ...] = ()
+    DERIVED_FIELDS: Tuple[str, ...] = ()
+    
+    @classmethod
+    def from_dict(cls, data: Dict):
+        fields_ = cls.__dataclass_fields__
+        values = {}
+        extra = {}
         
-        for req_id, req in data.items():
-            try:
-                req_time = datetime.fromisoformat(req.get("timestamp", ""))
-                if req_time.tzinfo is None:
-                    req_time = req_time.replace(tzinfo=MSK_TIMEZONE)
-                
-                if (now - req_time).total_seconds() > 86400:
-                    stale_ids.append(req_id)
-            except:
-                pass
+        for key, value in data.items():
+            if key in fields_ and key != "extra":
+                values[key] = value
+            elif key not in cls.DERIVED_FIELDS:
+                extra[key] = value
+        
+        for name in cls.DATETIME_FIELDS:
+            raw = values.get(name)
+            if raw is not None:
+                values[name] = parse_datetime(raw)
+                if values[name] is None:
+                    extra[name] = raw
+                    extra.update({key: data[key] for key in cls.DERIVED_FIELDS if key in data})
+        
+        return cls(**values, extra=extra)
+    
+    def to_dict(self) -> Dict:
+        data = {}
+        
+        for name in self.__dataclass_fields__:
+            value = getattr(self, name)
+            if name == "extra" or value is None:
+                continue
+            data[name] = value.isoformat() if isinstance(value, datetime) else value
+        
+        for name in self.DERIVED_FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        
+        data.update(self.extra)
+        return data
+
+@dataclass(slots=True)
+class Lesson(Record):
+    student_id: Optional[int] = None
+    student_name: Optional[str] = None
+    student_class: Optional[str] = None
+    subject: Optional[str] = None
+    lesson_datetime: Optional[datetime] = None
+    status: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+    
+    DATETIME_FIELDS = ("lesson_datetime", "timestamp")
+    DERIVED_FIELDS = ("date_str", "time")
+    
+    @property
+    def date_str(self) -> Optional[str]:
+        return self.lesson_datetime.strftime("%d.%m.%Y") if self.lesson_datetime else None
+    
+    @property
+    def time(self) -> Optional[str]:
+        return self.lesson_datetime.strftime("%H:%M") if self.lesson_datetime else None
+
+@dataclass(slots=True)
+class PendingRequest(Record):
+    student_id: Optional[int] = None
+    student_name: Optional[str] = None
+    student_class: Optional[str] = None
+    subject: Optional[str] = None
+    lesson_datetime: Optional[datetime] = None
+    timestamp: Optional[datetime] = None
+    status: Optional[str] = None
+    type: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+    
+    DATETIME_FIELDS = ("lesson_datetime", "timestamp")
+
+@dataclass(slots=True)
+class RescheduleRequest(Record):
+    """Перенос по просьбе ученика (pending_reschedules) или репетитора (pending_tutor_reschedules)"""
+    lesson_id: Optional[str] = None
+    student_id: Optional[int] = None
+    student_name: Optional[str] = None
+    student_class: Optional[str] = None
+    subject: Optional[str] = None
+    new_lesson_datetime: Optional[datetime] = None
+    timestamp: Optional[datetime] = None
+    status: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+    
+    DATETIME_FIELDS = ("new_lesson_datetime", "timestamp")
+
+@dataclass(slots=True)
+class CancelRequest(Record):
+    lesson_id: Optional[str] = None
+    student_id: Optional[int] = None
+    student_name: Optional[str] = None
+    student_class: Optional[str] = None
+    subject: Optional[str] = None
+    lesson_datetime: Optional[datetime] = None
+    timestamp: Optional[datetime] = None
+    status: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+    
+    DATETIME_FIELDS = ("lesson_datetime", "timestamp")
+
+@dataclass(slots=True)
+class LoggedMessage(Record):
+    """Сообщение бота из message_log.json (удаляется через сутки)"""
+    chat_id: Optional[int] = None
+    message_id: Optional[int] = None
+    type: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+    
+    DATETIME_FIELDS = ("timestamp",)
+
+@dataclass(slots=True)
+class SlotHold(Record):
+    """Временная бронь слота на время заявки (slot_holds.json); ключ - "YYYY-MM-DD_HH:MM" """
+    student_id: Optional[int] = None
+    kind: Optional[str] = None
+    request_id: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+    
+    DATETIME_FIELDS = ("expires_at",)
+
+@dataclass(slots=True)
+class WaitlistEntry(Record):
+    """Ученик в листе ожидания занятого слота (waitlist.json).
+    offered_until задан, пока ученику предложен освободившийся слот."""
+    student_id: Optional[int] = None
+    student_name: Optional[str] = None
+    student_class: Optional[str] = None
+    subject: Optional[str] = None
+    lesson_datetime: Optional[datetime] = None
+    timestamp: Optional[datetime] = None
+    offered_until: Optional[datetime] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+    
+    DATETIME_FIELDS = ("lesson_datetime", "timestamp", "offered_until")
+
+@dataclass(slots=True)
+class LessonSeries(Record):
+    """Еженедельная серия занятий (lesson_series.json). Занятия серии не хранятся -
+    они разворачиваются по правилу в окне записи (см. all_lessons).
+    exceptions: "YYYY-MM-DD" исходной даты -> "skip" или новое время в ISO."""
+    student_id: Optional[int] = None
+    student_name: Optional[str] = None
+    student_class: Optional[str] = None
+    subject: Optional[str] = None
+    weekday: Optional[int] = None
+    time: Optional[str] = None
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    exceptions: Dict[str, str] = field(default_factory=dict)
+    timestamp: Optional[datetime] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+    
+    DATETIME_FIELDS = ("start_date", "end_date", "timestamp")
+
+@dataclass(slots=True)
+class Student(Record):
+    """Запись students.json; id ученика - ключ словаря"""
+    name: Optional[str] = None
+    grade: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+class RecordFile:
+    """JSON-файл с записями одного типа.
+    
+    Файл разбирается один раз; повторно он читается, только если его изменил
+    другой процесс (сравниваем mtime и размер).
+    """
+    
+    def __init__(self, path: Path, record_type):
+        self.path = path
+        self.record_type = record_type
+        self.records: Optional[Dict[str, Record]] = None
+        self.signature = None
+        # Увеличивается при каждом разборе файла - по нему видно, что файл менял другой процесс
+        self.generation = 0
+        # Увеличивается при любом изменении записей (разбор или сохранение) - ключ для кэшей
+        self.version = 0
+    
+    def _signature(self):
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def load(self) -> Dict[str, Record]:
+        signature = self._signature()
+        
+        if self.records is None or signature != self.signature:
+            self.records = {
+                key: self.record_type.from_dict(value)
+                for key, value in load_json(self.path).items() if isinstance(value, dict)
+            }
+            self.signature = signature
+            self.generation += 1
+            self.version += 1
+        
+        return self.records
+    
+    def save(self, records: Optional[Dict[str, Record]] = None, allow_empty: bool = False) -> bool:
+        """False - запись не удалась: изменения в памяти отбрасываются, и следующий
+        load() перечитает файл, чтобы бот не работал с данными, которых нет на диске"""
+        if records is not None:
+            self.records = records
+        saved = save_json(self.path, {key: record.to_dict() for key, record in (self.records or {}).items()}, allow_empty)
+        if saved:
+            self.signature = self._signature()
+        else:
+            self.discard()
+        self.version += 1
+        return saved
+    
+    def discard(self):
+        """Несохраненные изменения забываются: следующий load() перечитает файл"""
+        self.signature = None
+
+STAT_EVENTS = ("confirmed", "rescheduled", "cancelled")
+
+class TutorStats:
+    """Счетчики занятий репетитора (stats.json): всего, по предметам, ученикам и неделям.
+    
+    Счетчики меняются в момент подтверждения, переноса или отмены, поэтому запрос
+    статистики только читает готовые числа и не зависит от объема истории.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.data: Optional[Dict] = None
+        self.signature = None
+        self.dirty = False
+    
+    @staticmethod
+    def counters() -> Dict[str, int]:
+        return dict.fromkeys(STAT_EVENTS, 0)
+    
+    def load(self) -> Optional[Dict]:
+        """None - снимка еще нет (см. rebuild_stats)"""
+        signature = file_version(self.path)
+        if not self.dirty and (self.data is None or signature != self.signature):
+            data = load_json(self.path)
+            self.data = data if "totals" in data else None
+            self.signature = signature
+        return self.data
+    
+    def reset(self):
+        self.data = {"totals": self.counters(), "subjects": {}, "students": {}, "weeks": {},
+                     "series_counted_until": None, "updated_at": None}
+        self.dirty = True
+    
+    def record(self, event: str, student_id: int, student_name: str, subject: str, lesson_dt: Optional[datetime]):
+        data = self.data
+        data["totals"][event] += 1
+        data["subjects"].setdefault(subject or "—", self.counters())[event] += 1
+        
+        student = data["students"].setdefault(str(student_id), {"name": student_name, **self.counters()})
+        student[event] += 1
+        if student_name:
+            student["name"] = student_name
+        
+        if lesson_dt:
+            data["weeks"].setdefault(stats_week_key(lesson_dt), self.counters())[event] += 1
+        
+        data["updated_at"] = datetime.now(tz=MSK_TIMEZONE).isoformat()
+        self.dirty = True
+    
+    def flush(self):
+        if self.dirty and save_json(self.path, self.data):
+            self.signature = file_version(self.path)
+            self.dirty = False
+
+# ============================================================================
+# РЕПЕТИТОРЫ И РАЗДЕЛЫ ДАННЫХ
+# ============================================================================
+
+class TutorPartition:
+    """Раздел данных одного репетитора: расписание, занятия, заявки и лог сообщений"""
+    
+    def __init__(self, tutor_id: int, name: str, data_dir: Path):
+        self.tutor_id = tutor_id
+        self.name = name
+        self.data_dir = data_dir
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        
+        self.schedule_file = data_dir / "schedule.json"
+        self.pending_file = data_dir / "pending_requests.json"
+        self.confirmed_file = data_dir / "confirmed_lessons.json"
+        self.pending_reschedules_file = data_dir / "pending_reschedules.json"
+        self.pending_cancels_file = data_dir / "pending_cancels.json"
+        self.pending_tutor_reschedules_file = data_dir / "pending_tutor_reschedules.json"
+        self.message_log_file = data_dir / "message_log.json"
+        self.sent_reminders_file = data_dir / "sent_reminders.json"
+        self.slot_holds_file = data_dir / "slot_holds.json"
+        self.waitlist_file = data_dir / "waitlist.json"
+        self.series_file = data_dir / "lesson_series.json"
+        self.schedule_rules_file = data_dir / "schedule_rules.json"
+        self.stats_file = data_dir / "stats.json"
+        self.archive_dir = data_dir / "archive"
+        self.archive_index_file = self.archive_dir / "index.json"
+        
+        self.lessons = RecordFile(self.confirmed_file, Lesson)
+        self.requests = RecordFile(self.pending_file, PendingRequest)
+        self.reschedules = RecordFile(self.pending_reschedules_file, RescheduleRequest)
+        self.cancels = RecordFile(self.pending_cancels_file, CancelRequest)
+        self.tutor_reschedules = RecordFile(self.pending_tutor_reschedules_file, RescheduleRequest)
+        self.holds = RecordFile(self.slot_holds_file, SlotHold)
+        self.waitlist = RecordFile(self.waitlist_file, WaitlistEntry)
+        self.series = RecordFile(self.series_file, LessonSeries)
+        self.stats = TutorStats(self.stats_file)
+        # slot_key -> id записей листа ожидания в порядке очереди (см. waitlist_index)
+        self.waitlist_slots: Dict[str, List[str]] = {}
+        self.waitlist_generation = 0
+        # Кэши занятости (см. all_lessons, get_booked_times и week_availability)
+        self.lessons_cache: Tuple[tuple, Dict[str, Lesson]] = ((), {})
+        self.slot_table: Tuple[tuple, Dict[date, List[str]]] = ((), {})
+        self.booked_cache: Tuple[tuple, Dict[str, bool]] = ((), {})
+        self.availability_cache: Dict[int, Tuple[tuple, datetime, Dict[str, List[str]]]] = {}
+        self.occupancy: Tuple[tuple, Any] = ((), None)
+        # Лог сообщений самый большой - читается только при первом обращении
+        self.message_log = RecordFile(self.message_log_file, LoggedMessage)
+        
+        self.sent_reminders = set(load_json(self.sent_reminders_file))
+    
+    @property
+    def request_stores(self) -> List[RecordFile]:
+        return [self.requests, self.reschedules, self.cancels, self.tutor_reschedules]
+    
+    def __repr__(self):
+        return f"TutorPartition({self.tutor_id}, {self.name!r})"
+
+def load_partitions() -> Dict[int, TutorPartition]:
+    """Основной репетитор хранит данные прямо в DATA_DIR, остальные - в DATA_DIR/tutors/<id>"""
+    partitions = {TUTOR_ID: TutorPartition(TUTOR_ID, "Репетитор", DATA_DIR)}
+    
+    for tutor_id_str, tutor_info in load_json(TUTORS_FILE).items():
+        try:
+            tutor_id = int(tutor_id_str)
+        except (TypeError, ValueError):
+            continue
+        
+        name = tutor_info.get("name", "Репетитор")
+        if tutor_id == TUTOR_ID:
+            partitions[tutor_id].name = name
+        else:
+            partitions[tutor_id] = TutorPartition(tutor_id, name, TUTORS_DIR / str(tutor_id))
+    
+    return partitions
+
+PARTITIONS = load_partitions()
+STUDENT_ROUTES: Dict[int, int] = {}
+ROUTES_MTIME = None
+
+def reload_routes_if_changed():
+    """Перечитывает student_routes.json, если его изменил другой процесс"""
+    global ROUTES_MTIME
+    
+    try:
+        mtime = STUDENT_ROUTES_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    
+    if mtime == ROUTES_MTIME:
+        return
+    
+    ROUTES_MTIME = mtime
+    STUDENT_ROUTES.clear()
+    STUDENT_ROUTES.update({
+        int(student_id): tutor_id for student_id, tutor_id in load_json(STUDENT_ROUTES_FILE).items()
+    })
+
+reload_routes_if_changed()
+
+class PartitionMiddleware(BaseMiddleware):
+    """Передает в обработчики раздел данных репетитора, к которому относится пользователь"""
+    
+    async def __call__(self, handler, event, data):
+        if BOT_MODE != "polling":
+            reload_routes_if_changed()
+        
+        user = data.get("event_from_user")
+        data["partition"] = get_partition(user.id if user else TUTOR_ID)
+        return await handler(event, data)
+
+def is_tutor(user_id: int) -> bool:
+    return user_id in PARTITIONS
+
+def get_partition(user_id: int) -> TutorPartition:
+    """Репетитор работает со своим разделом, ученик - с разделом своего репетитора"""
+    if user_id in PARTITIONS:
+        return PARTITIONS[user_id]
+    return PARTITIONS.get(STUDENT_ROUTES.get(user_id, TUTOR_ID)) or PARTITIONS[TUTOR_ID]
+
+def route_student(student_id: int, tutor_id: int):
+    if tutor_id not in PARTITIONS or STUDENT_ROUTES.get(student_id) == tutor_id:
+        return
+    
+    global ROUTES_MTIME
+    
+    STUDENT_ROUTES[student_id] = tutor_id
+    save_json(STUDENT_ROUTES_FILE, {str(sid): tid for sid, tid in STUDENT_ROUTES.items()})
+    ROUTES_MTIME = STUDENT_ROUTES_FILE.stat().st_mtime_ns
+    STUDENT_DIRECTORY.reroute(student_id)
+    print(f"🔀 Ученик {student_id} закреплен за репетитором {tutor_id}")
+
+def cleanup_stale_requests(partition: TutorPartition):
+    now = datetime.now(tz=MSK_TIMEZONE)
+    
+    for store in partition.request_stores:
+        data = store.load()
+        stale_ids = [
+            req_id for req_id, req in data.items()
+            if req.timestamp and (now - req.timestamp).total_seconds() > 86400
+        ]
         
         for req_id in stale_ids:
             del data[req_id]
             print(f"🗑️ Удален старый запрос: {req_id}")
         
         if stale_ids:
-            save_json(filepath, data)
+            store.save()
 
-def cleanup_sent_reminders_list():
-    global SENT_REMINDERS
-    
+def cleanup_sent_reminders_list(partition: TutorPartition):
     now = datetime.now(tz=MSK_TIMEZONE)
     active_reminders = set()
     
-    for reminder_key in SENT_REMINDERS:
+    for reminder_key in partition.sent_reminders:
         try:
             parts = reminder_key.split(":", 1)
             if len(parts) == 2:
@@ -157,118 +691,1303 @@ def cleanup_sent_reminders_list():
         except Exception as e:
             print(f"⚠️ Ошибка при очистке напоминания {reminder_key}: {e}")
     
-    SENT_REMINDERS = active_reminders
-    print(f"🧹 Очищены старые напоминания. Активных: {len(SENT_REMINDERS)}")
+    removed = len(partition.sent_reminders) - len(active_reminders)
+    partition.sent_reminders = active_reminders
+    if removed:
+        save_json(partition.sent_reminders_file, {key: True for key in active_reminders})
+    print(f"🧹 Очищены старые напоминания ({partition.tutor_id}). Активных: {len(active_reminders)}")
+
+def load_startup_data(cleanup: bool = True) -> Dict[str, float]:
+    """Загрузка при запуске за один проход: каждый файл читается не больше одного раза,
+    очистка и справочник учеников работают с уже загруженными записями"""
+    timings = {}
+    
+    started = time.perf_counter()
+    for partition in PARTITIONS.values():
+        for store in [partition.lessons, *partition.request_stores]:
+            store.load()
+    timings["занятия и заявки"] = time.perf_counter() - started
+    
+    if cleanup:
+        started = time.perf_counter()
+        for partition in PARTITIONS.values():
+            cleanup_stale_requests(partition)
+        timings["очистка заявок"] = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        for partition in PARTITIONS.values():
+            archive_old_lessons(partition)
+        timings["архивация занятий"] = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        for partition in PARTITIONS.values():
+            partition_stats(partition)
+        timings["счетчики занятий"] = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    restore_cache_from_files()
+    timings["справочник учеников"] = time.perf_counter() - started
+    
+    return timings
+
+def restore_cache_from_files():
+    print("🔄 Восстанавливаю справочник учеников из файлов...")
+    STUDENT_DIRECTORY.load()
+    print(f"✅ Справочник учеников восстановлен: {len(STUDENT_DIRECTORY.by_id)} записей")
+
+# ============================================================================
+# АРХИВ ЗАНЯТИЙ
+# ============================================================================
+
+def archive_month_file(partition: TutorPartition, month: str) -> Path:
+    return partition.archive_dir / f"lessons-{month}.jsonl.gz"
+
+def load_archive_index(partition: TutorPartition) -> Dict[str, Dict]:
+    """Индекс архива: месяц -> файл, количество занятий, границы дат и id учеников"""
+    return load_json(partition.archive_index_file) if partition.archive_index_file.exists() else {}
+
+def archive_old_lessons(partition: TutorPartition, now: datetime = None) -> int:
+    """Переносит занятия старше ARCHIVE_AFTER_DAYS в gzip-файлы по месяцам.
+    
+    Сначала дописывается архив и индекс, потом сохраняется живой набор - при сбое
+    посередине занятие окажется в обоих местах, но не потеряется.
+    """
+    if now is None:
+        now = datetime.now(tz=MSK_TIMEZONE)
+    cutoff = now - timedelta(days=ARCHIVE_AFTER_DAYS)
+    
+    confirmed = partition.lessons.load()
+    by_month: Dict[str, List[Tuple[str, Lesson]]] = {}
+    for lesson_id, lesson in confirmed.items():
+        if lesson.lesson_datetime and lesson.lesson_datetime < cutoff:
+            by_month.setdefault(lesson.lesson_datetime.strftime("%Y-%m"), []).append((lesson_id, lesson))
+    
+    if not by_month:
+        return 0
+    
+    partition.archive_dir.mkdir(parents=True, exist_ok=True)
+    index = load_archive_index(partition)
+    
+    for month, lessons in sorted(by_month.items()):
+        filepath = archive_month_file(partition, month)
+        # Режим "at" дописывает новый gzip-member, gzip.open читает их подряд
+        with gzip.open(filepath, "at", encoding="utf-8") as f:
+            for lesson_id, lesson in lessons:
+                f.write(json.dumps({"id": lesson_id, **lesson.to_dict()}, ensure_ascii=False) + "\n")
+        
+        dates = [lesson.lesson_datetime for _, lesson in lessons]
+        entry = index.get(month, {"file": filepath.name, "count": 0, "students": []})
+        entry["count"] += len(lessons)
+        entry["first"] = min([entry["first"], min(dates).isoformat()]) if entry.get("first") else min(dates).isoformat()
+        entry["last"] = max([entry["last"], max(dates).isoformat()]) if entry.get("last") else max(dates).isoformat()
+        entry["students"] = sorted(set(entry["students"]) | {lesson.student_id for _, lesson in lessons if lesson.student_id})
+        index[month] = entry
+    
+    save_json(partition.archive_index_file, index)
+    
+    archived = 0
+    for lessons in by_month.values():
+        for lesson_id, _ in lessons:
+            del confirmed[lesson_id]
+            archived += 1
+    partition.lessons.save(allow_empty=True)
+    
+    print(f"🗄 [{partition.tutor_id}] В архив перенесено занятий: {archived}, в работе осталось: {len(confirmed)}")
+    return archived
+
+def iter_archived_lessons(partition: TutorPartition, start: datetime = None, end: datetime = None,
+                          student_id: int = None) -> Iterator[Tuple[str, Lesson]]:
+    """Потоково читает архив: по индексу открываются только подходящие месяцы"""
+    index = load_archive_index(partition)
+    
+    for month in sorted(index):
+        entry = index[month]
+        if start and entry.get("last") and parse_datetime(entry["last"]) < start:
+            continue
+        if end and entry.get("first") and parse_datetime(entry["first"]) >= end:
+            continue
+        if student_id is not None and student_id not in entry.get("students", ()):
+            continue
+        
+        filepath = partition.archive_dir / entry["file"]
+        if not filepath.exists():
+            continue
+        
+        seen = set()
+        with gzip.open(filepath, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                lesson_id = data.pop("id", None)
+                if lesson_id in seen:
+                    continue
+                seen.add(lesson_id)
+                
+                lesson = Lesson.from_dict(data)
+                if student_id is not None and lesson.student_id != student_id:
+                    continue
+                if start and (not lesson.lesson_datetime or lesson.lesson_datetime < start):
+                    continue
+                if end and (not lesson.lesson_datetime or lesson.lesson_datetime >= end):
+                    continue
+                yield lesson_id, lesson
+
+def has_archived_lessons(partition: TutorPartition, student_id: int) -> bool:
+    return any(student_id in entry.get("students", ()) for entry in load_archive_index(partition).values())
+
+# ============================================================================
+# ЗАПИСЬ АПДЕЙТОВ
+# ============================================================================
+
+ANONYMOUS_KEEP_TEXT = {"☰ Меню"}
+PERSONAL_FIELDS = {"last_name", "username", "language_code", "phone_number", "is_premium"}
+
+def anonymize_id(user_id: int) -> int:
+    """Стабильный псевдоним пользователя; id репетиторов сохраняются, чтобы реплей видел их меню"""
+    if user_id in PARTITIONS or user_id <= 0:
+        return user_id
+    digest = hashlib.sha256(f"{RECORD_SALT}:{user_id}".encode()).digest()
+    return 10**12 + int.from_bytes(digest[:6], "big") % 10**12
+
+def anonymize_text(text: str) -> str:
+    """Команды, кнопки меню и время/класс оставляем, остальной текст заменяем той же длины"""
+    if text.startswith("/") or text in ANONYMOUS_KEEP_TEXT or all(c.isdigit() or c in ":.,- " for c in text):
+        return text
+    return "".join(c if c.isspace() else "x" for c in text)
+
+def anonymize_update(value, key: str = ""):
+    if isinstance(value, dict):
+        result = {}
+        for k, v in value.items():
+            if k in PERSONAL_FIELDS:
+                continue
+            if k == "first_name":
+                result[k] = "Ученик"
+            elif k == "id" and key in ("from", "from_user", "chat", "user", "sender_chat") and isinstance(v, int):
+                result[k] = anonymize_id(v)
+            elif k in ("text", "caption") and isinstance(v, str):
+                result[k] = anonymize_text(v)
+            else:
+                result[k] = anonymize_update(v, k)
+        return result
+    if isinstance(value, list):
+        return [anonymize_update(item, key) for item in value]
+    return value
+
+class UpdateRecorderMiddleware(BaseMiddleware):
+    """Пишет входящие апдейты (обезличенные) в JSON lines: {"t": unix-время, "update": {...}}.
+    Время абсолютное: файл дописывается после перезапусков и несколькими воркерами сразу."""
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        print(f"⏺ Запись апдейтов в {path}")
+    
+    async def __call__(self, handler, event, data):
+        try:
+            record = {
+                "t": round(time.time(), 3),
+                "update": anonymize_update(event.model_dump(mode="json", exclude_none=True, by_alias=True))
+            }
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+        except Exception as e:
+            print(f"⚠️ Ошибка записи апдейта: {e}")
+        return await handler(event, data)
+
+# ============================================================================
+# ХРАНИЛИЩЕ СОСТОЯНИЙ FSM (SQLite)
+# ============================================================================
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite: изменения копятся в памяти и сбрасываются на диск пачками в фоне"""
+
+    def __init__(self, db_path: Path, flush_interval: float = FSM_FLUSH_INTERVAL,
+                 ttl: int = FSM_STATE_TTL, memory_idle: int = FSM_MEMORY_IDLE):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.memory_idle = memory_idle
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        
+        # key -> {"state": str | None, "data": dict, "touched": float, "seen": float, "user_id": int}
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.dirty = set()
+        self.flush_task: Optional[asyncio.Task] = None
+        self.last_expire = 0.0
+        
+        self.db_lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        with self.db_lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, touched REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS fsm_touched ON fsm (touched)")
+            self.conn.commit()
+    
+    def _record(self, key: StorageKey) -> Dict[str, Any]:
+        storage_key = self.key_builder.build(key)
+        now = time.time()
+        record = self.records.get(storage_key)
+        
+        if record is None:
+            with self.db_lock:
+                row = self.conn.execute(
+                    "SELECT state, data, touched FROM fsm WHERE key = ?", (storage_key,)
+                ).fetchone()
+            if row:
+                record = {"state": row[0], "data": json.loads(row[1]), "touched": row[2]}
+            else:
+                record = {"state": None, "data": {}, "touched": now}
+            record["user_id"] = key.user_id
+            self.records[storage_key] = record
+        
+        if now - record["touched"] > self.ttl and (record["state"] or record["data"]):
+            print(f"⌛ FSM: состояние {storage_key} истекло")
+            record["state"] = None
+            record["data"] = {}
+            record["touched"] = now
+            self.dirty.add(storage_key)
+        
+        record["seen"] = now
+        return record
+    
+    def _mark_dirty(self, key: StorageKey, record: Dict[str, Any]):
+        record["touched"] = time.time()
+        self.dirty.add(self.key_builder.build(key))
+        
+        if self.flush_task is None or self.flush_task.done():
+            try:
+                self.flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+            except RuntimeError:
+                pass
+    
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._record(key)
+        record["state"] = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, record)
+    
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._record(key)["state"]
+    
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._record(key)
+        record["data"] = data.copy()
+        self._mark_dirty(key, record)
+    
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._record(key)["data"].copy()
+    
+    def _write_batch(self, upserts: List[Tuple], deletes: List[Tuple]):
+        with self.db_lock:
+            if upserts:
+                self.conn.executemany(
+                    "INSERT INTO fsm (key, state, data, touched) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                    "data = excluded.data, touched = excluded.touched",
+                    upserts
+                )
+            if deletes:
+                self.conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+            self.conn.commit()
+    
+    def _delete_expired(self, deadline: float) -> int:
+        with self.db_lock:
+            cursor = self.conn.execute("DELETE FROM fsm WHERE touched < ?", (deadline,))
+            self.conn.commit()
+            return cursor.rowcount
+    
+    async def flush(self):
+        if not self.dirty:
+            return
+        
+        keys = list(self.dirty)
+        self.dirty.clear()
+        
+        upserts = []
+        deletes = []
+        for storage_key in keys:
+            record = self.records.get(storage_key)
+            if record and (record["state"] or record["data"]):
+                upserts.append((
+                    storage_key,
+                    record["state"],
+                    json.dumps(record["data"], ensure_ascii=False),
+                    record["touched"]
+                ))
+            else:
+                deletes.append((storage_key,))
+        
+        try:
+            await asyncio.to_thread(self._write_batch, upserts, deletes)
+        except asyncio.CancelledError:
+            self.dirty.update(keys)
+            raise
+        except Exception as e:
+            print(f"❌ FSM: ошибка при сбросе на диск: {e}")
+            self.dirty.update(keys)
+    
+    async def expire(self):
+        now = time.time()
+        self.last_expire = now
+        
+        idle_keys = [
+            storage_key for storage_key, record in self.records.items()
+            if storage_key not in self.dirty and now - record.get("seen", record["touched"]) > self.memory_idle
+        ]
+        for storage_key in idle_keys:
+            del self.records[storage_key]
+        
+        removed = await asyncio.to_thread(self._delete_expired, now - self.ttl)
+        
+        if idle_keys or removed:
+            print(f"🧹 FSM: выгружено из памяти {len(idle_keys)}, удалено истекших {removed}")
+    
+    def forget(self, belongs: Callable[[int], bool]) -> int:
+        """Выгружает из памяти записи пользователей, для которых belongs(user_id) истинно
+        (кроме еще не сброшенных на диск): следующее чтение возьмет их из SQLite"""
+        keys = [
+            storage_key for storage_key, record in self.records.items()
+            if storage_key not in self.dirty and belongs(record["user_id"])
+        ]
+        for storage_key in keys:
+            del self.records[storage_key]
+        return len(keys)
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self.last_expire > FSM_EXPIRE_INTERVAL:
+                    await self.expire()
+            except Exception as e:
+                print(f"⚠️ Ошибка в FSM flush loop: {e}")
+    
+    async def close(self) -> None:
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        with self.db_lock:
+            self.conn.close()
+        print("✅ FSM-хранилище закрыто")
+
+storage = SQLiteStorage(FSM_DB_FILE)
+dp = Dispatcher(storage=storage)
+
+# ============================================================================
+# КООРДИНАЦИЯ НЕСКОЛЬКИХ ПРОЦЕССОВ
+# ============================================================================
+
+class Coordinator:
+    """Координация процессов бота через общую SQLite-базу.
+    
+    Каждый раздел репетитора в любой момент принадлежит одному процессу (аренда с TTL):
+    только владелец обрабатывает апдейты этого раздела из общей очереди и запускает
+    его фоновые задачи. Если владелец перестал продлевать аренду, раздел забирает другой процесс.
+    """
+    
+    def __init__(self, db_path: Path, worker_id: str, lease_ttl: int = LEASE_TTL):
+        self.db_path = db_path
+        self.worker_id = worker_id
+        self.lease_ttl = lease_ttl
+        self.owned = set()
+        
+        self.db_lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None, timeout=10)
+        with self.db_lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, seen REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS updates ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, shard INTEGER NOT NULL, payload TEXT NOT NULL, "
+                "claimed_by TEXT, claimed_at REAL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS updates_shard ON updates (shard, id)")
+    
+    def _try_acquire(self, name: str, now: float) -> bool:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != self.worker_id and row[1] > now:
+                return False
+            self.conn.execute(
+                "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires",
+                (name, self.worker_id, now + self.lease_ttl)
+            )
+            return True
+        finally:
+            self.conn.execute("COMMIT")
+    
+    def _release(self, name: str):
+        self.conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.worker_id))
+    
+    def rebalance(self) -> Tuple[List[int], List[int]]:
+        """Продлевает свои аренды, забирает свободные разделы и отдает лишние"""
+        now = time.time()
+        acquired, released = [], []
+        
+        with self.db_lock:
+            self.conn.execute(
+                "INSERT INTO workers (worker_id, seen) VALUES (?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET seen = excluded.seen",
+                (self.worker_id, now)
+            )
+            self.conn.execute("DELETE FROM workers WHERE seen < ?", (now - self.lease_ttl,))
+            alive = self.conn.execute("SELECT COUNT(*) FROM workers").fetchone()[0] or 1
+            target = math.ceil(len(PARTITIONS) / alive)
+            
+            for tutor_id in PARTITIONS:
+                name = f"partition:{tutor_id}"
+                if tutor_id in self.owned:
+                    if not self._try_acquire(name, now):
+                        self.owned.discard(tutor_id)
+                        released.append(tutor_id)
+                elif len(self.owned) < target and self._try_acquire(name, now):
+                    self.owned.add(tutor_id)
+                    acquired.append(tutor_id)
+            
+            while len(self.owned) > target:
+                tutor_id = max(self.owned)
+                self._release(f"partition:{tutor_id}")
+                self.owned.discard(tutor_id)
+                released.append(tutor_id)
+        
+        return acquired, released
+    
+    def release_all(self):
+        with self.db_lock:
+            for tutor_id in list(self.owned):
+                self._release(f"partition:{tutor_id}")
+            self.conn.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+        self.owned.clear()
+    
+    def enqueue(self, shard: int, payload: str):
+        with self.db_lock:
+            self.conn.execute("INSERT INTO updates (shard, payload) VALUES (?, ?)", (shard, payload))
+    
+    def claim(self, limit: int = QUEUE_BATCH_SIZE) -> List[Tuple[int, int, str]]:
+        """Забирает очередные апдейты своих разделов; брошенные упавшим процессом забираются повторно"""
+        if not self.owned:
+            return []
+        
+        now = time.time()
+        shards = sorted(self.owned)
+        placeholders = ",".join("?" * len(shards))
+        
+        with self.db_lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.conn.execute(
+                    f"SELECT id, shard, payload FROM updates WHERE shard IN ({placeholders}) "
+                    f"AND (claimed_by IS NULL OR claimed_by = ? OR claimed_at < ?) ORDER BY id LIMIT ?",
+                    (*shards, self.worker_id, now - self.lease_ttl, limit)
+                ).fetchall()
+                if rows:
+                    self.conn.executemany(
+                        "UPDATE updates SET claimed_by = ?, claimed_at = ? WHERE id = ?",
+                        [(self.worker_id, now, row[0]) for row in rows]
+                    )
+            finally:
+                self.conn.execute("COMMIT")
+        
+        return rows
+    
+    def ack(self, update_ids: List[int]):
+        with self.db_lock:
+            self.conn.executemany("DELETE FROM updates WHERE id = ?", [(update_id,) for update_id in update_ids])
+
+COORDINATOR: Optional[Coordinator] = None
+
+def owned_partitions() -> List[TutorPartition]:
+    """Разделы, фоновые задачи которых выполняет этот процесс"""
+    if COORDINATOR is None:
+        return list(PARTITIONS.values())
+    return [PARTITIONS[tutor_id] for tutor_id in sorted(COORDINATOR.owned) if tutor_id in PARTITIONS]
+
+def on_partition_acquired(partition: TutorPartition):
+    """Раздел мог меняться другим процессом - перечитываем то, что держим в памяти"""
+    partition.sent_reminders = set(load_json(partition.sent_reminders_file))
+    cleanup_sent_reminders_list(partition)
+    reload_routes_if_changed()
+    STUDENT_DIRECTORY.load()
+    partition_stats(partition)
+    # Пока раздел был у другого процесса, тот мог менять FSM-состояния его пользователей
+    storage.forget(lambda user_id: get_partition(user_id).tutor_id == partition.tutor_id)
+    REQUEST_EXPIRY.restore(partition)
+
+async def coordination_task():
+    while True:
+        try:
+            acquired, released = await asyncio.to_thread(COORDINATOR.rebalance)
+            
+            for tutor_id in acquired:
+                on_partition_acquired(PARTITIONS[tutor_id])
+                print(f"👑 {WORKER_ID}: получен раздел репетитора {tutor_id}")
+            for tutor_id in released:
+                print(f"🔁 {WORKER_ID}: раздел репетитора {tutor_id} передан другому процессу")
+        except Exception as e:
+            print(f"⚠️ Ошибка в coordination_task: {e}")
+        
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+
+async def process_queued_updates(bot: Bot, updates: List[Tuple[int, Update]]):
+    try:
+        for update_id, update in updates:
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as e:
+                print(f"⚠️ Ошибка при обработке апдейта из очереди {update_id}: {e}")
+    finally:
+        await asyncio.to_thread(COORDINATOR.ack, [update_id for update_id, _ in updates])
+
+async def consume_updates(bot: Bot):
+    """Апдейты одного пользователя обрабатываются по порядку, разных - параллельно, как при polling"""
+    while True:
+        try:
+            rows = await asyncio.to_thread(COORDINATOR.claim)
+            
+            if not rows:
+                await asyncio.sleep(QUEUE_POLL_INTERVAL)
+                continue
+            
+            by_user: Dict[int, List[Tuple[int, Update]]] = {}
+            broken = []
+            for update_id, shard, payload in rows:
+                try:
+                    update = Update.model_validate(json.loads(payload), context={"bot": bot})
+                except Exception as e:
+                    print(f"⚠️ Некорректный апдейт в очереди {update_id}: {e}")
+                    broken.append(update_id)
+                    continue
+                user = getattr(update.event, "from_user", None)
+                by_user.setdefault(user.id if user else 0, []).append((update_id, update))
+            
+            if broken:
+                await asyncio.to_thread(COORDINATOR.ack, broken)
+            await asyncio.gather(*(process_queued_updates(bot, updates) for updates in by_user.values()))
+        except Exception as e:
+            print(f"⚠️ Ошибка в consume_updates: {e}")
+            await asyncio.sleep(1)
+
+# ============================================================================
+# СРОКИ ЗАЯВОК
+# ============================================================================
+
+# Хранилища, записи которых истекают; у записей листа ожидания срок есть только во время предложения
+EXPIRING_STORES = ("requests", "reschedules", "cancels", "tutor_reschedules", "waitlist")
+
+class RequestExpiry:
+    """Мин-куча сроков заявок всех разделов.
+    
+    Заявка попадает в кучу при создании (или когда файл заявок изменил другой процесс),
+    а проверяется только в момент своего срока: работа пропорциональна числу
+    истекших заявок, а не размеру таблиц. Уже обработанные заявки отсеиваются при извлечении.
+    """
+    
+    def __init__(self):
+        self.heap: List[Tuple[float, int, str, str]] = []
+        self.tracked = set()
+        self.generations: Dict[Tuple[int, str], int] = {}
+        self.parked: Dict[int, List[Tuple[float, int, str, str]]] = {}
+    
+    @staticmethod
+    def deadline(record: Record) -> Optional[float]:
+        if isinstance(record, WaitlistEntry):
+            return record.offered_until.timestamp() if record.offered_until else None
+        return record.timestamp.timestamp() + REQUEST_TTL if record.timestamp else None
+    
+    def push(self, partition: TutorPartition, store_name: str, request_id: str, record: Record):
+        deadline = self.deadline(record)
+        if deadline is None:
+            return
+        
+        entry = (deadline, partition.tutor_id, store_name, request_id)
+        if entry not in self.tracked:
+            self.tracked.add(entry)
+            heapq.heappush(self.heap, entry)
+    
+    def sync(self, partition: TutorPartition):
+        """Добавляет заявки из файлов, которые перечитались с диска"""
+        for store_name in EXPIRING_STORES:
+            store = getattr(partition, store_name)
+            records = store.load()
+            key = (partition.tutor_id, store_name)
+            
+            if self.generations.get(key) != store.generation:
+                self.generations[key] = store.generation
+                for request_id, record in records.items():
+                    self.push(partition, store_name, request_id, record)
+    
+    def pop_due(self, now_ts: float, tutor_ids: set) -> List[Tuple[float, int, str, str]]:
+        """Наступившие сроки разделов tutor_ids; сроки чужих разделов откладываются до restore"""
+        due = []
+        while self.heap and self.heap[0][0] <= now_ts:
+            entry = heapq.heappop(self.heap)
+            if entry[1] not in tutor_ids:
+                self.parked.setdefault(entry[1], []).append(entry)
+                continue
+            self.tracked.discard(entry)
+            due.append(entry)
+        return due
+    
+    def restore(self, partition: TutorPartition):
+        """Раздел вернулся к процессу: отложенные сроки снова в куче, а файлы заявок
+        при следующем sync сверяются заново"""
+        for entry in self.parked.pop(partition.tutor_id, []):
+            heapq.heappush(self.heap, entry)
+        for store_name in EXPIRING_STORES:
+            self.generations.pop((partition.tutor_id, store_name), None)
+    
+    def next_deadline(self) -> Optional[float]:
+        return self.heap[0][0] if self.heap else None
+
+REQUEST_EXPIRY = RequestExpiry()
+
+def requested_slot(store_name: str, record: Record) -> Optional[datetime]:
+    """Слот, который заявка держит до ответа (у отмены такого нет)"""
+    if store_name in ("requests", "waitlist"):
+        return record.lesson_datetime
+    if store_name in ("reschedules", "tutor_reschedules"):
+        return record.new_lesson_datetime
+    return None
+
+def track_request(partition: TutorPartition, store_name: str, request_id: str, record: Record, save: bool = True):
+    """Новая заявка: срок в куче и бронь запрошенного слота на тот же срок"""
+    REQUEST_EXPIRY.push(partition, store_name, request_id, record)
+    
+    slot = requested_slot(store_name, record)
+    deadline = RequestExpiry.deadline(record)
+    if slot and deadline:
+        hold_slot(partition, slot, record.student_id, store_name, request_id,
+                  datetime.fromtimestamp(deadline, tz=MSK_TIMEZONE), save=save)
+
+async def notify_request_expired(bot: Bot, partition: TutorPartition, store_name: str, record: Record):
+    if store_name == "requests":
+        text = (f"⌛ Ваш запрос на занятие {record.lesson_datetime.strftime('%d.%m.%Y %H:%M')} истек - "
+                f"репетитор не успел ответить.\n\nПожалуйста, выберите время заново.")
+    elif store_name == "reschedules":
+        text = (f"⌛ Ваш запрос на перенос занятия на {record.new_lesson_datetime.strftime('%d.%m.%Y %H:%M')} истек.\n\n"
+                f"Занятие остается в прежнее время.")
+    elif store_name == "cancels":
+        text = (f"⌛ Ваш запрос на отмену занятия {record.lesson_datetime.strftime('%d.%m.%Y %H:%M')} истек.\n\n"
+                f"Занятие остается в расписании.")
+    elif store_name == "waitlist":
+        text = (f"⌛ Время на ответ истекло - слот {record.lesson_datetime.strftime('%d.%m.%Y %H:%M')} "
+                f"предложен следующему ученику из листа ожидания.")
+    else:
+        text = "⌛ Просьба репетитора о переносе занятия истекла. Занятие остается в прежнее время."
+        msg_tutor = await bot.send_message(
+            partition.tutor_id,
+            f"⌛ Ученик {record.student_name} не ответил на просьбу о переносе занятия.",
+            reply_markup=persistent_menu_keyboard()
+        )
+        log_message(partition.tutor_id, msg_tutor.message_id, partition=partition)
+    
+    msg_student = await bot.send_message(record.student_id, text, reply_markup=persistent_menu_keyboard())
+    log_message(record.student_id, msg_student.message_id, partition=partition)
+
+async def expire_requests(bot: Bot, now: datetime = None) -> int:
+    now_ts = (now or datetime.now(tz=MSK_TIMEZONE)).timestamp()
+    owned = owned_partitions()
+    owned_ids = {partition.tutor_id for partition in owned}
+    
+    for partition in owned:
+        REQUEST_EXPIRY.sync(partition)
+    
+    expired = []
+    dirty = set()
+    
+    for deadline, tutor_id, store_name, request_id in REQUEST_EXPIRY.pop_due(now_ts, owned_ids):
+        partition = PARTITIONS[tutor_id]
+        records = getattr(partition, store_name).load()
+        record = records.get(request_id)
+        
+        # Заявку уже обработали или переподали
+        if record is None or RequestExpiry.deadline(record) != deadline:
+            continue
+        
+        del records[request_id]
+        dirty.add((tutor_id, store_name))
+        if release_hold(partition, requested_slot(store_name, record), request_id, save=False):
+            dirty.add((tutor_id, "holds"))
+        expired.append((partition, store_name, request_id, record))
+    
+    for tutor_id, store_name in dirty:
+        getattr(PARTITIONS[tutor_id], store_name).save()
+    
+    for partition, store_name, request_id, record in expired:
+        print(f"⌛ Заявка истекла: {request_id} ({store_name}) - {record.student_name}")
+        try:
+            await notify_request_expired(bot, partition, store_name, record)
+        except Exception as e:
+            print(f"⚠️ Не удалось уведомить об истекшей заявке {request_id}: {e}")
+        
+        # Бронь снята - слот достается следующему в листе ожидания
+        slot = requested_slot(store_name, record)
+        if slot:
+            await offer_freed_slot(bot, partition, slot)
+    
+    return len(expired)
+
+async def request_expiry_task(bot: Bot):
+    while True:
+        try:
+            await expire_requests(bot)
+        except Exception as e:
+            print(f"⚠️ Ошибка в request_expiry_task: {e}")
+        
+        next_deadline = REQUEST_EXPIRY.next_deadline()
+        delay = EXPIRY_CHECK_INTERVAL
+        if next_deadline is not None:
+            delay = min(delay, max(1.0, next_deadline - time.time()))
+        await asyncio.sleep(delay)
+
+# ============================================================================
+# ЛИСТ ОЖИДАНИЯ
+# ============================================================================
+
+def waitlist_index(partition: TutorPartition) -> Dict[str, List[str]]:
+    """Очереди листа ожидания по слотам. Индекс перестраивается, только если
+    waitlist.json перечитан с диска; удаленные записи отсеиваются при чтении очереди."""
+    entries = partition.waitlist.load()
+    
+    if partition.waitlist_generation != partition.waitlist.generation:
+        slots: Dict[str, List[str]] = {}
+        ordered = sorted(entries.items(), key=lambda item: item[1].timestamp or datetime.min.replace(tzinfo=MSK_TIMEZONE))
+        for entry_id, entry in ordered:
+            if entry.lesson_datetime:
+                slots.setdefault(slot_key(entry.lesson_datetime), []).append(entry_id)
+        partition.waitlist_slots = slots
+        partition.waitlist_generation = partition.waitlist.generation
+    
+    return partition.waitlist_slots
+
+def waitlist_queue(partition: TutorPartition, key: str) -> List[str]:
+    entries = partition.waitlist.load()
+    queue = waitlist_index(partition).get(key, [])
+    queue[:] = [entry_id for entry_id in queue if entry_id in entries]
+    return queue
+
+def join_waitlist(partition: TutorPartition, student_id: int, student_name: str, student_class: str,
+                  subject: str, lesson_datetime: datetime) -> int:
+    """Ставит ученика в очередь на слот и возвращает его позицию"""
+    entries = partition.waitlist.load()
+    key = slot_key(lesson_datetime)
+    queue = waitlist_queue(partition, key)
+    
+    for position, entry_id in enumerate(queue, 1):
+        if entries[entry_id].student_id == student_id:
+            return position
+    
+    entry_id = create_request_id()
+    entries[entry_id] = WaitlistEntry(
+        student_id=student_id,
+        student_name=student_name,
+        student_class=student_class,
+        subject=subject,
+        lesson_datetime=lesson_datetime,
+        timestamp=datetime.now(tz=MSK_TIMEZONE)
+    )
+    partition.waitlist.save()
+    queue.append(entry_id)
+    partition.waitlist_slots[key] = queue
+    
+    print(f"🔔 {student_name} в листе ожидания на {key} (позиция {len(queue)})")
+    return len(queue)
+
+def leave_waitlist(partition: TutorPartition, entry_id: str) -> Optional[WaitlistEntry]:
+    entries = partition.waitlist.load()
+    entry = entries.pop(entry_id, None)
+    if entry is None:
+        return None
+    
+    partition.waitlist.save()
+    release_hold(partition, entry.lesson_datetime, entry_id)
+    return entry
+
+def prune_waitlist(partition: TutorPartition):
+    entries = partition.waitlist.load()
+    now = datetime.now(tz=MSK_TIMEZONE)
+    past = [entry_id for entry_id, entry in entries.items() if not entry.lesson_datetime or entry.lesson_datetime <= now]
+    
+    for entry_id in past:
+        del entries[entry_id]
+    
+    if past:
+        partition.waitlist.save()
+        print(f"🧹 Удалено записей листа ожидания на прошедшие слоты: {len(past)}")
+
+async def offer_freed_slot(bot: Bot, partition: TutorPartition, slot_dt: Optional[datetime]) -> Optional[str]:
+    """Предлагает освободившийся слот первому ученику из очереди и бронирует слот на WAITLIST_OFFER_TTL"""
+    if slot_dt is None or slot_dt <= datetime.now(tz=MSK_TIMEZONE):
+        return None
+    
+    key = slot_key(slot_dt)
+    if key in get_booked_times(partition) or is_slot_held(key, get_active_holds(partition)):
+        return None
+    # День мог быть закрыт исключением расписания (например, перенос всего дня)
+    if slot_dt.strftime("%H:%M") not in compile_availability(partition).get(slot_dt.date(), []):
+        return None
+    
+    entries = partition.waitlist.load()
+    
+    for entry_id in list(waitlist_queue(partition, key)):
+        entry = entries[entry_id]
+        entry.offered_until = datetime.now(tz=MSK_TIMEZONE) + timedelta(seconds=WAITLIST_OFFER_TTL)
+        partition.waitlist.save()
+        hold_slot(partition, slot_dt, entry.student_id, "waitlist", entry_id, entry.offered_until)
+        REQUEST_EXPIRY.push(partition, "waitlist", entry_id, entry)
+        
+        kb = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Записаться", callback_data=f"waitlist_accept_{entry_id}")],
+            [InlineKeyboardButton(text="❌ Не нужно", callback_data=f"waitlist_decline_{entry_id}")]
+        ])
+        
+        try:
+            msg_student = await bot.send_message(
+                entry.student_id,
+                f"🔔 <b>Освободилось время!</b>\n\n"
+                f"📖 Предмет: {entry.subject}\n"
+                f"📅 Дата: {slot_dt.strftime('%d.%m.%Y')}\n"
+                f"⏰ Время: {slot_dt.strftime('%H:%M')}\n\n"
+                f"Слот закреплен за вами на {WAITLIST_OFFER_TTL // 60} мин. Записаться?",
+                reply_markup=kb,
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            # Ученик недоступен - слот получает следующий
+            print(f"⚠️ Не удалось предложить слот {key} ученику {entry.student_id}: {e}")
+            leave_waitlist(partition, entry_id)
+            continue
+        
+        log_message(entry.student_id, msg_student.message_id, partition=partition)
+        print(f"🔔 Слот {key} предложен ученику {entry.student_name} ({entry_id})")
+        return entry_id
+    
+    return None
+
+# ============================================================================
+# СЕРИИ ЗАНЯТИЙ
+# ============================================================================
+
+def series_window(now: datetime = None) -> Tuple[datetime, datetime]:
+    """Окно, в котором разворачиваются серии: с начала сегодняшнего дня до конца горизонта записи"""
+    now = now or datetime.now(tz=MSK_TIMEZONE)
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = get_week_dates(now)["Monday"][0].replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, end + timedelta(weeks=BOOKING_HORIZON_WEEKS)
+
+def series_occurrences(series_id: str, series: LessonSeries, start: datetime, end: datetime) -> Iterator[Tuple[str, Lesson]]:
+    """Занятия серии в [start, end) с учетом исключений; id занятия - "<серия>@<исходная дата>" """
+    if series.weekday is None or not series.time or not series.start_date:
+        return
+    
+    hour, minute = parse_time(series.time)
+    day = max(start.date(), series.start_date.date())
+    day += timedelta(days=(series.weekday - day.weekday()) % 7)
+    last = end.date() - timedelta(days=1)
+    if series.end_date:
+        last = min(last, series.end_date.date())
+    
+    while day <= last:
+        exception = series.exceptions.get(day.isoformat())
+        if exception != "skip":
+            lesson_datetime = parse_datetime(exception) if exception else None
+            if lesson_datetime is None:
+                lesson_datetime = datetime(day.year, day.month, day.day, hour, minute, tzinfo=MSK_TIMEZONE)
+            
+            # Момент окончания не входит в серию: завершенная сегодня серия не оставляет сегодняшнее занятие
+            if not series.end_date or lesson_datetime < series.end_date:
+                yield f"{series_id}@{day.isoformat()}", Lesson(
+                    student_id=series.student_id,
+                    student_name=series.student_name,
+                    student_class=series.student_class,
+                    subject=series.subject,
+                    lesson_datetime=lesson_datetime,
+                    status="confirmed",
+                    timestamp=series.timestamp,
+                    extra={"series_id": series_id}
+                )
+        day += timedelta(weeks=1)
+
+def all_lessons(partition: TutorPartition) -> Dict[str, Lesson]:
+    """Подтвержденные занятия вместе с занятиями серий в окне записи.
+    Результат кэшируется до изменения занятий или серий (или до смены дня)."""
+    lessons = partition.lessons.load()
+    series = partition.series.load()
+    start, end = series_window()
+    key = (partition.lessons.version, partition.series.version, start.date())
+    
+    cached_key, cached = partition.lessons_cache
+    if cached_key == key:
+        return cached
+    
+    merged = lessons
+    if series:
+        merged = dict(lessons)
+        for series_id, item in series.items():
+            merged.update(series_occurrences(series_id, item, start, end))
+    
+    partition.lessons_cache = (key, merged)
+    return merged
+
+def split_occurrence_id(lesson_id: str) -> Tuple[Optional[str], Optional[str]]:
+    if "@" not in lesson_id:
+        return None, None
+    series_id, _, date_str = lesson_id.partition("@")
+    return series_id, date_str
+
+def remove_lesson(partition: TutorPartition, lesson_id: str) -> Optional[datetime]:
+    """Удаляет занятие (для занятия серии - исключение skip). Возвращает освободившееся время;
+    None - занятия нет или изменение не удалось сохранить."""
+    lesson = all_lessons(partition).get(lesson_id)
+    if lesson is None:
+        return None
+    
+    series_id, date_str = split_occurrence_id(lesson_id)
+    if series_id:
+        partition.series.load()[series_id].exceptions[date_str] = "skip"
+        saved = partition.series.save()
+    else:
+        del partition.lessons.load()[lesson_id]
+        # Отмена последнего занятия законно оставляет файл пустым
+        saved = partition.lessons.save(allow_empty=True)
+    
+    return lesson.lesson_datetime if saved else None
+
+def move_lesson(partition: TutorPartition, lesson_id: str, new_datetime: datetime) -> Optional[datetime]:
+    """Переносит занятие (для занятия серии - исключение с новым временем). Возвращает прежнее время;
+    None - занятия нет или изменение не удалось сохранить."""
+    lesson = all_lessons(partition).get(lesson_id)
+    if lesson is None:
+        return None
+    
+    old_datetime = lesson.lesson_datetime
+    series_id, date_str = split_occurrence_id(lesson_id)
+    if series_id:
+        partition.series.load()[series_id].exceptions[date_str] = new_datetime.isoformat()
+        saved = partition.series.save()
+    else:
+        partition.lessons.load()[lesson_id].lesson_datetime = new_datetime
+        saved = partition.lessons.save()
+    
+    return old_datetime if saved else None
 
-def restore_cache_from_files():
-    global STUDENT_CACHE
+def create_series(partition: TutorPartition, request: PendingRequest, request_id: str = None,
+                  weeks: int = 0) -> Tuple[Optional[str], List[str]]:
+    """Серия по дню недели и времени заявки на weeks недель (0 - без даты окончания).
+    Даты окна, уже занятые другими занятиями или забронированные под чужие заявки,
+    сразу отмечаются как пропуски - они возвращаются вторым значением.
+    id серии None - серию не удалось сохранить."""
+    series_id = create_request_id()
+    first = request.lesson_datetime
+    start_date = first.replace(hour=0, minute=0, second=0, microsecond=0)
+    series = LessonSeries(
+        student_id=request.student_id,
+        student_name=request.student_name,
+        student_class=request.student_class,
+        subject=request.subject,
+        weekday=first.weekday(),
+        time=first.strftime("%H:%M"),
+        start_date=start_date,
+        end_date=start_date + timedelta(weeks=weeks) if weeks else None,
+        timestamp=datetime.now(tz=MSK_TIMEZONE)
+    )
     
-    print("🔄 Восстанавливаю STUDENT_CACHE из файлов...")
+    booked = get_booked_times(partition)
+    holds = get_active_holds(partition)
+    start, end = series_window()
+    skipped = []
+    for _, lesson in series_occurrences(series_id, series, start, end):
+        key = slot_key(lesson.lesson_datetime)
+        hold = holds.get(key)
+        if key in booked or (hold and hold.request_id != request_id and is_slot_held(key, holds)):
+            series.exceptions[lesson.lesson_datetime.date().isoformat()] = "skip"
+            skipped.append(lesson.date_str)
+    
+    partition.series.load()[series_id] = series
+    if not partition.series.save():
+        return None, skipped
+    print(f"🔁 Создана серия {series_id}: {series.student_name}, с {first.strftime('%d.%m.%Y')} еженедельно в {series.time}")
+    return series_id, skipped
+
+def end_series(partition: TutorPartition, series_id: str, now: datetime = None) -> Optional[LessonSeries]:
+    """None - серии нет или завершение не удалось сохранить"""
+    series = partition.series.load().get(series_id)
+    if series is None:
+        return None
     
-    students_data = load_json(STUDENTS_FILE)
-    for student_id_str, student_info in students_data.items():
-        try:
-            student_id = int(student_id_str)
-            if student_id != TUTOR_ID:
-                STUDENT_CACHE[student_id] = {
-                    "name": student_info.get("name", ""),
-                    "grade": student_info.get("grade", "")
-                }
-        except:
-            pass
+    series.end_date = now or datetime.now(tz=MSK_TIMEZONE)
+    if not partition.series.save():
+        return None
+    print(f"⏹ Серия {series_id} завершена")
+    return series
+
+# ============================================================================
+# СТАТИСТИКА
+# ============================================================================
+
+def stats_week_key(dt: datetime) -> str:
+    year, week, _ = dt.isocalendar()
+    return f"{year}-W{week:02d}"
+
+def rebuild_stats(partition: TutorPartition) -> Dict:
+    """Первый запуск: счетчики подтверждений собираются из занятий, архива и уже прошедших
+    занятий серий. Переносы и отмены до этого момента не учитывались - они считаются с нуля."""
+    stats = partition.stats
+    stats.reset()
+    
+    archived = (lesson for _, lesson in iter_archived_lessons(partition))
+    for lesson in list(partition.lessons.load().values()) + list(archived):
+        stats.record("confirmed", lesson.student_id, lesson.student_name, lesson.subject, lesson.lesson_datetime)
+    first = min((series.start_date for series in partition.series.load().values() if series.start_date), default=None)
+    count_due_series(partition, since=first - timedelta(days=1) if first else None)
+    
+    stats.flush()
+    print(f"📊 [{partition.tutor_id}] Статистика собрана из истории: {stats.data['totals']['confirmed']} занятий")
+    return stats.data
+
+def count_due_series(partition: TutorPartition, now: datetime = None, since: datetime = None):
+    """Занятия серий попадают в "подтверждено" по одному, когда наступает их время:
+    так каждая неделя получает свои занятия, а пропущенные не учитываются вовсе.
+    Граница уже учтенного хранится в снимке (series_counted_until)."""
+    data = partition.stats.data
+    now = now or datetime.now(tz=MSK_TIMEZONE)
+    since = since or parse_datetime(data.get("series_counted_until"))
+    if since is None:
+        # Границы еще нет (в снимках старого формата серии учтены при подтверждении) - считаем с этого момента
+        data["series_counted_until"] = now.isoformat()
+        partition.stats.dirty = True
+        return
+    if since >= now:
+        return
     
-    confirmed_data = load_json(CONFIRMED_FILE)
-    for lesson_id, lesson in confirmed_data.items():
-        student_id = lesson.get("student_id")
-        if student_id and student_id != TUTOR_ID and student_id not in STUDENT_CACHE:
-            STUDENT_CACHE[student_id] = {
-                "name": lesson.get("student_name", ""),
-                "grade": lesson.get("student_class", "")
-            }
+    # Перенесенное занятие серии может уйти от исходной даты не дальше горизонта записи
+    margin = timedelta(weeks=BOOKING_HORIZON_WEEKS)
+    for series_id, series in partition.series.load().items():
+        for _, lesson in series_occurrences(series_id, series, since - margin, now + margin):
+            if since < lesson.lesson_datetime <= now:
+                partition.stats.record("confirmed", lesson.student_id, lesson.student_name, lesson.subject, lesson.lesson_datetime)
     
-    pending_data = load_json(PENDING_FILE)
-    for req_id, req in pending_data.items():
-        student_id = req.get("student_id")
-        if student_id and student_id != TUTOR_ID and student_id not in STUDENT_CACHE:
-            STUDENT_CACHE[student_id] = {
-                "name": req.get("student_name", ""),
-                "grade": req.get("student_class", "")
-            }
+    data["series_counted_until"] = now.isoformat()
+    partition.stats.dirty = True
+
+def partition_stats(partition: TutorPartition) -> Dict:
+    return partition.stats.load() or rebuild_stats(partition)
+
+def is_series_record(record: Record) -> bool:
+    if getattr(record, "lesson_id", None):
+        return split_occurrence_id(record.lesson_id)[0] is not None
+    return bool(record.extra.get("series_id"))
+
+def record_stat(partition: TutorPartition, event: str, record: Record, lesson_dt: Optional[datetime]):
+    """Учитывает подтверждение, перенос или отмену; на диск попадет при следующем сбросе снимка.
+    Переносы и отмены занятий серий не учитываются: серия считается по прошедшим
+    занятиям (count_due_series), и доли отмен и переносов считаются только по разовым."""
+    if event != "confirmed" and is_series_record(record):
+        return
+    if partition.stats.load() is None:
+        rebuild_stats(partition)
+        # Только что подтвержденное занятие уже сохранено и попало в историю
+        if event == "confirmed":
+            return
+    partition.stats.record(event, record.student_id, record.student_name, record.subject, lesson_dt)
+
+def stat_rates(counters: Dict[str, int]) -> Dict[str, float]:
+    confirmed = counters.get("confirmed", 0)
+    return {
+        "cancel_rate": round(counters.get("cancelled", 0) / confirmed, 3) if confirmed else 0.0,
+        "reschedule_rate": round(counters.get("rescheduled", 0) / confirmed, 3) if confirmed else 0.0
+    }
+
+def recent_weeks(data: Dict, weeks: int = STATS_ROLLING_WEEKS, now: datetime = None) -> List[Tuple[str, Dict[str, int]]]:
+    """Последние недели, начиная с текущей; недели без событий - с нулями"""
+    now = now or datetime.now(tz=MSK_TIMEZONE)
+    keys = [stats_week_key(now - timedelta(weeks=i)) for i in range(weeks)]
+    return [(key, data["weeks"].get(key) or TutorStats.counters()) for key in keys]
+
+def format_stats_message(data: Dict) -> str:
+    totals = data["totals"]
+    rates = stat_rates(totals)
+    
+    text = (
+        f"📊 Статистика\n\n"
+        f"✅ Подтверждено: {totals['confirmed']}\n"
+        f"📍 Переносов: {totals['rescheduled']} ({rates['reschedule_rate']:.0%})\n"
+        f"❌ Отмен: {totals['cancelled']} ({rates['cancel_rate']:.0%})\n"
+        f"👥 Учеников: {len(data['students'])}\n\n"
+        f"📖 По предметам:\n"
+    )
+    for subject, counters in data["subjects"].items():
+        text += f"• {subject}: {counters['confirmed']} (отмен {counters['cancelled']}, переносов {counters['rescheduled']})\n"
+    
+    text += "\n📅 По неделям:\n"
+    for key, counters in recent_weeks(data):
+        text += f"• {key}: {counters['confirmed']} (отмен {counters['cancelled']}, переносов {counters['rescheduled']})\n"
     
-    print(f"✅ STUDENT_CACHE восстановлен: {len(STUDENT_CACHE)} записей")
+    return text
+
+async def stats_flush_task():
+    while True:
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+        owned = {partition.tutor_id for partition in owned_partitions()}
+        for partition in PARTITIONS.values():
+            try:
+                # Прошедшие занятия серий считает только владелец раздела, иначе они учтутся дважды
+                if partition.tutor_id in owned:
+                    partition_stats(partition)
+                    count_due_series(partition)
+                partition.stats.flush()
+            except Exception as e:
+                print(f"⚠️ Ошибка сохранения статистики [{partition.tutor_id}]: {e}")
+        try:
+            STUDENT_DIRECTORY.flush()
+        except Exception as e:
+            print(f"⚠️ Ошибка сохранения справочника учеников: {e}")
 
 # ============================================================================
 # ФУНКЦИИ ОТПРАВКИ СООБЩЕНИЙ
 # ============================================================================
 
+async def send_partition_reminders(bot: Bot, partition: TutorPartition, now: datetime):
+    confirmed = all_lessons(partition)
+    
+    for lesson_id, lesson in list(confirmed.items()):
+        try:
+            lesson_time = lesson.lesson_datetime
+            if lesson_time is None:
+                continue
+            
+            time_diff = (lesson_time - now).total_seconds()
+            
+            if 3480 <= time_diff <= 3720:
+                reminder_key = f"{lesson_id}:{lesson_time.isoformat()}"
+                lesson_time_str = lesson_time.strftime('%H:%M')
+                # Ученик и репетитор отмечаются по отдельности (ключ репетитора - с @tutor),
+                # чтобы сбой одной отправки не повторял другую
+                recipients = [
+                    (reminder_key, lesson.student_id,
+                     f"⏰ Напоминание о занятии!\n\n"
+                     f"Предмет: {lesson.subject}\n"
+                     f"Время: {lesson_time_str}\n\n"
+                     f"Занятие начинается через 1 час! 📚"),
+                    (f"{lesson_id}@tutor:{lesson_time.isoformat()}", partition.tutor_id,
+                     f"⏰ Напоминание о занятии!\n\n"
+                     f"Ученик: {lesson.student_name}\n"
+                     f"Предмет: {lesson.subject}\n"
+                     f"Время: {lesson_time_str}\n\n"
+                     f"Занятие начинается через 1 час! 📚")
+                ]
+                
+                pending = [item for item in recipients if item[0] not in partition.sent_reminders]
+                if not pending:
+                    print(f"⏭️ Напоминание для {lesson_id} уже отправлено, пропускаем")
+                    continue
+                
+                print(f"📤 Отправляю напоминание для занятия {lesson_id}")
+                for key, chat_id, text in pending:
+                    try:
+                        msg = await bot.send_message(
+                            chat_id, text, parse_mode="HTML", reply_markup=persistent_menu_keyboard()
+                        )
+                        log_message(chat_id, msg.message_id, partition=partition)
+                    except TelegramRetryAfter as e:
+                        # 429 - сообщение точно не ушло, повторим на следующем тике
+                        print(f"⏳ Напоминание в чат {chat_id} отложено на {e.retry_after} с")
+                        SEND_PACER.pause(e.retry_after)
+                        continue
+                    except Exception as e:
+                        # После таймаута сообщение могло дойти, а заблокировавшему бота не дойдет
+                        # и при повторе - такое напоминание не повторяем
+                        print(f"⚠️ Напоминание в чат {chat_id} не подтверждено: {e}")
+                    
+                    partition.sent_reminders.add(key)
+                    save_json(partition.sent_reminders_file, {key: True for key in partition.sent_reminders})
+                print(f"✅ Напоминание отправлено и запомнено")
+        
+        except Exception as e:
+            print(f"⚠️ Ошибка при обработке напоминания {lesson_id}: {e}")
+
 async def send_reminders(bot: Bot):
     await asyncio.sleep(15)
+    last_cleanup = time.monotonic()
     
     while True:
         try:
             now = datetime.now(tz=MSK_TIMEZONE)
-            confirmed = load_json(CONFIRMED_FILE)
             
-            for lesson_id, lesson in confirmed.items():
-                try:
-                    lesson_time = datetime.fromisoformat(lesson.get('lesson_datetime', ''))
-                    
-                    if lesson_time.tzinfo is None:
-                        lesson_time = lesson_time.replace(tzinfo=MSK_TIMEZONE)
-                    
-                    time_diff = (lesson_time - now).total_seconds()
-                    
-                    if 3480 <= time_diff <= 3720:
-                        reminder_key = f"{lesson_id}:{lesson_time.isoformat()}"
-                        
-                        if reminder_key not in SENT_REMINDERS:
-                            student_id = lesson.get('student_id')
-                            student_name = lesson.get('student_name')
-                            subject = lesson.get('subject')
-                            lesson_time_str = lesson_time.strftime('%H:%M')
-                            
-                            print(f"📤 Отправляю напоминание для занятия {lesson_id}")
-                            
-                            msg_student = await bot.send_message(
-                                student_id,
-                                f"⏰ Напоминание о занятии!\n\n"
-                                f"Предмет: {subject}\n"
-                                f"Время: {lesson_time_str}\n\n"
-                                f"Занятие начинается через 1 час! 📚",
-                                parse_mode="HTML",
-                                reply_markup=persistent_menu_keyboard()
-                            )
-                            log_message(student_id, msg_student.message_id)
-                            
-                            msg_tutor = await bot.send_message(
-                                TUTOR_ID,
-                                f"⏰ Напоминание о занятии!\n\n"
-                                f"Ученик: {student_name}\n"
-                                f"Предмет: {subject}\n"
-                                f"Время: {lesson_time_str}\n\n"
-                                f"Занятие начинается через 1 час! 📚",
-                                parse_mode="HTML",
-                                reply_markup=persistent_menu_keyboard()
-                            )
-                            log_message(TUTOR_ID, msg_tutor.message_id)
-                            
-                            SENT_REMINDERS.add(reminder_key)
-                            print(f"✅ Напоминание отправлено и запомнено")
-                        else:
-                            print(f"⏭️ Напоминание для {lesson_id} уже отправлено, пропускаем")
-                
-                except Exception as e:
-                    print(f"⚠️ Ошибка при обработке напоминания {lesson_id}: {e}")
+            for partition in owned_partitions():
+                await send_partition_reminders(bot, partition, now)
             
             await asyncio.sleep(60)
             
-            if int(now.timestamp()) % 600 == 0:
-                cleanup_sent_reminders_list()
+            if time.monotonic() - last_cleanup >= REMINDER_CLEANUP_INTERVAL:
+                last_cleanup = time.monotonic()
+                for partition in owned_partitions():
+                    cleanup_sent_reminders_list(partition)
         
         except Exception as e:
             print(f"⚠️ Ошибка в send_reminders: {e}")
             await asyncio.sleep(60)
 
+async def send_partition_daily_schedule(bot: Bot, partition: TutorPartition, now: datetime):
+    today_date = now.date()
+    today_lessons = [
+        lesson for lesson in all_lessons(partition).values()
+        if lesson.lesson_datetime and lesson.lesson_datetime.date() == today_date
+    ]
+    today_lessons.sort(key=lambda lesson: lesson.lesson_datetime)
+    
+    weekday_names = {
+        0: "Понедельник",
+        1: "Вторник",
+        2: "Среда",
+        3: "Четверг",
+        4: "Пятница",
+        5: "Суббота",
+        6: "Воскресенье"
+    }
+    
+    day_name = weekday_names.get(now.weekday(), "")
+    
+    if today_lessons:
+        message = f"📚 <b>Расписание на сегодня</b>\n\n{day_name}, {now.strftime('%d.%m.%Y')}\n\n"
+        
+        for lesson in today_lessons:
+            time_str = lesson.time
+            student_name = lesson.student_name or "Неизвестный ученик"
+            student_class = lesson.student_class or ""
+            subject = lesson.subject or "Неизвестный предмет"
+            
+            message += f"🕐 {time_str} - {student_name}, {student_class}, {subject}\n"
+    else:
+        message = f"📭 На сегодня ({day_name}) нет занятий"
+    
+    msg = await bot.send_message(
+        partition.tutor_id,
+        message,
+        parse_mode="HTML",
+        reply_markup=persistent_menu_keyboard()
+    )
+    log_message(partition.tutor_id, msg.message_id, partition=partition)
+
 async def send_daily_schedule(bot: Bot):
     await asyncio.sleep(120)
     
@@ -279,56 +1998,11 @@ async def send_daily_schedule(bot: Bot):
             if now.hour == 8 and 0 <= now.minute < 5:
                 print(f"📅 Отправляю расписание на сегодня в {now.strftime('%H:%M:%S')}")
                 
-                all_lessons = load_json(CONFIRMED_FILE)
-                today_date = now.date()
-                today_lessons = []
-                
-                for lesson_id, lesson in all_lessons.items():
+                for partition in owned_partitions():
                     try:
-                        lesson_datetime = datetime.fromisoformat(lesson.get("lesson_datetime", ""))
-                        
-                        if lesson_datetime.tzinfo is None:
-                            lesson_datetime = lesson_datetime.replace(tzinfo=MSK_TIMEZONE)
-                        
-                        if lesson_datetime.date() == today_date:
-                            today_lessons.append((lesson_datetime, lesson))
+                        await send_partition_daily_schedule(bot, partition, now)
                     except Exception as e:
-                        print(f"⚠️ Ошибка при обработке занятия {lesson_id}: {e}")
-                
-                today_lessons.sort(key=lambda x: x[0])
-                
-                weekday_names = {
-                    0: "Понедельник",
-                    1: "Вторник",
-                    2: "Среда",
-                    3: "Четверг",
-                    4: "Пятница",
-                    5: "Суббота",
-                    6: "Воскресенье"
-                }
-                
-                day_name = weekday_names.get(now.weekday(), "")
-                
-                if today_lessons:
-                    message = f"📚 <b>Расписание на сегодня</b>\n\n{day_name}, {now.strftime('%d.%m.%Y')}\n\n"
-                    
-                    for lesson_datetime, lesson in today_lessons:
-                        time_str = lesson_datetime.strftime("%H:%M")
-                        student_name = lesson.get("student_name", "Неизвестный ученик")
-                        student_class = lesson.get("student_class", "")
-                        subject = lesson.get("subject", "Неизвестный предмет")
-                        
-                        message += f"🕐 {time_str} - {student_name}, {student_class}, {subject}\n"
-                else:
-                    message = f"📭 На сегодня ({day_name}) нет занятий"
-                
-                msg = await bot.send_message(
-                    TUTOR_ID,
-                    message,
-                    parse_mode="HTML",
-                    reply_markup=persistent_menu_keyboard()
-                )
-                log_message(TUTOR_ID, msg.message_id)
+                        print(f"⚠️ Ошибка при отправке расписания репетитору {partition.tutor_id}: {e}")
                 
                 print(f"✅ Расписание отправлено успешно")
                 await asyncio.sleep(3600)
@@ -345,73 +2019,124 @@ async def cleanup_task(bot: Bot):
     while True:
         try:
             print(f"🧹 Запускаю очистку старых запросов [{datetime.now().strftime('%H:%M:%S')}]")
-            cleanup_stale_requests()
+            # Истекшие заявки снимает request_expiry_task, здесь остается только архив
+            for partition in owned_partitions():
+                archive_old_lessons(partition)
+                prune_expired_holds(partition)
+                prune_waitlist(partition)
             print(f"✅ Очистка завершена")
             await asyncio.sleep(3600)
         except Exception as e:
             print(f"⚠️ Ошибка в cleanup_task: {e}")
             await asyncio.sleep(60)
 
-def log_message(chat_id: int, message_id: int, message_type: str = "bot"):
-    message_log = load_json(MESSAGE_LOG_FILE)
+def log_message(chat_id: int, message_id: int, message_type: str = "bot", partition: TutorPartition = None,
+                save: bool = True):
+    if partition is None:
+        partition = get_partition(chat_id)
+    
+    message_log = partition.message_log.load()
     
     message_key = f"{chat_id}_{message_id}"
-    message_log[message_key] = {
-        "chat_id": chat_id,
-        "message_id": message_id,
-        "type": message_type,
-        "timestamp": datetime.now(tz=MSK_TIMEZONE).isoformat()
-    }
+    message_log[message_key] = LoggedMessage(
+        chat_id=chat_id,
+        message_id=message_id,
+        type=message_type,
+        timestamp=datetime.now(tz=MSK_TIMEZONE)
+    )
     
-    save_json(MESSAGE_LOG_FILE, message_log)
+    if save:
+        partition.message_log.save()
     print(f"📝 Записано сообщение {message_id} для чата {chat_id}")
 
+class SendPacer:
+    """Общий темп массовых рассылок: каждая отправка занимает свой интервал 1/SEND_RATE"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_at = 0.0
+    
+    async def wait(self):
+        now = time.monotonic()
+        start = max(now, self.next_at)
+        self.next_at = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+    
+    def pause(self, seconds: float):
+        self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+SEND_PACER = SendPacer(SEND_RATE)
+
+async def send_batch(bot: Bot, partition: TutorPartition,
+                     messages: List[Tuple[int, str, Optional[InlineKeyboardMarkup]]]) -> Tuple[int, int]:
+    """Массовая отправка: не больше NOTIFY_CONCURRENCY сообщений одновременно и SEND_RATE в секунду;
+    на 429 ждем retry_after и повторяем. Лог сообщений сохраняется один раз в конце."""
+    semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+    
+    async def send(chat_id: int, text: str, reply_markup) -> bool:
+        async with semaphore:
+            for attempt in range(SEND_RETRIES):
+                await SEND_PACER.wait()
+                try:
+                    msg = await bot.send_message(chat_id, text, reply_markup=reply_markup)
+                    log_message(chat_id, msg.message_id, partition=partition, save=False)
+                    return True
+                except TelegramRetryAfter as e:
+                    print(f"⏳ Telegram просит подождать {e.retry_after} с (чат {chat_id})")
+                    SEND_PACER.pause(e.retry_after)
+                except Exception as e:
+                    print(f"⚠️ Ошибка при отправке в чат {chat_id}: {e}")
+                    return False
+            return False
+    
+    results = await asyncio.gather(*(send(*message) for message in messages))
+    if any(results):
+        partition.message_log.save()
+    return sum(results), len(results) - sum(results)
+
+async def delete_partition_messages(bot: Bot, partition: TutorPartition, now: datetime):
+    message_log = partition.message_log.load()
+    
+    if not message_log:
+        return
+    
+    deleted_count = 0
+    messages_to_delete = [
+        (message_key, message_info) for message_key, message_info in message_log.items()
+        if message_info.timestamp and (now - message_info.timestamp).total_seconds() > 86400
+    ]
+    
+    for message_key, message_info in messages_to_delete:
+        try:
+            chat_id = message_info.chat_id
+            message_id = message_info.message_id
+            
+            if chat_id and message_id:
+                await bot.delete_message(chat_id=chat_id, message_id=message_id)
+                print(f"🗑️ Удалено сообщение {message_id} из чата {chat_id}")
+                deleted_count += 1
+            
+            del message_log[message_key]
+        
+        except Exception as e:
+            print(f"⚠️ Не удалось удалить сообщение {message_key}: {e}")
+            if message_key in message_log:
+                del message_log[message_key]
+    
+    if messages_to_delete:
+        partition.message_log.save()
+        print(f"✅ Удалено {deleted_count} старых сообщений ({partition.tutor_id})")
+
 async def delete_old_messages(bot: Bot):
     await asyncio.sleep(600)
     
     while True:
         try:
             now = datetime.now(tz=MSK_TIMEZONE)
-            message_log = load_json(MESSAGE_LOG_FILE)
-            
-            if not message_log:
-                await asyncio.sleep(3600)
-                continue
-            
-            deleted_count = 0
-            messages_to_delete = []
-            
-            for message_key, message_info in message_log.items():
-                try:
-                    msg_time = datetime.fromisoformat(message_info.get("timestamp", ""))
-                    if msg_time.tzinfo is None:
-                        msg_time = msg_time.replace(tzinfo=MSK_TIMEZONE)
-                    
-                    if (now - msg_time).total_seconds() > 86400:
-                        messages_to_delete.append((message_key, message_info))
-                except Exception as e:
-                    print(f"⚠️ Ошибка при обработке сообщения {message_key}: {e}")
-            
-            for message_key, message_info in messages_to_delete:
-                try:
-                    chat_id = message_info.get("chat_id")
-                    message_id = message_info.get("message_id")
-                    
-                    if chat_id and message_id:
-                        await bot.delete_message(chat_id=chat_id, message_id=message_id)
-                        print(f"🗑️ Удалено сообщение {message_id} из чата {chat_id}")
-                        deleted_count += 1
-                    
-                    del message_log[message_key]
-                
-                except Exception as e:
-                    print(f"⚠️ Не удалось удалить сообщение {message_key}: {e}")
-                    if message_key in message_log:
-                        del message_log[message_key]
             
-            if messages_to_delete:
-                save_json(MESSAGE_LOG_FILE, message_log)
-                print(f"✅ Удалено {deleted_count} старых сообщений")
+            for partition in owned_partitions():
+                await delete_partition_messages(bot, partition, now)
             
             await asyncio.sleep(3600)
         
@@ -447,6 +2172,9 @@ class InteractiveScheduleStates(StatesGroup):
     choosing_day = State()
     waiting_for_start_time = State()
 
+class ScheduleRulesStates(StatesGroup):
+    waiting_for_rule = State()
+
 class TutorRescheduleStates(StatesGroup):
     choosing_lesson = State()
     waiting_for_new_time = State()
@@ -467,7 +2195,7 @@ def main_menu_keyboard(user_id: int):
         [InlineKeyboardButton(text="📚 Мое расписание", callback_data="my_schedule")]
     ])
     
-    if user_id == TUTOR_ID:
+    if is_tutor(user_id):
         kb.inline_keyboard.append(
             [InlineKeyboardButton(text="🛠 Изменить расписание", callback_data="edit_schedule")]
         )
@@ -477,9 +2205,32 @@ def main_menu_keyboard(user_id: int):
         kb.inline_keyboard.append(
             [InlineKeyboardButton(text="📢 Уведомить всех", callback_data="broadcast_message")]
         )
+        kb.inline_keyboard.append(
+            [InlineKeyboardButton(text="🔁 Еженедельные занятия", callback_data="series_list")]
+        )
+        kb.inline_keyboard.append(
+            [InlineKeyboardButton(text="📥 Заявки списком", callback_data="pending_list")]
+        )
+        kb.inline_keyboard.append(
+            [InlineKeyboardButton(text="📊 Статистика", callback_data="tutor_stats")]
+        )
+    elif len(PARTITIONS) > 1:
+        kb.inline_keyboard.append(
+            [InlineKeyboardButton(text=f"👩‍🏫 Репетитор: {get_partition(user_id).name}", callback_data="choose_tutor")]
+        )
     
     return kb
 
+def tutors_keyboard():
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=partition.name, callback_data=f"choose_tutor_{partition.tutor_id}")]
+        for partition in PARTITIONS.values()
+    ])
+    kb.inline_keyboard.append([
+        InlineKeyboardButton(text="⬅️ Вернуться в меню", callback_data="back_to_menu")
+    ])
+    return kb
+
 def persistent_menu_keyboard():
     return ReplyKeyboardMarkup(keyboard=[
         [KeyboardButton(text="☰ Меню")]
@@ -493,6 +2244,7 @@ def subjects_keyboard_single():
 def tutor_confirm_keyboard(request_id: str):
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"confirm_{request_id}")],
+        [InlineKeyboardButton(text="🔁 Подтвердить еженедельно", callback_data=f"series_confirm_{request_id}")],
         [InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{request_id}")]
     ])
 
@@ -516,9 +2268,9 @@ def lessons_list_keyboard(lessons: Dict, action_type: str = "reschedule"):
     kb = InlineKeyboardMarkup(inline_keyboard=[])
     
     for lesson_id, lesson in lessons.items():
-        student_name = lesson.get("student_name", "Неизвестный")
-        date_str = lesson.get("date_str", "??.??.????")
-        time_str = lesson.get("time", "??:??")
+        student_name = lesson.student_name or "Неизвестный"
+        date_str = lesson.date_str or "??.??.????"
+        time_str = lesson.time or "??:??"
         btn_text = f"{student_name} - {date_str} {time_str}"
         callback = f"{action_type}_{lesson_id}"
         kb.inline_keyboard.append([
@@ -535,61 +2287,143 @@ def lessons_list_keyboard(lessons: Dict, action_type: str = "reschedule"):
 # ФУНКЦИИ УПРАВЛЕНИЯ ДАННЫМИ
 # ============================================================================
 
-def cache_student_info(student_id: int, name: str, grade: str):
-    STUDENT_CACHE[student_id] = {"name": name, "grade": grade}
+class StudentDirectory:
+    """Единый справочник учеников: основной индекс по id и вторичный по имени.
+    
+    Собирается один раз из students.json, confirmed_lessons.json и pending_requests.json
+    всех репетиторов, дальше пополняется через cache_student_info (подтверждение занятия,
+    ввод имени и класса). students.json дописывается не на каждое изменение, а раз в
+    STATS_FLUSH_INTERVAL и при остановке - потерянные при сбое имена восстановятся
+    из заявок и занятий при следующей загрузке.
+    Списки рассылки ведутся отдельно для каждого репетитора.
+    """
+    
+    def __init__(self):
+        self.by_id: Dict[int, Student] = {}
+        self.by_name: Dict[str, set] = {}
+        self.recipients: Dict[int, Dict[int, Student]] = {}
+        self.stored: Dict[str, Student] = {}
+        self.loaded = False
+        self.dirty = False
+    
+    @staticmethod
+    def name_key(name: str) -> str:
+        return " ".join(name.lower().split())
+    
+    def _index(self, student_id: int, name: str, grade: str):
+        old = self.by_id.get(student_id)
+        if old:
+            ids = self.by_name.get(self.name_key(old.name))
+            if ids:
+                ids.discard(student_id)
+                if not ids:
+                    del self.by_name[self.name_key(old.name)]
+        
+        student = Student(name or "", grade or "")
+        self.by_id[student_id] = student
+        self.by_name.setdefault(self.name_key(student.name), set()).add(student_id)
+        tutor_id = get_partition(student_id).tutor_id
+        self.recipients.setdefault(tutor_id, {})[student_id] = student
+    
+    def reroute(self, student_id: int):
+        for recipients in self.recipients.values():
+            recipients.pop(student_id, None)
+        
+        info = self.by_id.get(student_id)
+        if info:
+            self._index(student_id, info.name, info.grade)
+    
+    def load(self):
+        self.flush()
+        self.by_id.clear()
+        self.by_name.clear()
+        self.recipients.clear()
+        
+        self.stored = {
+            key: Student.from_dict(value) for key, value in load_json(STUDENTS_FILE).items() if isinstance(value, dict)
+        }
+        for student_id_str, student_info in self.stored.items():
+            try:
+                student_id = int(student_id_str)
+            except (TypeError, ValueError):
+                continue
+            if not is_tutor(student_id):
+                self._index(student_id, student_info.name, student_info.grade)
+        
+        for partition in PARTITIONS.values():
+            for store in [partition.lessons, partition.requests]:
+                for record in store.load().values():
+                    self.observe(record)
+        
+        self.loaded = True
+    
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+    
+    def observe(self, record: Record):
+        """Добавляет ученика из заявки или занятия, если он еще не известен"""
+        student_id = record.student_id
+        if not student_id or is_tutor(student_id) or student_id in self.by_id:
+            return
+        self._index(student_id, record.student_name, record.student_class)
+    
+    def put(self, student_id: int, name: str, grade: str) -> bool:
+        """Записывает данные ученика; возвращает True, если что-то изменилось"""
+        self.ensure_loaded()
+        
+        if is_tutor(student_id):
+            return False
+        
+        stored = self.stored.get(str(student_id))
+        if stored and stored.name == name and stored.grade == grade:
+            return False
+        
+        self._index(student_id, name, grade)
+        self.stored[str(student_id)] = Student(name, grade, dict(stored.extra) if stored else {})
+        self.dirty = True
+        return True
+    
+    def flush(self):
+        if self.dirty and save_json(STUDENTS_FILE, {key: student.to_dict() for key, student in self.stored.items()}):
+            self.dirty = False
     
-    students = load_json(STUDENTS_FILE)
-    students[str(student_id)] = {"name": name, "grade": grade}
-    save_json(STUDENTS_FILE, students)
+    def get(self, student_id: int) -> Optional[Student]:
+        self.ensure_loaded()
+        return self.by_id.get(student_id)
     
-    print(f"✅ Кешировано и сохранено: {name} ({grade}) - ID: {student_id}")
+    def find_by_name(self, name: str) -> List[int]:
+        self.ensure_loaded()
+        return sorted(self.by_name.get(self.name_key(name), ()))
+    
+    def all_recipients(self, tutor_id: int) -> Dict[int, Student]:
+        self.ensure_loaded()
+        return dict(self.recipients.get(tutor_id, {}))
 
-def get_student_info_from_any_source(student_id: int) -> Optional[Dict]:
-    if student_id in STUDENT_CACHE:
-        info = STUDENT_CACHE[student_id]
-        print(f"✅ Найдено в памяти: {info['name']} ({info['grade']}) - ID: {student_id}")
-        return info
+STUDENT_DIRECTORY = StudentDirectory()
+
+def cache_student_info(student_id: int, name: str, grade: str):
+    if STUDENT_DIRECTORY.put(student_id, name, grade):
+        print(f"✅ Кешировано: {name} ({grade}) - ID: {student_id}")
+
+def get_student_info_from_any_source(student_id: int) -> Optional[Student]:
+    info = STUDENT_DIRECTORY.get(student_id)
     
-    students = load_json(STUDENTS_FILE)
-    if str(student_id) in students:
-        info = students[str(student_id)]
-        STUDENT_CACHE[student_id] = info
-        print(f"✅ Найдено в students.json: {info['name']} ({info['grade']}) - ID: {student_id}")
+    if info:
+        print(f"✅ Найдено в справочнике: {info.name} ({info.grade}) - ID: {student_id}")
         return info
     
-    confirmed = load_json(CONFIRMED_FILE)
-    for lesson_id, lesson in confirmed.items():
-        if lesson.get("student_id") == student_id:
-            name = lesson.get("student_name", "")
-            grade = lesson.get("student_class", "")
-            if name and grade:
-                info = {"name": name, "grade": grade}
-                cache_student_info(student_id, name, grade)
-                print(f"✅ Восстановлено из confirmed lessons: {name} ({grade}) - ID: {student_id}")
-                return info
-    
-    pending = load_json(PENDING_FILE)
-    for req_id, req in pending.items():
-        if req.get("student_id") == student_id:
-            name = req.get("student_name", "")
-            grade = req.get("student_class", "")
-            if name and grade:
-                info = {"name": name, "grade": grade}
-                cache_student_info(student_id, name, grade)
-                print(f"✅ Восстановлено из pending requests: {name} ({grade}) - ID: {student_id}")
-                return info
-    
     print(f"❌ Информация ученика не найдена: ID: {student_id}")
     return None
 
-def get_student_info(student_id: int) -> Optional[Dict]:
+def get_student_info(student_id: int) -> Optional[Student]:
     return get_student_info_from_any_source(student_id)
 
 # ============================================================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ============================================================================
 
-def get_week_dates(start_date: datetime = None) -> Dict:
+def get_week_dates(start_date: datetime = None, week_offset: int = 0) -> Dict:
     if start_date is None:
         start_date = datetime.now(tz=MSK_TIMEZONE)
     
@@ -604,6 +2438,8 @@ def get_week_dates(start_date: datetime = None) -> Dict:
         days_back = current_weekday
         week_start = start_date - timedelta(days=days_back)
     
+    week_start += timedelta(weeks=week_offset)
+    
     days_map = {0: "Monday", 1: "Tuesday", 2: "Wednesday",
                 3: "Thursday", 4: "Friday", 5: "Saturday"}
     
@@ -625,31 +2461,98 @@ def get_week_dates(start_date: datetime = None) -> Dict:
     
     return week
 
-def get_booked_times() -> Dict[str, bool]:
-    booked: Dict[str, bool] = {}
+def day_token(day_name: str, week_offset: int = 0) -> str:
+    """День в callback_data: "Monday" для текущей недели, "Monday+2" - через две недели"""
+    return day_name if week_offset == 0 else f"{day_name}+{week_offset}"
+
+def parse_day_token(token: str) -> Tuple[str, int]:
+    day_name, _, offset = token.partition("+")
+    try:
+        return day_name, int(offset or 0)
+    except ValueError:
+        return day_name, -1
+
+def week_dates_for(token: str) -> Tuple[str, Dict]:
+    """День недели и даты его недели; вне горизонта записи даты пустые"""
+    day_name, week_offset = parse_day_token(token)
+    if not 0 <= week_offset < BOOKING_HORIZON_WEEKS:
+        return day_name, {}
+    return day_name, get_week_dates(week_offset=week_offset)
+
+def get_booked_times(partition: TutorPartition) -> Dict[str, bool]:
+    """Занятые слоты; пересчитываются, только когда меняются занятия или серии"""
+    lessons = all_lessons(partition)
+    version, booked = partition.booked_cache
+    if version == partition.lessons_cache[0]:
+        return booked
+    
+    booked = {}
+    for lesson in lessons.values():
+        if lesson.lesson_datetime:
+            booked[lesson.lesson_datetime.strftime("%Y-%m-%d_%H:%M")] = True
+    
+    partition.booked_cache = (partition.lessons_cache[0], booked)
+    return booked
+
+def is_slot_booked(partition: TutorPartition, dt: Optional[datetime]) -> bool:
+    """Повторная проверка перед записью занятия: пока заявка ждала ответа,
+    слот могло занять другое занятие"""
+    return dt is not None and slot_key(dt) in get_booked_times(partition)
+
+def slot_key(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d_%H:%M")
+
+def get_active_holds(partition: TutorPartition) -> Dict[str, SlotHold]:
+    """Таблица броней слотов; истекшие брони просто не учитываются (см. is_slot_held)"""
+    return partition.holds.load()
+
+def is_slot_held(key: str, holds: Dict[str, SlotHold], now: datetime = None) -> bool:
+    hold = holds.get(key)
+    if hold is None or hold.expires_at is None:
+        return False
+    return hold.expires_at > (now or datetime.now(tz=MSK_TIMEZONE))
+
+def hold_slot(partition: TutorPartition, dt: datetime, student_id: int, kind: str, request_id: str,
+              expires_at: datetime, save: bool = True):
+    holds = partition.holds.load()
+    holds[slot_key(dt)] = SlotHold(student_id=student_id, kind=kind, request_id=request_id, expires_at=expires_at)
+    if save:
+        partition.holds.save()
+    print(f"🔒 Слот {slot_key(dt)} забронирован под заявку {request_id}")
+
+def release_hold(partition: TutorPartition, dt: Optional[datetime], request_id: str, save: bool = True) -> bool:
+    """Снимает бронь, только если она все еще принадлежит этой заявке"""
+    if dt is None:
+        return False
+    
+    holds = partition.holds.load()
+    key = slot_key(dt)
+    hold = holds.get(key)
+    if hold is None or hold.request_id != request_id:
+        return False
+    
+    del holds[key]
+    if save:
+        partition.holds.save()
+    print(f"🔓 Бронь слота {key} снята ({request_id})")
+    return True
+
+def prune_expired_holds(partition: TutorPartition):
+    holds = partition.holds.load()
+    now = datetime.now(tz=MSK_TIMEZONE)
+    expired = [key for key in holds if not is_slot_held(key, holds, now)]
     
-    confirmed = load_json(CONFIRMED_FILE)
-    for lesson_id, lesson in confirmed.items():
-        try:
-            lesson_datetime = datetime.fromisoformat(lesson.get("lesson_datetime", ""))
-            
-            if lesson_datetime.tzinfo is None:
-                lesson_datetime = lesson_datetime.replace(tzinfo=MSK_TIMEZONE)
-            
-            lesson_time = lesson_datetime.strftime("%H:%M")
-            date_str = lesson_datetime.strftime("%Y-%m-%d")
-            
-            key = f"{date_str}_{lesson_time}"
-            booked[key] = True
-        
-        except Exception as e:
-            print(f"⚠️ Ошибка при обработке confirmed lesson {lesson_id}: {e}")
-            continue
+    for key in expired:
+        del holds[key]
     
-    return booked
+    if expired:
+        partition.holds.save()
+        print(f"🧹 Удалено истекших броней: {len(expired)}")
 
-def is_time_slot_booked(day_name: str, time_str: str) -> bool:
-    week = get_week_dates()
+def is_time_slot_booked(partition: TutorPartition, day_name: str, time_str: str, booked: Dict[str, bool] = None,
+                        holds: Dict[str, SlotHold] = None) -> bool:
+    """Слот занят подтвержденным занятием или забронирован заявкой, ждущей ответа"""
+    day_name, week = week_dates_for(day_name)
     
     if day_name not in week:
         return True
@@ -658,23 +2561,128 @@ def is_time_slot_booked(day_name: str, time_str: str) -> bool:
     date_str = date_obj.strftime("%Y-%m-%d")
     
     key = f"{date_str}_{time_str}"
-    booked = get_booked_times()
+    if booked is None:
+        booked = get_booked_times(partition)
+    if holds is None:
+        holds = get_active_holds(partition)
+    
+    if time_str not in compile_availability(partition).get(date_obj.date(), []):
+        return True
     
-    return key in booked
+    return key in booked or is_slot_held(key, holds)
+
+def file_version(path: Path):
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
 
-def get_available_times(day_name: str, schedule: Dict) -> List[str]:
-    all_times = schedule.get(day_name, [])
+def schedule_version(partition: TutorPartition):
+    return file_version(partition.schedule_file)
+
+def load_schedule_rules(partition: TutorPartition) -> Dict:
+    """Исключения расписания: overrides {"YYYY-MM-DD": [времена] или "нет"}, holidays {"начало": "конец"}"""
+    rules = load_json(partition.schedule_rules_file)
+    rules.setdefault("overrides", {})
+    rules.setdefault("holidays", {})
+    return rules
+
+def compile_availability(partition: TutorPartition, schedule: Dict = None) -> Dict[date, List[str]]:
+    """Таблица "дата -> времена занятий" на весь горизонт записи: недельное расписание
+    с исключениями по датам и отпусками. Перестраивается, только когда меняется
+    расписание, правила или начало горизонта; поиск по дате - одно обращение к словарю."""
+    week_start = get_week_dates()["Monday"][0].date()
+    key = (week_start, schedule_version(partition), file_version(partition.schedule_rules_file))
+    
+    cached_key, table = partition.slot_table
+    if cached_key == key:
+        return table
+    
+    if schedule is None:
+        schedule = load_json(partition.schedule_file) or DEFAULT_SCHEDULE
+    rules = load_schedule_rules(partition)
+    
+    holidays = set()
+    for start_str, end_str in rules["holidays"].items():
+        try:
+            day = date.fromisoformat(start_str)
+            end = date.fromisoformat(end_str)
+        except (TypeError, ValueError):
+            continue
+        while day <= end:
+            holidays.add(day)
+            day += timedelta(days=1)
+    
+    table = {}
+    for offset in range(BOOKING_HORIZON_WEEKS * 7):
+        day = week_start + timedelta(days=offset)
+        if day in holidays:
+            continue
+        
+        day_name = list(DAYS_RU)[day.weekday()] if day.weekday() < 6 else None
+        times = rules["overrides"].get(day.isoformat(), schedule.get(day_name, []))
+        if isinstance(times, list) and times:
+            # "8:00" -> "08:00": в таком виде время стоит в ключах занятых слотов
+            table[day] = [normalize_time(time_str) for time_str in times]
+    
+    partition.slot_table = (key, table)
+    print(f"🗓 Таблица доступности пересобрана: {len(table)} дней")
+    return table
+
+def week_availability(partition: TutorPartition, week_offset: int, schedule: Dict) -> Dict[str, List[str]]:
+    """Свободные времена всех дней недели. Считаются при первом обращении к неделе и
+    кэшируются по (неделя, версия расписания, версии занятий и броней); кэш живет
+    не дольше ближайшей истекающей брони этой недели."""
+    week = get_week_dates(week_offset=week_offset)
+    now = datetime.now(tz=MSK_TIMEZONE)
+    booked = get_booked_times(partition)
+    holds = get_active_holds(partition)
+    table = compile_availability(partition, schedule)
+    key = (week["Monday"][0].date(), partition.slot_table[0], partition.lessons_cache[0], partition.holds.version)
+    
+    cached = partition.availability_cache.get(week_offset)
+    if cached and cached[0] == key and now < cached[1]:
+        return cached[2]
+    
+    availability = {}
+    valid_until = now + timedelta(days=1)
+    
+    for day_name, (date_obj, _) in week.items():
+        all_times = table.get(date_obj.date(), [])
+        date_str = date_obj.strftime("%Y-%m-%d")
+        free = []
+        for time_str in all_times:
+            slot = f"{date_str}_{time_str}"
+            if slot in booked:
+                continue
+            if is_slot_held(slot, holds, now):
+                valid_until = min(valid_until, holds[slot].expires_at)
+                continue
+            free.append(time_str)
+        availability[day_name] = free
     
-    if isinstance(all_times, str) and all_times == "нет":
-        return []
+    partition.availability_cache[week_offset] = (key, valid_until, availability)
+    return availability
+
+def get_available_times(partition: TutorPartition, day_name: str, schedule: Dict) -> List[str]:
+    token = day_name
+    day_name, week_offset = parse_day_token(token)
     
-    if not all_times:
+    if not 0 <= week_offset < BOOKING_HORIZON_WEEKS:
         return []
     
-    available = [time for time in all_times if not is_time_slot_booked(day_name, time)]
-    print(f"📊 get_available_times: {day_name} -> {available}")
+    available = week_availability(partition, week_offset, schedule).get(day_name, [])
+    print(f"📊 get_available_times: {token} -> {available}")
     return available
 
+def first_week_with_slots(partition: TutorPartition, schedule: Dict) -> Optional[int]:
+    """Первая неделя горизонта со свободными слотами; недели дальше нее не считаются"""
+    for week_offset in range(BOOKING_HORIZON_WEEKS):
+        if any(week_availability(partition, week_offset, schedule).values()):
+            return week_offset
+    return None
+
 def create_request_id():
     return str(uuid.uuid4())[:8]
 
@@ -682,8 +2690,12 @@ def parse_time(time_str: str) -> tuple:
     parts = time_str.split(":")
     return int(parts[0]), int(parts[1])
 
+def normalize_time(time_str: str) -> str:
+    hour, minute = parse_time(time_str)
+    return f"{hour:02d}:{minute:02d}"
+
 def get_lesson_datetime(day_name: str, time_str: str) -> Optional[datetime]:
-    week = get_week_dates()
+    day_name, week = week_dates_for(day_name)
     
     if day_name not in week:
         return None
@@ -696,95 +2708,25 @@ def get_lesson_datetime(day_name: str, time_str: str) -> Optional[datetime]:
     
     return dt
 
-# ============================================================================
-# ИСПРАВЛЕННАЯ ФУНКЦИЯ get_student_lessons (гарантирует date_str и time)
-# ============================================================================
-def get_student_lessons(student_id: int) -> Dict:
-    """Получить подтвержденные занятия ученика с гарантированными ключами date_str и time"""
-    confirmed = load_json(CONFIRMED_FILE)
-    result = {}
-    for lid, lesson in confirmed.items():
-        if lesson.get("student_id") == student_id:
-            # Если нет date_str или time, генерируем из lesson_datetime
-            if "date_str" not in lesson or "time" not in lesson:
-                try:
-                    dt = datetime.fromisoformat(lesson.get("lesson_datetime", ""))
-                    if dt.tzinfo is None:
-                        dt = dt.replace(tzinfo=MSK_TIMEZONE)
-                    lesson["date_str"] = dt.strftime("%d.%m.%Y")
-                    lesson["time"] = dt.strftime("%H:%M")
-                except Exception as e:
-                    print(f"⚠️ Ошибка генерации даты/времени для занятия {lid}: {e}")
-                    lesson["date_str"] = "??.??.????"
-                    lesson["time"] = "??:??"
-            result[lid] = lesson
-    return result
-
-def get_tutor_lessons() -> Dict:
-    confirmed = load_json(CONFIRMED_FILE)
+def get_student_lessons(partition: TutorPartition, student_id: int) -> Dict[str, Lesson]:
+    """Подтвержденные занятия ученика (date_str и time вычисляются из lesson_datetime)"""
+    return {
+        lesson_id: lesson for lesson_id, lesson in all_lessons(partition).items()
+        if lesson.student_id == student_id
+    }
+
+def get_tutor_lessons(partition: TutorPartition) -> Dict[str, Lesson]:
     week = get_week_dates()
+    week_start = week["Monday"][0]
+    week_end = week["Saturday"][0] + timedelta(days=1)
     
-    tutor_lessons = {}
-    
-    for lesson_id, lesson in confirmed.items():
-        try:
-            lesson_date = datetime.fromisoformat(lesson.get("lesson_datetime", ""))
-            
-            if lesson_date.tzinfo is None:
-                lesson_date = lesson_date.replace(tzinfo=MSK_TIMEZONE)
-            
-            week_start = week["Monday"][0]
-            week_end = week["Saturday"][0] + timedelta(days=1)
-            
-            if week_start <= lesson_date < week_end:
-                if "date_str" not in lesson or "time" not in lesson:
-                    lesson["date_str"] = lesson_date.strftime("%d.%m.%Y")
-                    lesson["time"] = lesson_date.strftime("%H:%M")
-                tutor_lessons[lesson_id] = lesson
-        
-        except Exception as e:
-            print(f"⚠️ Ошибка при обработке tutor lesson {lesson_id}: {e}")
-            pass
-    
-    return tutor_lessons
+    return {
+        lesson_id: lesson for lesson_id, lesson in all_lessons(partition).items()
+        if lesson.lesson_datetime and week_start <= lesson.lesson_datetime < week_end
+    }
 
-def get_all_students() -> Dict[int, Dict]:
-    all_students = {}
-    
-    students_file_data = load_json(STUDENTS_FILE)
-    for student_id_str, student_data in students_file_data.items():
-        try:
-            student_id = int(student_id_str)
-            if student_id not in all_students and student_id != TUTOR_ID:
-                all_students[student_id] = {
-                    "name": student_data.get("name", "Ученик"),
-                    "class": student_data.get("grade", "")
-                }
-        except:
-            pass
-    
-    confirmed = load_json(CONFIRMED_FILE)
-    for lesson_id, lesson in confirmed.items():
-        student_id = lesson.get("student_id")
-        if student_id and student_id not in all_students and student_id != TUTOR_ID:
-            all_students[student_id] = {
-                "name": lesson.get("student_name", "Ученик"),
-                "class": lesson.get("student_class", "")
-            }
-    
-    pending = load_json(PENDING_FILE)
-    for req_id, req in pending.items():
-        student_id = req.get("student_id")
-        if student_id and student_id not in all_students and student_id != TUTOR_ID:
-            all_students[student_id] = {
-                "name": req.get("student_name", "Ученик"),
-                "class": req.get("student_class", "")
-            }
-    
-    for student_id in STUDENT_CACHE:
-        if student_id not in all_students and student_id != TUTOR_ID:
-            all_students[student_id] = STUDENT_CACHE[student_id]
-    
+def get_all_students(partition: TutorPartition) -> Dict[int, Student]:
+    all_students = STUDENT_DIRECTORY.all_recipients(partition.tutor_id)
     print(f"📊 Всего найдено учеников: {len(all_students)}")
     return all_students
 
@@ -794,18 +2736,16 @@ def format_student_schedule_message(lessons: Dict) -> str:
     
     message = "📚 Ваше расписание на эту неделю:\n\n"
     
-    sorted_lessons = sorted(lessons.values(), key=lambda x: x.get("lesson_datetime", ""))
+    sorted_lessons = sorted(
+        (lesson for lesson in lessons.values() if lesson.lesson_datetime),
+        key=lambda lesson: lesson.lesson_datetime
+    )
     
     for lesson in sorted_lessons:
         try:
-            lesson_date = datetime.fromisoformat(lesson.get("lesson_datetime", ""))
-            
-            if lesson_date.tzinfo is None:
-                lesson_date = lesson_date.replace(tzinfo=MSK_TIMEZONE)
-            
-            date_str = lesson_date.strftime("%d.%m.%Y")
-            time_str = lesson_date.strftime("%H:%M")
-            subject = lesson.get("subject", "Неизвестный предмет")
+            date_str = lesson.date_str
+            time_str = lesson.time
+            subject = lesson.subject or "Неизвестный предмет"
             
             message += f"📅 {date_str} в {time_str}\n"
             message += f" Предмет: {subject}\n"
@@ -822,19 +2762,17 @@ def format_tutor_schedule_message(lessons: Dict) -> str:
     
     message = "📚 Ваше расписание на эту неделю:\n\n"
     
-    sorted_lessons = sorted(lessons.values(), key=lambda x: x.get("lesson_datetime", ""))
+    sorted_lessons = sorted(
+        (lesson for lesson in lessons.values() if lesson.lesson_datetime),
+        key=lambda lesson: lesson.lesson_datetime
+    )
     
     for lesson in sorted_lessons:
         try:
-            lesson_date = datetime.fromisoformat(lesson.get("lesson_datetime", ""))
-            
-            if lesson_date.tzinfo is None:
-                lesson_date = lesson_date.replace(tzinfo=MSK_TIMEZONE)
-            
-            date_str = lesson_date.strftime("%d.%m.%Y")
-            time_str = lesson_date.strftime("%H:%M")
-            student_name = lesson.get("student_name", "Неизвестный ученик")
-            subject = lesson.get("subject", "Неизвестный предмет")
+            date_str = lesson.date_str
+            time_str = lesson.time
+            student_name = lesson.student_name or "Неизвестный ученик"
+            subject = lesson.subject or "Неизвестный предмет"
             
             message += f"📅 {date_str} в {time_str}\n"
             message += f" Ученик: {student_name}\n"
@@ -911,15 +2849,161 @@ def format_schedule_for_preview(schedule_dict: Dict) -> str:
     
     return message
 
+# ============================================================================
+# РЕКОМЕНДАЦИИ ВРЕМЕНИ
+# ============================================================================
+
+SLOT_STEP_MINUTES = 15
+BUCKETS_PER_DAY = 24 * 60 // SLOT_STEP_MINUTES
+
+class OccupancyMatrix:
+    """Таблица занятости "день горизонта x 15-минутный интервал" в плоских массивах array:
+    ячейка i = день * BUCKETS_PER_DAY + интервал. open - слот есть в таблице доступности,
+    busy - занят занятием или бронью; free - индексы открытых свободных ячеек.
+    Это только хранилище с индексацией O(1): векторных операций над ним нет."""
+    
+    def __init__(self, week_start: date, days: int):
+        self.week_start = week_start
+        self.days = days
+        self.open = array("b", bytes(days * BUCKETS_PER_DAY))
+        self.busy = array("b", bytes(days * BUCKETS_PER_DAY))
+        self.day_load = array("h", bytes(2 * days))
+        self.free: List[int] = []
+    
+    def cell(self, dt: datetime) -> Optional[int]:
+        day = (dt.date() - self.week_start).days
+        if not 0 <= day < self.days:
+            return None
+        return day * BUCKETS_PER_DAY + (dt.hour * 60 + dt.minute) // SLOT_STEP_MINUTES
+    
+    def slot_datetime(self, cell: int) -> datetime:
+        day, bucket = divmod(cell, BUCKETS_PER_DAY)
+        slot_day = self.week_start + timedelta(days=day)
+        minutes = bucket * SLOT_STEP_MINUTES
+        return datetime(slot_day.year, slot_day.month, slot_day.day, minutes // 60, minutes % 60, tzinfo=MSK_TIMEZONE)
+
+def occupancy_matrix(partition: TutorPartition) -> OccupancyMatrix:
+    """Строится из таблицы доступности, занятий и броней; пересобирается, только когда они меняются"""
+    table = compile_availability(partition)
+    lessons = all_lessons(partition)
+    holds = get_active_holds(partition)
+    key = (partition.lessons_cache[0], partition.holds.version, partition.slot_table[0])
+    
+    cached_key, matrix = partition.occupancy
+    if cached_key == key:
+        return matrix
+    
+    matrix = OccupancyMatrix(get_week_dates()["Monday"][0].date(), BOOKING_HORIZON_WEEKS * 7)
+    
+    for slot_day, times in table.items():
+        for time_str in times:
+            hour, minute = parse_time(time_str)
+            cell = matrix.cell(datetime(slot_day.year, slot_day.month, slot_day.day, hour, minute, tzinfo=MSK_TIMEZONE))
+            if cell is not None:
+                matrix.open[cell] = 1
+    
+    for lesson in lessons.values():
+        cell = matrix.cell(lesson.lesson_datetime) if lesson.lesson_datetime else None
+        if cell is not None:
+            matrix.busy[cell] = 1
+            matrix.day_load[cell // BUCKETS_PER_DAY] += 1
+    
+    for key_str in holds:
+        if is_slot_held(key_str, holds):
+            try:
+                held = datetime.strptime(key_str, "%Y-%m-%d_%H:%M").replace(tzinfo=MSK_TIMEZONE)
+            except ValueError:
+                continue
+            cell = matrix.cell(held)
+            if cell is not None:
+                matrix.busy[cell] = 1
+    
+    matrix.free = [cell for cell in range(len(matrix.open)) if matrix.open[cell] and not matrix.busy[cell]]
+    partition.occupancy = (key, matrix)
+    return matrix
+
+def student_affinity(partition: TutorPartition, student_id: int) -> array:
+    """Как часто ученик занимался в этот день недели и интервал (0..1) - по занятиям в работе и сериям"""
+    affinity = array("f", bytes(4 * 7 * BUCKETS_PER_DAY))
+    
+    for lesson in get_student_lessons(partition, student_id).values():
+        dt = lesson.lesson_datetime
+        if dt:
+            affinity[dt.weekday() * BUCKETS_PER_DAY + (dt.hour * 60 + dt.minute) // SLOT_STEP_MINUTES] += 1
+    
+    peak = max(affinity)
+    if peak:
+        for cell in range(len(affinity)):
+            if affinity[cell]:
+                affinity[cell] /= peak
+    return affinity
+
+def suggest_slots(partition: TutorPartition, student_id: int, limit: int = SUGGESTION_COUNT,
+                  now: datetime = None) -> List[datetime]:
+    """Лучшие свободные слоты: привычные ученику день и время, менее загруженные дни
+    и слоты рядом с уже занятыми (без окон в расписании); при равенстве - раньше.
+    Оценка считается обычным циклом по свободным ячейкам - их сотни, а numpy
+    в зависимостях бота нет."""
+    matrix = occupancy_matrix(partition)
+    affinity = student_affinity(partition, student_id)
+    now = now or datetime.now(tz=MSK_TIMEZONE)
+    now_cell = matrix.cell(now)
+    if now_cell is None:
+        now_cell = -1 if now.date() < matrix.week_start else len(matrix.open)
+    
+    step = max(1, SLOT_DURATION // SLOT_STEP_MINUTES)
+    busy = matrix.busy
+    day_load = matrix.day_load
+    
+    scored = []
+    for cell in matrix.free:
+        if cell <= now_cell:
+            continue
+        day, bucket = divmod(cell, BUCKETS_PER_DAY)
+        # Воскресенья нет в DAYS_RU - такой слот не выбрать в календаре
+        if day % 7 == 6:
+            continue
+        score = 3.0 * affinity[(day % 7) * BUCKETS_PER_DAY + bucket] - 0.5 * day_load[day] - 0.02 * day
+        if bucket >= step and busy[cell - step]:
+            score += 1.0
+        if bucket + step < BUCKETS_PER_DAY and busy[cell + step]:
+            score += 1.0
+        scored.append((score, -cell))
+    
+    return [matrix.slot_datetime(-cell) for _, cell in heapq.nlargest(limit, scored)]
+
+def suggestion_buttons(partition: TutorPartition, flow: str, student_id: int) -> List[List[InlineKeyboardButton]]:
+    """Кнопки "⭐" сразу на подтверждение слота - как выбор дня и времени вручную"""
+    prefix = "repeat_confirm_" if flow == "repeat" else "confirm_time_"
+    week_start = get_week_dates()["Monday"][0].date()
+    
+    rows = []
+    for slot_dt in suggest_slots(partition, student_id):
+        day_offset = (slot_dt.date() - week_start).days
+        token = day_token(list(DAYS_RU)[slot_dt.weekday()], day_offset // 7)
+        day_ru = list(DAYS_RU.values())[slot_dt.weekday()]
+        rows.append([InlineKeyboardButton(
+            text=f"⭐ {day_ru}, {slot_dt.strftime('%d.%m')} в {slot_dt.strftime('%H:%M')}",
+            callback_data=f"{prefix}{token}_{slot_dt.strftime('%H:%M')}"
+        )])
+    return rows
+
 # ============================================================================
 # ОБРАБОТЧИКИ СООБЩЕНИЙ
 # ============================================================================
 
-async def start_handler(message: types.Message):
+async def start_handler(message: types.Message, command: CommandObject = None):
     user_id = message.from_user.id
     name = message.from_user.first_name or "Гость"
     
-    if user_id == TUTOR_ID:
+    # Ссылка вида t.me/<bot>?start=t<tutor_id> закрепляет ученика за репетитором
+    if command and command.args and command.args.startswith("t") and not is_tutor(user_id):
+        try:
+            route_student(user_id, int(command.args[1:]))
+        except ValueError:
+            pass
+    
+    if is_tutor(user_id):
         welcome_text = f"🎓 Добро пожаловать, {name}!\n\nВы авторизованы как репетитор."
     else:
         welcome_text = f"👋 Добро пожаловать, {name}!\n\nВыберите действие:"
@@ -935,21 +3019,25 @@ async def menu_button_handler(message: types.Message):
     msg = await message.answer("📌 Главное меню", reply_markup=main_menu_keyboard(user_id))
     log_message(user_id, msg.message_id)
 
-async def my_schedule_handler(callback: types.CallbackQuery, state: FSMContext):
+async def my_schedule_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
     user_id = callback.from_user.id
     await state.set_state(MyScheduleStates.viewing_schedule)
     
-    if user_id == TUTOR_ID:
-        lessons = get_tutor_lessons()
+    if is_tutor(user_id):
+        lessons = get_tutor_lessons(partition)
         message_text = format_tutor_schedule_message(lessons)
     else:
-        lessons = get_student_lessons(user_id)
+        lessons = get_student_lessons(partition, user_id)
         message_text = format_student_schedule_message(lessons)
     
     back_btn = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="⬅️ Вернуться в меню", callback_data="back_to_menu")]
     ])
     
+    url = calendar_url(user_id)
+    if url:
+        back_btn.inline_keyboard.insert(0, [InlineKeyboardButton(text="📆 Добавить в календарь", url=url)])
+    
     await callback.message.edit_text(message_text, reply_markup=back_btn, parse_mode="HTML")
     await callback.answer()
 
@@ -995,72 +3083,117 @@ async def first_lesson_class_handler(message: types.Message, state: FSMContext):
     msg = await message.answer("📖 Выберите предмет:", reply_markup=subjects_keyboard_single())
     log_message(message.from_user.id, msg.message_id)
 
-async def subject_single_handler(callback: types.CallbackQuery, state: FSMContext):
+async def subject_single_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
     subject = callback.data.replace("subject_single_", "")
     
-    current_state = await state.get_state()
-    
-    await state.update_data(subject=subject)
-    
-    week = get_week_dates()
-    schedule = load_json(SCHEDULE_FILE)
-    
-    if not schedule:
-        schedule = DEFAULT_SCHEDULE
-        print(f"⚠️ Расписание пусто! Используем DEFAULT_SCHEDULE")
-    
-    days_ru = {
-        "Monday": "Понедельник",
-        "Tuesday": "Вторник",
-        "Wednesday": "Среда",
-        "Thursday": "Четверг",
-        "Friday": "Пятница",
-        "Saturday": "Суббота"
-    }
-    
-    kb = InlineKeyboardMarkup(inline_keyboard=[])
+    current_state = await state.get_state()
     
-    for day_name in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]:
-        times = get_available_times(day_name, schedule)
-        
-        if times:
-            date_obj, date_str = week[day_name]
-            btn_text = f"{days_ru[day_name]}, {date_str}"
-            
-            if current_state == FirstLessonStates.waiting_for_subject:
-                kb.inline_keyboard.append([
-                    InlineKeyboardButton(text=btn_text, callback_data=f"time_{day_name}")
-                ])
-            elif current_state == RepeatLessonStates.waiting_for_subject:
-                kb.inline_keyboard.append([
-                    InlineKeyboardButton(text=btn_text, callback_data=f"repeat_time_{day_name}")
-                ])
+    await state.update_data(subject=subject)
     
-    kb.inline_keyboard.append([
-        InlineKeyboardButton(text="❌ Отменить", callback_data="back_to_menu")
-    ])
+    schedule = load_json(partition.schedule_file)
+    
+    if not schedule:
+        schedule = DEFAULT_SCHEDULE
+        print(f"⚠️ Расписание пусто! Используем DEFAULT_SCHEDULE")
+    
+    flow = "repeat" if current_state == RepeatLessonStates.waiting_for_subject else "first"
+    week_offset = first_week_with_slots(partition, schedule) or 0
+    kb = calendar_keyboard(partition, flow, week_offset, schedule)
+    
+    suggestions = suggestion_buttons(partition, flow, callback.from_user.id)
+    title = calendar_title(week_offset)
+    if suggestions:
+        kb.inline_keyboard[:0] = suggestions
+        title = "⭐ Рекомендуемое время - или выберите день ниже.\n\n" + title
     
     if current_state == FirstLessonStates.waiting_for_subject:
         await state.set_state(FirstLessonStates.waiting_for_time)
     elif current_state == RepeatLessonStates.waiting_for_subject:
         await state.set_state(RepeatLessonStates.waiting_for_time)
     
-    await callback.message.edit_text("📅 Выберите день:", reply_markup=kb)
+    await callback.message.edit_text(title, reply_markup=kb)
     await callback.answer()
 
 # ============================================================================
 # ИСПРАВЛЕННЫЙ time_select_handler
 # ============================================================================
 
-async def time_select_handler(callback: types.CallbackQuery, state: FSMContext):
+# Календари выбора дня: префикс callback_data дня и кнопка выхода для каждого сценария
+CALENDAR_FLOWS = {
+    "first": ("time_", "❌ Отменить"),
+    "repeat": ("repeat_time_", "❌ Отменить"),
+    "reschedule": ("reschedule_day_", "⬅️ Назад"),
+    "tutor": ("tutor_reschedule_day_", "⬅️ Назад"),
+}
+
+def calendar_keyboard(partition: TutorPartition, flow: str, week_offset: int, schedule: Dict) -> InlineKeyboardMarkup:
+    """Дни одной недели со свободными слотами и переход между неделями горизонта"""
+    day_prefix, back_text = CALENDAR_FLOWS[flow]
+    week = get_week_dates(week_offset=week_offset)
+    availability = week_availability(partition, week_offset, schedule)
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[])
+    
+    for day_name, (date_obj, date_str) in week.items():
+        if availability.get(day_name):
+            kb.inline_keyboard.append([
+                InlineKeyboardButton(text=date_str, callback_data=f"{day_prefix}{day_token(day_name, week_offset)}")
+            ])
+    
+    nav = []
+    if week_offset > 0:
+        nav.append(InlineKeyboardButton(text="⬅️ Пред. неделя", callback_data=f"calendar_{flow}_{week_offset - 1}"))
+    if week_offset + 1 < BOOKING_HORIZON_WEEKS:
+        nav.append(InlineKeyboardButton(text="След. неделя ➡️", callback_data=f"calendar_{flow}_{week_offset + 1}"))
+    if nav:
+        kb.inline_keyboard.append(nav)
+    
+    kb.inline_keyboard.append([InlineKeyboardButton(text=back_text, callback_data="back_to_menu")])
+    return kb
+
+def calendar_title(week_offset: int) -> str:
+    week = get_week_dates(week_offset=week_offset)
+    start = week["Monday"][0].strftime("%d.%m")
+    end = week["Saturday"][0].strftime("%d.%m")
+    return f"📅 Выберите день (неделя {start} - {end}):"
+
+async def calendar_page_handler(callback: types.CallbackQuery, partition: TutorPartition):
+    _, flow, week_str = callback.data.split("_", 2)
+    week_offset = int(week_str)
+    
+    if flow not in CALENDAR_FLOWS or not 0 <= week_offset < BOOKING_HORIZON_WEEKS:
+        await callback.answer()
+        return
+    
+    schedule = load_json(partition.schedule_file) or DEFAULT_SCHEDULE
+    await callback.message.edit_text(
+        calendar_title(week_offset),
+        reply_markup=calendar_keyboard(partition, flow, week_offset, schedule)
+    )
+    await callback.answer()
+
+def waitlist_buttons(partition: TutorPartition, day_name: str, schedule: Dict,
+                     available: List[str]) -> List[List[InlineKeyboardButton]]:
+    """Кнопки записи в лист ожидания на занятые слоты дня"""
+    weekday, week = week_dates_for(day_name)
+    if weekday not in week:
+        return []
+    all_times = compile_availability(partition, schedule).get(week[weekday][0].date(), [])
+    
+    return [
+        [InlineKeyboardButton(text=f"🔔 {time} - лист ожидания", callback_data=f"waitlist_join_{day_name}_{time}")]
+        for time in all_times if time not in available
+    ]
+
+async def time_select_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
     day_name = callback.data.replace("time_", "")
     print(f"time_select_handler: day_name={day_name}")
     
-    schedule = load_json(SCHEDULE_FILE)
+    schedule = load_json(partition.schedule_file)
     if not schedule:
         schedule = DEFAULT_SCHEDULE
     
-    times = get_available_times(day_name, schedule)
+    times = get_available_times(partition, day_name, schedule)
     print(f"Available times: {times}")
     
     if not times:
@@ -1068,11 +3201,12 @@ async def time_select_handler(callback: types.CallbackQuery, state: FSMContext):
         return
     
     kb = InlineKeyboardMarkup(inline_keyboard=[])
-    for time in times:
-        time_str = str(time).strip()
+    for slot_time in times:
+        time_str = str(slot_time).strip()
         callback_data = f"confirm_time_{day_name}_{time_str}"
         kb.inline_keyboard.append([InlineKeyboardButton(text=time_str, callback_data=callback_data)])
     
+    kb.inline_keyboard.extend(waitlist_buttons(partition, day_name, schedule, times))
     kb.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Вернуться", callback_data="back_to_menu")])
     
     try:
@@ -1087,7 +3221,7 @@ async def time_select_handler(callback: types.CallbackQuery, state: FSMContext):
 # ОСТАЛЬНЫЕ ОБРАБОТЧИКИ (включая перенос и отмену)
 # ============================================================================
 
-async def confirm_time_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
+async def confirm_time_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot, partition: TutorPartition):
     parts = callback.data.split("_")
     day_name = parts[2]
     time_str = "_".join(parts[3:])
@@ -1098,7 +3232,7 @@ async def confirm_time_handler(callback: types.CallbackQuery, state: FSMContext,
     subject = data.get("subject", "")
     student_id = callback.from_user.id
     
-    if is_time_slot_booked(day_name, time_str):
+    if is_time_slot_booked(partition, day_name, time_str):
         await callback.answer("❌ Это время уже занято. Пожалуйста, выберите другое.", show_alert=True)
         return
     
@@ -1112,25 +3246,26 @@ async def confirm_time_handler(callback: types.CallbackQuery, state: FSMContext,
     
     request_id = create_request_id()
     
-    pending = load_json(PENDING_FILE)
-    pending[request_id] = {
-        "student_id": student_id,
-        "student_name": student_name,
-        "student_class": student_class,
-        "subject": subject,
-        "lesson_datetime": lesson_datetime.isoformat(),
-        "timestamp": datetime.now(tz=MSK_TIMEZONE).isoformat(),
-        "status": "pending"
-    }
+    pending = partition.requests.load()
+    pending[request_id] = PendingRequest(
+        student_id=student_id,
+        student_name=student_name,
+        student_class=student_class,
+        subject=subject,
+        lesson_datetime=lesson_datetime,
+        timestamp=datetime.now(tz=MSK_TIMEZONE),
+        status="pending"
+    )
     
-    save_json(PENDING_FILE, pending)
+    partition.requests.save()
+    track_request(partition, "requests", request_id, pending[request_id])
     print(f"📝 Создан запрос на занятие: {request_id} - {student_name} ({student_class})")
     
     lesson_date_str = lesson_datetime.strftime("%d.%m.%Y")
     lesson_time_str = lesson_datetime.strftime("%H:%M")
     
     msg_tutor = await bot.send_message(
-        TUTOR_ID,
+        partition.tutor_id,
         f"📋 Новый запрос на занятие!\n\n"
         f"👤 Ученик: {student_name}\n"
         f"📚 Класс: {student_class}\n"
@@ -1140,7 +3275,7 @@ async def confirm_time_handler(callback: types.CallbackQuery, state: FSMContext,
         reply_markup=tutor_confirm_keyboard(request_id),
         parse_mode="HTML"
     )
-    log_message(TUTOR_ID, msg_tutor.message_id)
+    log_message(partition.tutor_id, msg_tutor.message_id)
     
     await callback.message.edit_text(
         f"✅ Запрос отправлен!\n\n"
@@ -1156,10 +3291,10 @@ async def confirm_time_handler(callback: types.CallbackQuery, state: FSMContext,
     await state.clear()
     await callback.answer()
 
-async def confirm_request_handler(callback: types.CallbackQuery, bot: Bot):
+async def confirm_request_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
     request_id = callback.data.replace("confirm_", "")
     
-    pending = load_json(PENDING_FILE)
+    pending = partition.requests.load()
     
     if request_id not in pending:
         await callback.answer("❌ Запрос не найден или уже обработан", show_alert=True)
@@ -1167,42 +3302,52 @@ async def confirm_request_handler(callback: types.CallbackQuery, bot: Bot):
     
     request = pending[request_id]
     
-    student_id = request["student_id"]
-    student_name = request["student_name"]
-    student_class = request["student_class"]
-    subject = request["subject"]
-    lesson_datetime_str = request["lesson_datetime"]
+    if is_slot_booked(partition, request.lesson_datetime):
+        if any(lesson.student_id == request.student_id and lesson.lesson_datetime == request.lesson_datetime
+               for lesson in all_lessons(partition).values()):
+            # Занятие уже записано, а удаление заявки в прошлый раз не сохранилось
+            del pending[request_id]
+            partition.requests.save()
+            release_hold(partition, request.lesson_datetime, request_id)
+            await callback.answer("✅ Запрос уже подтвержден")
+            return
+        await callback.answer("❌ Это время уже занято другим занятием - отклоните запрос", show_alert=True)
+        return
+    
+    student_id = request.student_id
+    student_name = request.student_name
+    student_class = request.student_class
+    subject = request.subject
     
     cache_student_info(student_id, student_name, student_class)
     
-    confirmed = load_json(CONFIRMED_FILE)
+    confirmed = partition.lessons.load()
     
     lesson_id = create_request_id()
-    confirmed[lesson_id] = {
-        "student_id": student_id,
-        "student_name": student_name,
-        "student_class": student_class,
-        "subject": subject,
-        "lesson_datetime": lesson_datetime_str,
-        "date_str": datetime.fromisoformat(lesson_datetime_str).strftime("%d.%m.%Y"),
-        "time": datetime.fromisoformat(lesson_datetime_str).strftime("%H:%M"),
-        "status": "confirmed",
-        "timestamp": datetime.now(tz=MSK_TIMEZONE).isoformat()
-    }
+    lesson = Lesson(
+        student_id=student_id,
+        student_name=student_name,
+        student_class=student_class,
+        subject=subject,
+        lesson_datetime=request.lesson_datetime,
+        status="confirmed",
+        timestamp=datetime.now(tz=MSK_TIMEZONE)
+    )
+    confirmed[lesson_id] = lesson
     
-    save_json(CONFIRMED_FILE, confirmed)
+    if not partition.lessons.save():
+        await callback.answer("❌ Не удалось сохранить занятие - попробуйте еще раз", show_alert=True)
+        return
     
     del pending[request_id]
-    save_json(PENDING_FILE, pending)
+    partition.requests.save()
+    release_hold(partition, request.lesson_datetime, request_id)
+    record_stat(partition, "confirmed", lesson, lesson.lesson_datetime)
     
     print(f"✅ Занятие подтверждено: {lesson_id} - {student_name}")
     
-    lesson_datetime = datetime.fromisoformat(lesson_datetime_str)
-    if lesson_datetime.tzinfo is None:
-        lesson_datetime = lesson_datetime.replace(tzinfo=MSK_TIMEZONE)
-    
-    date_str = lesson_datetime.strftime("%d.%m.%Y")
-    time_str = lesson_datetime.strftime("%H:%M")
+    date_str = lesson.date_str
+    time_str = lesson.time
     
     msg_student = await bot.send_message(
         student_id,
@@ -1223,10 +3368,10 @@ async def confirm_request_handler(callback: types.CallbackQuery, bot: Bot):
     
     await callback.answer("✅ Запрос подтвержден")
 
-async def reject_request_handler(callback: types.CallbackQuery, bot: Bot):
+async def reject_request_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
     request_id = callback.data.replace("reject_", "")
     
-    pending = load_json(PENDING_FILE)
+    pending = partition.requests.load()
     
     if request_id not in pending:
         await callback.answer("❌ Запрос не найден или уже обработан", show_alert=True)
@@ -1234,11 +3379,12 @@ async def reject_request_handler(callback: types.CallbackQuery, bot: Bot):
     
     request = pending[request_id]
     
-    student_id = request["student_id"]
-    student_name = request["student_name"]
+    student_id = request.student_id
+    student_name = request.student_name
     
     del pending[request_id]
-    save_json(PENDING_FILE, pending)
+    partition.requests.save()
+    release_hold(partition, request.lesson_datetime, request_id)
     
     print(f"❌ Запрос отклонен: {request_id} - {student_name}")
     
@@ -1260,11 +3406,11 @@ async def reject_request_handler(callback: types.CallbackQuery, bot: Bot):
     
     await callback.answer("❌ Запрос отклонен")
 
-async def repeat_lesson_handler(callback: types.CallbackQuery, state: FSMContext):
+async def repeat_lesson_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
     student_id = callback.from_user.id
-    lessons = get_student_lessons(student_id)
+    lessons = get_student_lessons(partition, student_id)
     
-    if not lessons:
+    if not lessons and not has_archived_lessons(partition, student_id):
         await callback.message.edit_text(
             "❌ У вас пока нет забронированных занятий.\n\n"
             "Попробуйте записаться через кнопку \"🎓 Первое занятие\"",
@@ -1281,8 +3427,8 @@ async def repeat_lesson_handler(callback: types.CallbackQuery, state: FSMContext
     
     if student_info:
         await state.update_data(
-            student_name=student_info["name"],
-            class_grade=student_info["grade"]
+            student_name=student_info.name,
+            class_grade=student_info.grade
         )
     
     await state.set_state(RepeatLessonStates.waiting_for_subject)
@@ -1291,14 +3437,14 @@ async def repeat_lesson_handler(callback: types.CallbackQuery, state: FSMContext
     
     await callback.answer()
 
-async def repeat_time_select_handler(callback: types.CallbackQuery, state: FSMContext):
+async def repeat_time_select_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
     day_name = callback.data.replace("repeat_time_", "")
     
-    schedule = load_json(SCHEDULE_FILE)
+    schedule = load_json(partition.schedule_file)
     if not schedule:
         schedule = DEFAULT_SCHEDULE
     
-    times = get_available_times(day_name, schedule)
+    times = get_available_times(partition, day_name, schedule)
     
     if not times:
         await callback.answer("❌ На этот день нет доступных свободных времен")
@@ -1308,14 +3454,15 @@ async def repeat_time_select_handler(callback: types.CallbackQuery, state: FSMCo
         [InlineKeyboardButton(text=time, callback_data=f"repeat_confirm_{day_name}_{time}")] for time in times
     ])
     
+    kb.inline_keyboard.extend(waitlist_buttons(partition, day_name, schedule, times))
     kb.inline_keyboard.append([
-        [InlineKeyboardButton(text="⬅️ Вернуться", callback_data="back_to_menu")]
+        InlineKeyboardButton(text="⬅️ Вернуться", callback_data="back_to_menu")
     ])
     
     await callback.message.edit_text("⏰ Выберите время:", reply_markup=kb)
     await callback.answer()
 
-async def repeat_confirm_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
+async def repeat_confirm_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot, partition: TutorPartition):
     parts = callback.data.split("_")
     day_name = parts[2]
     time_str = "_".join(parts[3:])
@@ -1330,12 +3477,12 @@ async def repeat_confirm_handler(callback: types.CallbackQuery, state: FSMContex
         await callback.answer("❌ Ошибка: данные ученика не найдены. Пожалуйста, сначала запишитесь на первое занятие!", show_alert=True)
         return
     
-    if is_time_slot_booked(day_name, time_str):
+    if is_time_slot_booked(partition, day_name, time_str):
         await callback.answer("❌ Это время уже занято. Пожалуйста, выберите другое.", show_alert=True)
         return
     
-    student_name = student_info["name"]
-    student_class = student_info["grade"]
+    student_name = student_info.name
+    student_class = student_info.grade
     
     print(f"✅ Загружены данные для повторного занятия: {student_name} ({student_class}) - ID: {student_id}")
     
@@ -1347,26 +3494,27 @@ async def repeat_confirm_handler(callback: types.CallbackQuery, state: FSMContex
     
     request_id = create_request_id()
     
-    pending = load_json(PENDING_FILE)
-    pending[request_id] = {
-        "student_id": student_id,
-        "student_name": student_name,
-        "student_class": student_class,
-        "subject": subject,
-        "lesson_datetime": lesson_datetime.isoformat(),
-        "timestamp": datetime.now(tz=MSK_TIMEZONE).isoformat(),
-        "status": "pending",
-        "type": "repeat"
-    }
+    pending = partition.requests.load()
+    pending[request_id] = PendingRequest(
+        student_id=student_id,
+        student_name=student_name,
+        student_class=student_class,
+        subject=subject,
+        lesson_datetime=lesson_datetime,
+        timestamp=datetime.now(tz=MSK_TIMEZONE),
+        status="pending",
+        type="repeat"
+    )
     
-    save_json(PENDING_FILE, pending)
+    partition.requests.save()
+    track_request(partition, "requests", request_id, pending[request_id])
     print(f"📝 Создан запрос на повторное занятие: {request_id} - {student_name} ({student_class})")
     
     lesson_date_str = lesson_datetime.strftime("%d.%m.%Y")
     lesson_time_str = lesson_datetime.strftime("%H:%M")
     
     msg_tutor = await bot.send_message(
-        TUTOR_ID,
+        partition.tutor_id,
         f"📋 Новый запрос на повторное занятие!\n\n"
         f"👤 Ученик: {student_name}\n"
         f"📚 Класс: {student_class}\n"
@@ -1376,7 +3524,7 @@ async def repeat_confirm_handler(callback: types.CallbackQuery, state: FSMContex
         reply_markup=tutor_confirm_keyboard(request_id),
         parse_mode="HTML"
     )
-    log_message(TUTOR_ID, msg_tutor.message_id)
+    log_message(partition.tutor_id, msg_tutor.message_id)
     
     await callback.message.edit_text(
         f"✅ Запрос отправлен!\n\n"
@@ -1392,17 +3540,143 @@ async def repeat_confirm_handler(callback: types.CallbackQuery, state: FSMContex
     await state.clear()
     await callback.answer()
 
+# ============================================================================
+# ЕЖЕНЕДЕЛЬНЫЕ СЕРИИ
+# ============================================================================
+
+def series_duration_keyboard(request_id: str):
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
+            text=f"📅 {weeks} нед." if weeks else "♾ Без даты окончания",
+            callback_data=f"series_weeks_{request_id}_{weeks}"
+        )] for weeks in SERIES_DURATION_WEEKS
+    ])
+    kb.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=f"series_back_{request_id}")])
+    return kb
+
+async def series_confirm_handler(callback: types.CallbackQuery, partition: TutorPartition):
+    """Перед созданием серии репетитор выбирает, сколько недель она продлится"""
+    request_id = callback.data.replace("series_confirm_", "")
+    
+    if request_id not in partition.requests.load():
+        await callback.answer("❌ Запрос не найден или уже обработан", show_alert=True)
+        return
+    
+    await callback.message.edit_reply_markup(reply_markup=series_duration_keyboard(request_id))
+    await callback.answer("🔁 Сколько недель продлится серия?")
+
+async def series_back_handler(callback: types.CallbackQuery):
+    await callback.message.edit_reply_markup(reply_markup=tutor_confirm_keyboard(callback.data.replace("series_back_", "")))
+    await callback.answer()
+
+async def series_weeks_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
+    request_id, weeks = callback.data.replace("series_weeks_", "").rsplit("_", 1)
+    weeks = int(weeks)
+    
+    pending = partition.requests.load()
+    
+    if request_id not in pending:
+        await callback.answer("❌ Запрос не найден или уже обработан", show_alert=True)
+        return
+    
+    request = pending[request_id]
+    cache_student_info(request.student_id, request.student_name, request.student_class)
+    
+    series_id, skipped = create_series(partition, request, request_id, weeks)
+    if series_id is None:
+        await callback.answer("❌ Не удалось сохранить серию - попробуйте еще раз", show_alert=True)
+        return
+    
+    del pending[request_id]
+    partition.requests.save()
+    release_hold(partition, request.lesson_datetime, request_id)
+    # Занятия серии попадут в статистику по мере наступления (count_due_series)
+    
+    day_ru = list(DAYS_RU.values())[request.lesson_datetime.weekday()]
+    time_str = request.lesson_datetime.strftime("%H:%M")
+    skipped_text = f"\n\n⚠️ Заняты другими занятиями: {', '.join(skipped)}" if skipped else ""
+    last_lesson = request.lesson_datetime + timedelta(weeks=weeks - 1)
+    until_text = f" по {last_lesson.strftime('%d.%m.%Y')}" if weeks else ""
+    
+    msg_student = await bot.send_message(
+        request.student_id,
+        f"✅ Ваш запрос подтвержден!\n\n"
+        f"🔁 Занятия будут проходить еженедельно:\n"
+        f"📅 {day_ru}, начиная с {request.lesson_datetime.strftime('%d.%m.%Y')}{until_text}\n"
+        f"⏰ Время: {time_str}\n"
+        f"📖 Предмет: {request.subject}{skipped_text}",
+        reply_markup=persistent_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    log_message(request.student_id, msg_student.message_id)
+    
+    await callback.message.edit_text(
+        f"🔁 Еженедельные занятия подтверждены!\n\n"
+        f"Ученик {request.student_name} ({request.student_class}): {day_ru}, {time_str}{until_text}{skipped_text}",
+        parse_mode="HTML"
+    )
+    await callback.answer("✅ Серия создана")
+
+async def series_list_handler(callback: types.CallbackQuery, partition: TutorPartition):
+    now = datetime.now(tz=MSK_TIMEZONE)
+    active = {
+        series_id: series for series_id, series in partition.series.load().items()
+        if not series.end_date or series.end_date > now
+    }
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[])
+    for series_id, series in active.items():
+        day_ru = list(DAYS_RU.values())[series.weekday] if series.weekday is not None and series.weekday < 6 else "?"
+        kb.inline_keyboard.append([
+            InlineKeyboardButton(
+                text=f"⏹ {series.student_name} - {day_ru} {series.time}",
+                callback_data=f"series_end_{series_id}"
+            )
+        ])
+    kb.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Вернуться в меню", callback_data="back_to_menu")])
+    
+    text = "🔁 Еженедельные занятия.\nНажмите, чтобы завершить серию:" if active else "📭 Еженедельных занятий нет."
+    await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
+
+async def series_end_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
+    series_id = callback.data.replace("series_end_", "")
+    
+    if series_id not in partition.series.load():
+        await callback.answer("❌ Серия не найдена", show_alert=True)
+        return
+    
+    series = end_series(partition, series_id)
+    if series is None:
+        await callback.answer("❌ Не удалось сохранить изменения - попробуйте еще раз", show_alert=True)
+        return
+    
+    try:
+        msg_student = await bot.send_message(
+            series.student_id,
+            f"⏹ Еженедельные занятия ({series.subject}, {series.time}) завершены.\n\n"
+            f"Уже прошедшие занятия остаются в истории.",
+            reply_markup=persistent_menu_keyboard()
+        )
+        log_message(series.student_id, msg_student.message_id)
+    except Exception as e:
+        print(f"⚠️ Не удалось уведомить ученика о завершении серии: {e}")
+    
+    await callback.answer("⏹ Серия завершена")
+    await series_list_handler(callback, partition)
+
 # ============================================================================
 # ПРОСЬБА О ПЕРЕНОСЕ ОТ РЕПЕТИТОРА
 # ============================================================================
 
-async def tutor_reschedule_request_handler(callback: types.CallbackQuery, state: FSMContext):
-    lessons = get_tutor_lessons()
+async def tutor_reschedule_request_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
+    lessons = get_tutor_lessons(partition)
     
     if not lessons:
         await callback.message.edit_text(
             "❌ У вас нет занятий на эту неделю для переноса.",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="📆 Перенести или отменить весь день", callback_data="day_shift")],
                 [InlineKeyboardButton(text="⬅️ Вернуться в меню", callback_data="back_to_menu")]
             ])
         )
@@ -1411,62 +3685,42 @@ async def tutor_reschedule_request_handler(callback: types.CallbackQuery, state:
     
     await state.set_state(TutorRescheduleStates.choosing_lesson)
     
+    kb = lessons_list_keyboard(lessons, "tutor_reschedule_pick")
+    kb.inline_keyboard.insert(0, [InlineKeyboardButton(text="📆 Перенести или отменить весь день", callback_data="day_shift")])
+    
     await callback.message.edit_text(
         "📅 Выберите занятие, которое нужно перенести:",
-        reply_markup=lessons_list_keyboard(lessons, "tutor_reschedule_pick")
+        reply_markup=kb
     )
     await callback.answer()
 
-async def tutor_reschedule_pick_handler(callback: types.CallbackQuery, state: FSMContext):
+async def tutor_reschedule_pick_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
     lesson_id = callback.data.replace("tutor_reschedule_pick_", "")
     
-    confirmed = load_json(CONFIRMED_FILE)
+    confirmed = all_lessons(partition)
     
     if lesson_id not in confirmed:
         await callback.answer("❌ Занятие не найдено", show_alert=True)
         return
     
     lesson = confirmed[lesson_id]
-    student_name = lesson.get("student_name", "")
-    subject = lesson.get("subject", "")
+    student_name = lesson.student_name or ""
+    subject = lesson.subject or ""
     
     await state.update_data(
         tutor_reschedule_lesson_id=lesson_id,
-        tutor_reschedule_student_id=lesson.get("student_id"),
+        tutor_reschedule_student_id=lesson.student_id,
         tutor_reschedule_student_name=student_name,
         tutor_reschedule_subject=subject
     )
     
-    week = get_week_dates()
-    schedule = load_json(SCHEDULE_FILE)
+    schedule = load_json(partition.schedule_file)
     
     if not schedule:
         schedule = DEFAULT_SCHEDULE
     
-    days_ru = {
-        "Monday": "Понедельник",
-        "Tuesday": "Вторник",
-        "Wednesday": "Среда",
-        "Thursday": "Четверг",
-        "Friday": "Пятница",
-        "Saturday": "Суббота"
-    }
-    
-    kb = InlineKeyboardMarkup(inline_keyboard=[])
-    
-    for day_name in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]:
-        times = get_available_times(day_name, schedule)
-        
-        if times:
-            date_obj, date_str = week[day_name]
-            btn_text = f"{days_ru[day_name]}, {date_str}"
-            kb.inline_keyboard.append([
-                InlineKeyboardButton(text=btn_text, callback_data=f"tutor_reschedule_day_{day_name}")
-            ])
-    
-    kb.inline_keyboard.append([
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_menu")]
-    ])
+    week_offset = first_week_with_slots(partition, schedule) or 0
+    kb = calendar_keyboard(partition, "tutor", week_offset, schedule)
     
     await callback.message.edit_text(
         f"📅 Выберите новый день для {student_name} ({subject}):",
@@ -1475,14 +3729,14 @@ async def tutor_reschedule_pick_handler(callback: types.CallbackQuery, state: FS
     await state.set_state(TutorRescheduleStates.waiting_for_new_time)
     await callback.answer()
 
-async def tutor_reschedule_day_handler(callback: types.CallbackQuery, state: FSMContext):
+async def tutor_reschedule_day_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
     day_name = callback.data.replace("tutor_reschedule_day_", "")
     
-    schedule = load_json(SCHEDULE_FILE)
+    schedule = load_json(partition.schedule_file)
     if not schedule:
         schedule = DEFAULT_SCHEDULE
     
-    times = get_available_times(day_name, schedule)
+    times = get_available_times(partition, day_name, schedule)
     
     if not times:
         await callback.answer("❌ На этот день нет доступных свободных времен")
@@ -1493,13 +3747,13 @@ async def tutor_reschedule_day_handler(callback: types.CallbackQuery, state: FSM
     ])
     
     kb.inline_keyboard.append([
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_menu")]
+        InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_menu")
     ])
     
     await callback.message.edit_text("⏰ Выберите новое время:", reply_markup=kb)
     await callback.answer()
 
-async def tutor_reschedule_confirm_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
+async def tutor_reschedule_confirm_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot, partition: TutorPartition):
     parts = callback.data.split("_")
     day_name = parts[3]
     time_str = "_".join(parts[4:])
@@ -1511,7 +3765,7 @@ async def tutor_reschedule_confirm_handler(callback: types.CallbackQuery, state:
     student_name = data.get("tutor_reschedule_student_name")
     subject = data.get("tutor_reschedule_subject")
     
-    if is_time_slot_booked(day_name, time_str):
+    if is_time_slot_booked(partition, day_name, time_str):
         await callback.answer("❌ Это время уже занято. Пожалуйста, выберите другое.", show_alert=True)
         return
     
@@ -1523,18 +3777,19 @@ async def tutor_reschedule_confirm_handler(callback: types.CallbackQuery, state:
     
     reschedule_id = create_request_id()
     
-    pending_tutor_reschedules = load_json(PENDING_TUTOR_RESCHEDULES_FILE)
-    pending_tutor_reschedules[reschedule_id] = {
-        "lesson_id": lesson_id,
-        "student_id": student_id,
-        "student_name": student_name,
-        "subject": subject,
-        "new_lesson_datetime": new_lesson_datetime.isoformat(),
-        "timestamp": datetime.now(tz=MSK_TIMEZONE).isoformat(),
-        "status": "pending"
-    }
+    pending_tutor_reschedules = partition.tutor_reschedules.load()
+    pending_tutor_reschedules[reschedule_id] = RescheduleRequest(
+        lesson_id=lesson_id,
+        student_id=student_id,
+        student_name=student_name,
+        subject=subject,
+        new_lesson_datetime=new_lesson_datetime,
+        timestamp=datetime.now(tz=MSK_TIMEZONE),
+        status="pending"
+    )
     
-    save_json(PENDING_TUTOR_RESCHEDULES_FILE, pending_tutor_reschedules)
+    partition.tutor_reschedules.save()
+    track_request(partition, "tutor_reschedules", reschedule_id, pending_tutor_reschedules[reschedule_id])
     
     lesson_date_str = new_lesson_datetime.strftime("%d.%m.%Y")
     lesson_time_str = new_lesson_datetime.strftime("%H:%M")
@@ -1569,10 +3824,10 @@ async def tutor_reschedule_confirm_handler(callback: types.CallbackQuery, state:
     await state.clear()
     await callback.answer()
 
-async def student_reschedule_agree_handler(callback: types.CallbackQuery, bot: Bot):
+async def student_reschedule_agree_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
     reschedule_id = callback.data.replace("student_reschedule_agree_", "")
     
-    pending_tutor_reschedules = load_json(PENDING_TUTOR_RESCHEDULES_FILE)
+    pending_tutor_reschedules = partition.tutor_reschedules.load()
     
     if reschedule_id not in pending_tutor_reschedules:
         await callback.answer("❌ Запрос не найден", show_alert=True)
@@ -1580,43 +3835,37 @@ async def student_reschedule_agree_handler(callback: types.CallbackQuery, bot: B
     
     reschedule = pending_tutor_reschedules[reschedule_id]
     
-    lesson_id = reschedule["lesson_id"]
-    student_id = reschedule["student_id"]
-    student_name = reschedule["student_name"]
-    new_datetime_str = reschedule["new_lesson_datetime"]
+    lesson_id = reschedule.lesson_id
+    student_id = reschedule.student_id
+    student_name = reschedule.student_name
+    new_datetime = reschedule.new_lesson_datetime
     
-    confirmed = load_json(CONFIRMED_FILE)
+    if is_slot_booked(partition, new_datetime):
+        await callback.answer("❌ Это время уже занято другим занятием", show_alert=True)
+        return
     
-    if lesson_id in confirmed:
-        confirmed[lesson_id]["lesson_datetime"] = new_datetime_str
-        
-        new_datetime = datetime.fromisoformat(new_datetime_str)
-        if new_datetime.tzinfo is None:
-            new_datetime = new_datetime.replace(tzinfo=MSK_TIMEZONE)
-        
-        confirmed[lesson_id]["date_str"] = new_datetime.strftime("%d.%m.%Y")
-        confirmed[lesson_id]["time"] = new_datetime.strftime("%H:%M")
-        
-        save_json(CONFIRMED_FILE, confirmed)
+    freed_slot = move_lesson(partition, lesson_id, new_datetime)
+    if freed_slot is None and lesson_id in all_lessons(partition):
+        await callback.answer("❌ Не удалось сохранить перенос - попробуйте еще раз", show_alert=True)
+        return
     
     del pending_tutor_reschedules[reschedule_id]
-    save_json(PENDING_TUTOR_RESCHEDULES_FILE, pending_tutor_reschedules)
-    
-    new_datetime = datetime.fromisoformat(new_datetime_str)
-    if new_datetime.tzinfo is None:
-        new_datetime = new_datetime.replace(tzinfo=MSK_TIMEZONE)
+    partition.tutor_reschedules.save()
+    release_hold(partition, reschedule.new_lesson_datetime, reschedule_id)
+    if freed_slot:
+        record_stat(partition, "rescheduled", reschedule, new_datetime)
     
     date_str = new_datetime.strftime("%d.%m.%Y")
     time_str = new_datetime.strftime("%H:%M")
     
     msg_tutor = await bot.send_message(
-        TUTOR_ID,
+        partition.tutor_id,
         f"✅ Ученик {student_name} согласился на перенос!\n\n"
         f"📅 Дата: {date_str}\n"
         f"⏰ Время: {time_str}",
         reply_markup=persistent_menu_keyboard()
     )
-    log_message(TUTOR_ID, msg_tutor.message_id)
+    log_message(partition.tutor_id, msg_tutor.message_id)
     
     await callback.message.edit_text(
         f"✅ Вы согласились на перенос занятия!\n\n"
@@ -1629,11 +3878,12 @@ async def student_reschedule_agree_handler(callback: types.CallbackQuery, bot: B
     )
     
     await callback.answer("✅ Вы согласились на перенос")
+    await offer_freed_slot(bot, partition, freed_slot)
 
-async def student_reschedule_decline_handler(callback: types.CallbackQuery, bot: Bot):
+async def student_reschedule_decline_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
     reschedule_id = callback.data.replace("student_reschedule_decline_", "")
     
-    pending_tutor_reschedules = load_json(PENDING_TUTOR_RESCHEDULES_FILE)
+    pending_tutor_reschedules = partition.tutor_reschedules.load()
     
     if reschedule_id not in pending_tutor_reschedules:
         await callback.answer("❌ Запрос не найден", show_alert=True)
@@ -1641,17 +3891,18 @@ async def student_reschedule_decline_handler(callback: types.CallbackQuery, bot:
     
     reschedule = pending_tutor_reschedules[reschedule_id]
     
-    student_name = reschedule["student_name"]
+    student_name = reschedule.student_name
     
     del pending_tutor_reschedules[reschedule_id]
-    save_json(PENDING_TUTOR_RESCHEDULES_FILE, pending_tutor_reschedules)
+    partition.tutor_reschedules.save()
+    release_hold(partition, reschedule.new_lesson_datetime, reschedule_id)
     
     msg_tutor = await bot.send_message(
-        TUTOR_ID,
+        partition.tutor_id,
         f"❌ Ученик {student_name} не согласился на перенос занятия.",
         reply_markup=persistent_menu_keyboard()
     )
-    log_message(TUTOR_ID, msg_tutor.message_id)
+    log_message(partition.tutor_id, msg_tutor.message_id)
     
     await callback.message.edit_text(
         f"❌ Вы отклонили просьбу о переносе.\n\n"
@@ -1663,6 +3914,461 @@ async def student_reschedule_decline_handler(callback: types.CallbackQuery, bot:
     
     await callback.answer("❌ Вы отклонили просьбу")
 
+# ============================================================================
+# ПЕРЕНОС ВСЕГО ДНЯ
+# ============================================================================
+
+def lessons_on_day(partition: TutorPartition, day: date) -> List[Tuple[str, Lesson]]:
+    return sorted(
+        ((lesson_id, lesson) for lesson_id, lesson in all_lessons(partition).items()
+         if lesson.lesson_datetime and lesson.lesson_datetime.date() == day),
+        key=lambda item: item[1].lesson_datetime
+    )
+
+def plan_day_shift(partition: TutorPartition, day: date,
+                   lessons: List[Tuple[str, Lesson]]) -> List[Tuple[str, Lesson, Optional[datetime]]]:
+    """Новое время для каждого занятия дня: ближайший свободный слот после этого дня,
+    по возможности в то же время суток. Свободные слоты - таблица доступности
+    за вычетом индекса занятости и броней; один слот не предлагается дважды."""
+    table = compile_availability(partition)
+    booked = get_booked_times(partition)
+    holds = get_active_holds(partition)
+    
+    free = []
+    for slot_day in sorted(d for d in table if d > day):
+        for time_str in table[slot_day]:
+            key = f"{slot_day.isoformat()}_{time_str}"
+            if key in booked or is_slot_held(key, holds):
+                continue
+            hour, minute = parse_time(time_str)
+            free.append(datetime(slot_day.year, slot_day.month, slot_day.day, hour, minute, tzinfo=MSK_TIMEZONE))
+    
+    plan = []
+    for lesson_id, lesson in lessons:
+        new_datetime = next((dt for dt in free if dt.strftime("%H:%M") == lesson.time), None)
+        if new_datetime is None and free:
+            new_datetime = free[0]
+        if new_datetime:
+            free.remove(new_datetime)
+        plan.append((lesson_id, lesson, new_datetime))
+    
+    return plan
+
+def is_day_closed(partition: TutorPartition, day: date) -> bool:
+    return load_schedule_rules(partition)["overrides"].get(day.isoformat()) == "нет"
+
+def close_day(partition: TutorPartition, day: date) -> bool:
+    """Исключение "нет" на дату: освободившиеся слоты дня не достанутся другим ученикам.
+    False - правила не удалось сохранить."""
+    rules = load_schedule_rules(partition)
+    rules["overrides"][day.isoformat()] = "нет"
+    if not save_json(partition.schedule_rules_file, rules):
+        return False
+    print(f"📆 День {day.isoformat()} закрыт для записи")
+    return True
+
+def lessons_being_rescheduled(partition: TutorPartition) -> set:
+    """Занятия, по которым ученику уже отправлена просьба репетитора о переносе"""
+    return {reschedule.lesson_id for reschedule in partition.tutor_reschedules.load().values()}
+
+def propose_day_shift(partition: TutorPartition, plan: List[Tuple[str, Lesson, Optional[datetime]]]) -> Optional[List[Tuple[str, RescheduleRequest]]]:
+    """Просьбы о переносе для всего плана: файл просьб и брони сохраняются по одному разу.
+    None - просьбы не удалось сохранить, ученикам ничего отправлять нельзя."""
+    pending_tutor_reschedules = partition.tutor_reschedules.load()
+    
+    proposals = []
+    for lesson_id, lesson, new_datetime in plan:
+        if new_datetime is None:
+            continue
+        reschedule_id = create_request_id()
+        reschedule = RescheduleRequest(
+            lesson_id=lesson_id,
+            student_id=lesson.student_id,
+            student_name=lesson.student_name,
+            student_class=lesson.student_class,
+            subject=lesson.subject,
+            new_lesson_datetime=new_datetime,
+            timestamp=datetime.now(tz=MSK_TIMEZONE),
+            status="pending"
+        )
+        pending_tutor_reschedules[reschedule_id] = reschedule
+        track_request(partition, "tutor_reschedules", reschedule_id, reschedule, save=False)
+        proposals.append((reschedule_id, reschedule))
+    
+    if proposals:
+        if not partition.tutor_reschedules.save():
+            partition.holds.discard()
+            return None
+        partition.holds.save()
+        print(f"📬 Просьб о переносе дня создано: {len(proposals)}")
+    return proposals
+
+def cancel_day_lessons(partition: TutorPartition, lessons: List[Tuple[str, Lesson]]) -> List[Tuple[str, Lesson]]:
+    """Отменяет занятия дня одной записью: обычные удаляются, у занятий серий - исключение skip"""
+    partition_stats(partition)
+    confirmed = partition.lessons.load()
+    series = partition.series.load()
+    
+    cancelled = []
+    for lesson_id, lesson in lessons:
+        series_id, date_str = split_occurrence_id(lesson_id)
+        if series_id and series_id in series:
+            series[series_id].exceptions[date_str] = "skip"
+            cancelled.append(("series", lesson_id, lesson))
+        elif confirmed.pop(lesson_id, None) is not None:
+            cancelled.append(("lessons", lesson_id, lesson))
+    
+    # Ученикам сообщается только об отменах, которые удалось сохранить
+    failed = {store_name for store_name in {item[0] for item in cancelled}
+              if not getattr(partition, store_name).save(allow_empty=True)}
+    cancelled = [(lesson_id, lesson) for store_name, lesson_id, lesson in cancelled if store_name not in failed]
+    for lesson_id, lesson in cancelled:
+        record_stat(partition, "cancelled", lesson, lesson.lesson_datetime)
+    
+    print(f"❌ Отменено занятий дня: {len(cancelled)}")
+    return cancelled
+
+def day_shift_back_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📌 В главное меню", callback_data="back_to_menu")]
+    ])
+
+async def day_shift_handler(callback: types.CallbackQuery, partition: TutorPartition):
+    now = datetime.now(tz=MSK_TIMEZONE)
+    days: Dict[date, int] = {}
+    for lesson in all_lessons(partition).values():
+        if lesson.lesson_datetime and lesson.lesson_datetime > now:
+            day = lesson.lesson_datetime.date()
+            days[day] = days.get(day, 0) + 1
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
+            text=f"📅 {list(DAYS_RU.values())[day.weekday()] if day.weekday() < 6 else ''} {day.strftime('%d.%m')} - занятий: {count}",
+            callback_data=f"day_shift_pick_{day.isoformat()}"
+        )]
+        for day, count in sorted(days.items())
+    ])
+    kb.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Вернуться в меню", callback_data="back_to_menu")])
+    
+    text = "📆 Выберите день, занятия которого нужно перенести или отменить:" if days else "📭 Предстоящих занятий нет."
+    await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
+
+async def day_shift_pick_handler(callback: types.CallbackQuery, partition: TutorPartition):
+    day = date.fromisoformat(callback.data.replace("day_shift_pick_", ""))
+    plan = plan_day_shift(partition, day, lessons_on_day(partition, day))
+    
+    if not plan:
+        await callback.answer("❌ На этот день занятий нет", show_alert=True)
+        return
+    
+    text = f"📆 Занятия {day.strftime('%d.%m.%Y')} и предлагаемое новое время:\n\n"
+    for lesson_id, lesson, new_datetime in plan:
+        target = new_datetime.strftime("%d.%m %H:%M") if new_datetime else "нет свободного времени"
+        text += f"• {lesson.time} {lesson.student_name} ({lesson.subject}) → {target}\n"
+    text += "\nПосле переноса или отмены день будет закрыт для записи."
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📬 Предложить перенос всем", callback_data=f"day_shift_send_{day.isoformat()}")],
+        [InlineKeyboardButton(text="❌ Отменить все занятия дня", callback_data=f"day_shift_cancel_{day.isoformat()}")],
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="day_shift")]
+    ])
+    await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
+
+async def day_shift_send_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
+    day = date.fromisoformat(callback.data.replace("day_shift_send_", ""))
+    # Повторное нажатие или повторная доставка не должны слать ученикам вторую просьбу
+    if is_day_closed(partition, day):
+        await callback.answer("⚠️ Этот день уже закрыт - просьбы о переносе отправлены раньше", show_alert=True)
+        return
+    
+    # План пересчитывается: с момента просмотра слоты могли занять
+    in_progress = lessons_being_rescheduled(partition)
+    lessons = [(lesson_id, lesson) for lesson_id, lesson in lessons_on_day(partition, day) if lesson_id not in in_progress]
+    plan = plan_day_shift(partition, day, lessons)
+    proposals = propose_day_shift(partition, plan)
+    if proposals is None:
+        await callback.answer("❌ Не удалось сохранить просьбы о переносе - попробуйте еще раз", show_alert=True)
+        return
+    day_closed = close_day(partition, day)
+    
+    messages = []
+    for reschedule_id, reschedule in proposals:
+        kb_student = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Согласен", callback_data=f"student_reschedule_agree_{reschedule_id}")],
+            [InlineKeyboardButton(text="❌ Не согласен", callback_data=f"student_reschedule_decline_{reschedule_id}")]
+        ])
+        messages.append((
+            reschedule.student_id,
+            f"📬 Просьба о переносе занятия\n\n"
+            f"Репетитор не сможет провести занятия {day.strftime('%d.%m.%Y')} и просит перенести занятие:\n\n"
+            f"📖 Предмет: {reschedule.subject}\n"
+            f"📅 Новая дата: {reschedule.new_lesson_datetime.strftime('%d.%m.%Y')}\n"
+            f"⏰ Новое время: {reschedule.new_lesson_datetime.strftime('%H:%M')}\n\n"
+            f"Вы согласны на перенос?",
+            kb_student
+        ))
+    sent, failed = await send_batch(bot, partition, messages)
+    
+    without_slot = [lesson for _, lesson, new_datetime in plan if new_datetime is None]
+    text = f"📬 Просьбы о переносе отправлены: {sent}"
+    if failed:
+        text += f"\n⚠️ Не доставлено: {failed}"
+    if not day_closed:
+        text += "\n⚠️ Не удалось закрыть день для записи"
+    if without_slot:
+        text += "\n\n⚠️ Не нашлось свободного времени:\n" + "\n".join(
+            f"• {lesson.time} {lesson.student_name}" for lesson in without_slot
+        )
+    
+    await callback.message.edit_text(text, reply_markup=day_shift_back_keyboard())
+    await callback.answer()
+
+async def day_shift_cancel_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
+    day = date.fromisoformat(callback.data.replace("day_shift_cancel_", ""))
+    cancelled = cancel_day_lessons(partition, lessons_on_day(partition, day))
+    day_closed = close_day(partition, day)
+    
+    texts: Dict[int, List[str]] = {}
+    for lesson_id, lesson in cancelled:
+        texts.setdefault(lesson.student_id, []).append(
+            f"❌ Репетитор отменил занятие {lesson.date_str} в {lesson.time} ({lesson.subject})."
+        )
+    sent, failed = await notify_students(bot, partition, texts)
+    
+    text = f"❌ Отменено занятий: {len(cancelled)}\n✉️ Уведомлено учеников: {sent}"
+    if failed:
+        text += f"\n⚠️ Не доставлено: {failed}"
+    if not day_closed:
+        text += "\n⚠️ Не удалось закрыть день для записи"
+    
+    await callback.message.edit_text(text, reply_markup=day_shift_back_keyboard())
+    await callback.answer()
+
+# ============================================================================
+# СТАТИСТИКА РЕПЕТИТОРА
+# ============================================================================
+
+async def stats_handler(callback: types.CallbackQuery, partition: TutorPartition):
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ Вернуться в меню", callback_data="back_to_menu")]
+    ])
+    await callback.message.edit_text(format_stats_message(partition_stats(partition)), reply_markup=kb)
+    await callback.answer()
+
+# ============================================================================
+# ЗАЯВКИ СПИСКОМ
+# ============================================================================
+
+def pending_conflicts(partition: TutorPartition, pending: Dict[str, PendingRequest]) -> set:
+    """Заявки, которые нельзя подтвердить: слот уже занят занятием, удерживается чужой заявкой
+    или достается более ранней заявке из того же списка"""
+    booked = get_booked_times(partition)
+    holds = get_active_holds(partition)
+    claimed = set()
+    conflicts = set()
+    
+    for request_id, request in sorted(pending.items(), key=lambda item: item[1].timestamp.timestamp() if item[1].timestamp else 0):
+        if not request.lesson_datetime:
+            conflicts.add(request_id)
+            continue
+        
+        key = slot_key(request.lesson_datetime)
+        hold = holds.get(key)
+        if key in booked or key in claimed or (hold and hold.request_id != request_id and is_slot_held(key, holds)):
+            conflicts.add(request_id)
+        else:
+            claimed.add(key)
+    
+    return conflicts
+
+def approve_requests(partition: TutorPartition, request_ids: List[str]) -> Tuple[Optional[List[Tuple[str, Lesson]]], List[str]]:
+    """Подтверждает заявки без конфликтов. Занятия, заявки и брони сохраняются по одному разу
+    на весь список: сначала занятия, потом заявки - как в confirm_request_handler.
+    Подтвержденных None - занятия не удалось сохранить, заявки остались как были."""
+    # Снимок статистики собирается до записи, иначе новые занятия учлись бы дважды
+    partition_stats(partition)
+    pending = partition.requests.load()
+    selected = {request_id: pending[request_id] for request_id in request_ids if request_id in pending}
+    conflicts = pending_conflicts(partition, selected)
+    confirmed = partition.lessons.load()
+    
+    approved = []
+    holds_changed = False
+    for request_id, request in selected.items():
+        if request_id in conflicts:
+            continue
+        
+        lesson = Lesson(
+            student_id=request.student_id,
+            student_name=request.student_name,
+            student_class=request.student_class,
+            subject=request.subject,
+            lesson_datetime=request.lesson_datetime,
+            status="confirmed",
+            timestamp=datetime.now(tz=MSK_TIMEZONE)
+        )
+        confirmed[create_request_id()] = lesson
+        del pending[request_id]
+        holds_changed |= release_hold(partition, request.lesson_datetime, request_id, save=False)
+        approved.append((request_id, lesson))
+    
+    if approved:
+        if not partition.lessons.save():
+            partition.requests.discard()
+            partition.holds.discard()
+            return None, sorted(conflicts)
+        partition.requests.save()
+        if holds_changed:
+            partition.holds.save()
+        
+        for request_id, lesson in approved:
+            cache_student_info(lesson.student_id, lesson.student_name, lesson.student_class)
+            record_stat(partition, "confirmed", lesson, lesson.lesson_datetime)
+        print(f"✅ Подтверждено заявок списком: {len(approved)}, с конфликтами: {len(conflicts)}")
+    
+    return approved, sorted(conflicts)
+
+def reject_requests(partition: TutorPartition, request_ids: List[str]) -> Optional[List[Tuple[str, PendingRequest]]]:
+    """Отклоняет заявки одной записью. None - файл заявок не удалось сохранить,
+    заявки и брони остались как были."""
+    pending = partition.requests.load()
+    
+    rejected = []
+    holds_changed = False
+    for request_id in request_ids:
+        request = pending.pop(request_id, None)
+        if request is None:
+            continue
+        holds_changed |= release_hold(partition, request.lesson_datetime, request_id, save=False)
+        rejected.append((request_id, request))
+    
+    if rejected:
+        if not partition.requests.save():
+            partition.holds.discard()
+            return None
+        if holds_changed:
+            partition.holds.save()
+        print(f"❌ Отклонено заявок списком: {len(rejected)}")
+    
+    return rejected
+
+async def notify_students(bot: Bot, partition: TutorPartition, texts: Dict[int, List[str]]) -> Tuple[int, int]:
+    """Одно сообщение на ученика через send_batch"""
+    return await send_batch(bot, partition, [
+        (student_id, "\n\n".join(parts), persistent_menu_keyboard()) for student_id, parts in texts.items()
+    ])
+
+def pending_page(partition: TutorPartition, selected: set, page: int) -> Tuple[str, InlineKeyboardMarkup]:
+    pending = partition.requests.load()
+    kb = InlineKeyboardMarkup(inline_keyboard=[])
+    
+    if not pending:
+        kb.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Вернуться в меню", callback_data="back_to_menu")])
+        return "📭 Новых заявок нет.", kb
+    
+    far_future = datetime.max.replace(tzinfo=MSK_TIMEZONE)
+    items = sorted(pending.items(), key=lambda item: item[1].lesson_datetime or far_future)
+    conflicts = pending_conflicts(partition, pending)
+    pages = math.ceil(len(items) / PENDING_PAGE_SIZE)
+    page = max(0, min(page, pages - 1))
+    
+    for request_id, request in items[page * PENDING_PAGE_SIZE:(page + 1) * PENDING_PAGE_SIZE]:
+        mark = "☑️" if request_id in selected else "⬜"
+        when = request.lesson_datetime.strftime("%d.%m %H:%M") if request.lesson_datetime else "?"
+        warning = " ⚠️" if request_id in conflicts else ""
+        kb.inline_keyboard.append([InlineKeyboardButton(
+            text=f"{mark} {when} {request.student_name} - {request.subject}{warning}",
+            callback_data=f"pending_toggle_{request_id}_{page}"
+        )])
+    
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"pending_page_{page - 1}"))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"pending_page_{page + 1}"))
+    if nav:
+        kb.inline_keyboard.append(nav)
+    
+    if selected:
+        kb.inline_keyboard.append([
+            InlineKeyboardButton(text=f"✅ Подтвердить ({len(selected)})", callback_data=f"pending_bulk_approve_{page}"),
+            InlineKeyboardButton(text=f"❌ Отклонить ({len(selected)})", callback_data=f"pending_bulk_reject_{page}")
+        ])
+    kb.inline_keyboard.append([InlineKeyboardButton(text="✅ Подтвердить все без конфликтов", callback_data=f"pending_bulk_all_{page}")])
+    kb.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Вернуться в меню", callback_data="back_to_menu")])
+    
+    text = (f"📥 Заявки на занятия: {len(pending)} (страница {page + 1}/{pages})\n"
+            f"Нажмите на заявку, чтобы отметить ее. ⚠️ - слот уже занят.")
+    return text, kb
+
+async def show_pending_page(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition,
+                            page: int, header: str = ""):
+    data = await state.get_data()
+    pending = partition.requests.load()
+    # Отметки обработанных в другом месте заявок больше не нужны
+    selected = {request_id for request_id in data.get("pending_selected", []) if request_id in pending}
+    await state.update_data(pending_selected=sorted(selected))
+    
+    text, kb = pending_page(partition, selected, page)
+    await callback.message.edit_text(header + text, reply_markup=kb)
+
+async def pending_list_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
+    await state.update_data(pending_selected=[])
+    await show_pending_page(callback, state, partition, 0)
+    await callback.answer()
+
+async def pending_page_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
+    await show_pending_page(callback, state, partition, int(callback.data.replace("pending_page_", "")))
+    await callback.answer()
+
+async def pending_toggle_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
+    request_id, page = callback.data.replace("pending_toggle_", "").rsplit("_", 1)
+    
+    selected = set((await state.get_data()).get("pending_selected", []))
+    selected ^= {request_id}
+    await state.update_data(pending_selected=sorted(selected))
+    
+    await show_pending_page(callback, state, partition, int(page))
+    await callback.answer()
+
+async def pending_bulk_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot, partition: TutorPartition):
+    action, page = callback.data.replace("pending_bulk_", "").rsplit("_", 1)
+    selected = (await state.get_data()).get("pending_selected", [])
+    
+    texts: Dict[int, List[str]] = {}
+    if action == "reject":
+        rejected = reject_requests(partition, selected)
+        if rejected is None:
+            await callback.answer("❌ Не удалось сохранить заявки - попробуйте еще раз", show_alert=True)
+            return
+        for request_id, request in rejected:
+            texts.setdefault(request.student_id, []).append(
+                f"❌ Ваш запрос на {request.lesson_datetime.strftime('%d.%m.%Y %H:%M')} отклонен.\n"
+                f"Репетитор не сможет провести занятие в выбранное время. Пожалуйста, выберите другое время."
+            )
+        header = f"❌ Отклонено: {len(rejected)}\n"
+    else:
+        request_ids = list(partition.requests.load()) if action == "all" else selected
+        approved, conflicts = approve_requests(partition, request_ids)
+        if approved is None:
+            await callback.answer("❌ Не удалось сохранить занятия - попробуйте еще раз", show_alert=True)
+            return
+        for request_id, lesson in approved:
+            texts.setdefault(lesson.student_id, []).append(
+                f"✅ Ваш запрос подтвержден!\n📅 Дата: {lesson.date_str}\n⏰ Время: {lesson.time}\n📖 Предмет: {lesson.subject}"
+            )
+        header = f"✅ Подтверждено: {len(approved)}" + (f", ⚠️ с конфликтами: {len(conflicts)}" if conflicts else "") + "\n"
+    
+    await state.update_data(pending_selected=[])
+    sent, failed = await notify_students(bot, partition, texts)
+    if failed:
+        header += f"✉️ Не доставлено уведомлений: {failed}\n"
+    
+    await show_pending_page(callback, state, partition, int(page), header + "\n")
+    await callback.answer()
+
 # ============================================================================
 # УВЕДОМЛЕНИЕ ВСЕХ УЧЕНИКОВ
 # ============================================================================
@@ -1680,7 +4386,7 @@ async def broadcast_message_handler(callback: types.CallbackQuery, state: FSMCon
     
     await callback.answer()
 
-async def broadcast_text_handler(message: types.Message, state: FSMContext, bot: Bot):
+async def broadcast_text_handler(message: types.Message, state: FSMContext, bot: Bot, partition: TutorPartition):
     current_state = await state.get_state()
     
     if current_state != BroadcastMessageStates.waiting_for_message:
@@ -1692,7 +4398,7 @@ async def broadcast_text_handler(message: types.Message, state: FSMContext, bot:
         await message.answer("❌ Пожалуйста, введите текст сообщения")
         return
     
-    students = get_all_students()
+    students = get_all_students(partition)
     
     if not students:
         await message.answer(
@@ -1733,9 +4439,9 @@ async def broadcast_text_handler(message: types.Message, state: FSMContext, bot:
 # ИСПРАВЛЕННЫЕ ОБРАБОТЧИКИ ДЛЯ ПЕРЕНОСА ЗАНЯТИЙ
 # ============================================================================
 
-async def reschedule_lesson_handler(callback: types.CallbackQuery, state: FSMContext):
+async def reschedule_lesson_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
     print("📞 reschedule_lesson_handler вызван")
-    lessons = get_student_lessons(callback.from_user.id)
+    lessons = get_student_lessons(partition, callback.from_user.id)
     print(f"📞 lessons: {lessons}")
     
     if not lessons:
@@ -1765,13 +4471,13 @@ async def reschedule_lesson_handler(callback: types.CallbackQuery, state: FSMCon
     
     await callback.answer()
 
-async def reschedule_pick_handler(callback: types.CallbackQuery, state: FSMContext):
+async def reschedule_pick_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
     print(f"📞 reschedule_pick_handler вызван, data: {callback.data}")
     lesson_id = callback.data.replace("reschedule_pick_", "")
     print(f"📞 lesson_id: {lesson_id}")
     
-    confirmed = load_json(CONFIRMED_FILE)
-    print(f"📞 confirmed keys: {list(confirmed.keys())}")
+    confirmed = all_lessons(partition)
+    print(f"📞 confirmed: {len(confirmed)} занятий")
     
     if lesson_id not in confirmed:
         await callback.answer("❌ Занятие не найдено", show_alert=True)
@@ -1780,50 +4486,15 @@ async def reschedule_pick_handler(callback: types.CallbackQuery, state: FSMConte
     lesson = confirmed[lesson_id]
     print(f"📞 lesson: {lesson}")
     
-    # Гарантируем наличие date_str и time
-    if "date_str" not in lesson or "time" not in lesson:
-        try:
-            dt = datetime.fromisoformat(lesson.get("lesson_datetime", ""))
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=MSK_TIMEZONE)
-            lesson["date_str"] = dt.strftime("%d.%m.%Y")
-            lesson["time"] = dt.strftime("%H:%M")
-        except Exception as e:
-            print(f"⚠️ Ошибка генерации даты/времени: {e}")
-            lesson["date_str"] = "??.??.????"
-            lesson["time"] = "??:??"
+    await state.update_data(reschedule_lesson_id=lesson_id, reschedule_subject=lesson.subject or "Неизвестный предмет")
     
-    await state.update_data(reschedule_lesson_id=lesson_id, reschedule_subject=lesson.get("subject", "Неизвестный предмет"))
-    
-    week = get_week_dates()
-    schedule = load_json(SCHEDULE_FILE) or DEFAULT_SCHEDULE
+    schedule = load_json(partition.schedule_file) or DEFAULT_SCHEDULE
     print(f"📞 schedule: {schedule}")
     
-    days_ru = {
-        "Monday": "Понедельник",
-        "Tuesday": "Вторник",
-        "Wednesday": "Среда",
-        "Thursday": "Четверг",
-        "Friday": "Пятница",
-        "Saturday": "Суббота"
-    }
-    
-    kb = InlineKeyboardMarkup(inline_keyboard=[])
-    added_days = 0
-    
-    for day_name in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]:
-        times = get_available_times(day_name, schedule)
-        print(f"📞 day {day_name} times: {times}")
-        if times:
-            date_obj, date_str = week[day_name]
-            btn_text = f"{days_ru[day_name]}, {date_str}"
-            kb.inline_keyboard.append([
-                InlineKeyboardButton(text=btn_text, callback_data=f"reschedule_day_{day_name}")
-            ])
-            added_days += 1
+    week_offset = first_week_with_slots(partition, schedule)
     
     # Если нет доступных дней, сообщаем об этом и возвращаемся
-    if added_days == 0:
+    if week_offset is None:
         await callback.answer("❌ Нет доступных дней для переноса", show_alert=True)
         await callback.message.edit_text(
             "❌ Нет доступных дней для переноса. Попробуйте позже.",
@@ -1833,9 +4504,7 @@ async def reschedule_pick_handler(callback: types.CallbackQuery, state: FSMConte
         )
         return
     
-    kb.inline_keyboard.append([
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_menu")]
-    ])
+    kb = calendar_keyboard(partition, "reschedule", week_offset, schedule)
     
     try:
         await callback.message.edit_text("📅 Выберите новый день:", reply_markup=kb)
@@ -1850,13 +4519,13 @@ async def reschedule_pick_handler(callback: types.CallbackQuery, state: FSMConte
     await state.set_state(RescheduleStates.waiting_for_new_time)
     await callback.answer()
 
-async def reschedule_day_handler(callback: types.CallbackQuery, state: FSMContext):
+async def reschedule_day_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
     day_name = callback.data.replace("reschedule_day_", "")
     print(f"📞 reschedule_day_handler: day={day_name}")
     
-    schedule = load_json(SCHEDULE_FILE) or DEFAULT_SCHEDULE
+    schedule = load_json(partition.schedule_file) or DEFAULT_SCHEDULE
     
-    times = get_available_times(day_name, schedule)
+    times = get_available_times(partition, day_name, schedule)
     
     if not times:
         await callback.answer("❌ На этот день нет доступных свободных времен")
@@ -1867,13 +4536,13 @@ async def reschedule_day_handler(callback: types.CallbackQuery, state: FSMContex
     ])
     
     kb.inline_keyboard.append([
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_menu")]
+        InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_menu")
     ])
     
     await callback.message.edit_text("⏰ Выберите новое время:", reply_markup=kb)
     await callback.answer()
 
-async def reschedule_confirm_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
+async def reschedule_confirm_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot, partition: TutorPartition):
     parts = callback.data.split("_")
     day_name = parts[2]
     time_str = "_".join(parts[3:])
@@ -1885,22 +4554,21 @@ async def reschedule_confirm_handler(callback: types.CallbackQuery, state: FSMCo
     subject = data.get("reschedule_subject")
     student_id = callback.from_user.id
     
-    if is_time_slot_booked(day_name, time_str):
+    if is_time_slot_booked(partition, day_name, time_str):
         await callback.answer("❌ Это время уже занято. Пожалуйста, выберите другое.", show_alert=True)
         return
     
     student_info = get_student_info_from_any_source(student_id)
     
     if not student_info:
-        confirmed = load_json(CONFIRMED_FILE)
-        lesson = confirmed.get(lesson_id, {})
-        student_name = lesson.get("student_name", "Ученик")
-        student_class = lesson.get("student_class", "")
+        lesson = all_lessons(partition).get(lesson_id) or Lesson()
+        student_name = lesson.student_name or "Ученик"
+        student_class = lesson.student_class or ""
         print(f"⚠️ ВНИМАНИЕ: данные {student_id} восстановлены из lessons: {student_name} ({student_class})")
         cache_student_info(student_id, student_name, student_class)
     else:
-        student_name = student_info["name"]
-        student_class = student_info["grade"]
+        student_name = student_info.name
+        student_class = student_info.grade
         print(f"✅ Загружены данные для переноса: {student_name} ({student_class}) - ID: {student_id}")
     
     new_lesson_datetime = get_lesson_datetime(day_name, time_str)
@@ -1911,19 +4579,20 @@ async def reschedule_confirm_handler(callback: types.CallbackQuery, state: FSMCo
     
     reschedule_id = create_request_id()
     
-    pending_reschedules = load_json(PENDING_RESCHEDULES_FILE)
-    pending_reschedules[reschedule_id] = {
-        "lesson_id": lesson_id,
-        "student_id": student_id,
-        "student_name": student_name,
-        "student_class": student_class,
-        "subject": subject,
-        "new_lesson_datetime": new_lesson_datetime.isoformat(),
-        "timestamp": datetime.now(tz=MSK_TIMEZONE).isoformat(),
-        "status": "pending"
-    }
+    pending_reschedules = partition.reschedules.load()
+    pending_reschedules[reschedule_id] = RescheduleRequest(
+        lesson_id=lesson_id,
+        student_id=student_id,
+        student_name=student_name,
+        student_class=student_class,
+        subject=subject,
+        new_lesson_datetime=new_lesson_datetime,
+        timestamp=datetime.now(tz=MSK_TIMEZONE),
+        status="pending"
+    )
     
-    save_json(PENDING_RESCHEDULES_FILE, pending_reschedules)
+    partition.reschedules.save()
+    track_request(partition, "reschedules", reschedule_id, pending_reschedules[reschedule_id])
     
     print(f"📝 Создан запрос на перенос занятия: {reschedule_id} - {student_name} ({student_class})")
     
@@ -1931,7 +4600,7 @@ async def reschedule_confirm_handler(callback: types.CallbackQuery, state: FSMCo
     lesson_time_str = new_lesson_datetime.strftime("%H:%M")
     
     msg_tutor = await bot.send_message(
-        TUTOR_ID,
+        partition.tutor_id,
         f"📍 Запрос на перенос занятия!\n\n"
         f"👤 Ученик: {student_name}\n"
         f"📚 Класс: {student_class}\n"
@@ -1941,7 +4610,7 @@ async def reschedule_confirm_handler(callback: types.CallbackQuery, state: FSMCo
         reply_markup=tutor_reschedule_confirm_keyboard(reschedule_id),
         parse_mode="HTML"
     )
-    log_message(TUTOR_ID, msg_tutor.message_id)
+    log_message(partition.tutor_id, msg_tutor.message_id)
     
     await callback.message.edit_text(
         f"✅ Запрос на перенос отправлен!\n\n"
@@ -1956,10 +4625,10 @@ async def reschedule_confirm_handler(callback: types.CallbackQuery, state: FSMCo
     await state.clear()
     await callback.answer()
 
-async def confirm_reschedule_handler(callback: types.CallbackQuery, bot: Bot):
+async def confirm_reschedule_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
     reschedule_id = callback.data.replace("confirm_reschedule_", "")
     
-    pending_reschedules = load_json(PENDING_RESCHEDULES_FILE)
+    pending_reschedules = partition.reschedules.load()
     
     if reschedule_id not in pending_reschedules:
         await callback.answer("❌ Запрос не найден", show_alert=True)
@@ -1967,38 +4636,32 @@ async def confirm_reschedule_handler(callback: types.CallbackQuery, bot: Bot):
     
     reschedule = pending_reschedules[reschedule_id]
     
-    lesson_id = reschedule["lesson_id"]
-    student_id = reschedule["student_id"]
-    student_name = reschedule["student_name"]
-    student_class = reschedule["student_class"]
-    subject = reschedule["subject"]
-    new_datetime_str = reschedule["new_lesson_datetime"]
+    lesson_id = reschedule.lesson_id
+    student_id = reschedule.student_id
+    student_name = reschedule.student_name
+    student_class = reschedule.student_class
+    subject = reschedule.subject
+    new_datetime = reschedule.new_lesson_datetime
     
-    cache_student_info(student_id, student_name, student_class)
+    if is_slot_booked(partition, new_datetime):
+        await callback.answer("❌ Это время уже занято другим занятием - отклоните перенос", show_alert=True)
+        return
     
-    confirmed = load_json(CONFIRMED_FILE)
+    cache_student_info(student_id, student_name, student_class)
     
-    if lesson_id in confirmed:
-        confirmed[lesson_id]["lesson_datetime"] = new_datetime_str
-        
-        new_datetime = datetime.fromisoformat(new_datetime_str)
-        if new_datetime.tzinfo is None:
-            new_datetime = new_datetime.replace(tzinfo=MSK_TIMEZONE)
-        
-        confirmed[lesson_id]["date_str"] = new_datetime.strftime("%d.%m.%Y")
-        confirmed[lesson_id]["time"] = new_datetime.strftime("%H:%M")
-        
-        save_json(CONFIRMED_FILE, confirmed)
+    freed_slot = move_lesson(partition, lesson_id, new_datetime)
+    if freed_slot is None and lesson_id in all_lessons(partition):
+        await callback.answer("❌ Не удалось сохранить перенос - попробуйте еще раз", show_alert=True)
+        return
     
     del pending_reschedules[reschedule_id]
-    save_json(PENDING_RESCHEDULES_FILE, pending_reschedules)
+    partition.reschedules.save()
+    release_hold(partition, reschedule.new_lesson_datetime, reschedule_id)
+    if freed_slot:
+        record_stat(partition, "rescheduled", reschedule, new_datetime)
     
     print(f"✅ Перенос занятия подтвержден: {reschedule_id} - {student_name} ({student_class})")
     
-    new_datetime = datetime.fromisoformat(new_datetime_str)
-    if new_datetime.tzinfo is None:
-        new_datetime = new_datetime.replace(tzinfo=MSK_TIMEZONE)
-    
     date_str = new_datetime.strftime("%d.%m.%Y")
     time_str = new_datetime.strftime("%H:%M")
     
@@ -2020,11 +4683,12 @@ async def confirm_reschedule_handler(callback: types.CallbackQuery, bot: Bot):
     )
     
     await callback.answer("✅ Перенос подтвержден")
+    await offer_freed_slot(bot, partition, freed_slot)
 
-async def reject_reschedule_handler(callback: types.CallbackQuery, bot: Bot):
+async def reject_reschedule_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
     reschedule_id = callback.data.replace("reject_reschedule_", "")
     
-    pending_reschedules = load_json(PENDING_RESCHEDULES_FILE)
+    pending_reschedules = partition.reschedules.load()
     
     if reschedule_id not in pending_reschedules:
         await callback.answer("❌ Запрос не найден", show_alert=True)
@@ -2032,11 +4696,12 @@ async def reject_reschedule_handler(callback: types.CallbackQuery, bot: Bot):
     
     reschedule = pending_reschedules[reschedule_id]
     
-    student_id = reschedule["student_id"]
-    student_name = reschedule["student_name"]
+    student_id = reschedule.student_id
+    student_name = reschedule.student_name
     
     del pending_reschedules[reschedule_id]
-    save_json(PENDING_RESCHEDULES_FILE, pending_reschedules)
+    partition.reschedules.save()
+    release_hold(partition, reschedule.new_lesson_datetime, reschedule_id)
     
     print(f"❌ Перенос занятия отклонен: {reschedule_id} - {student_name}")
     
@@ -2058,8 +4723,8 @@ async def reject_reschedule_handler(callback: types.CallbackQuery, bot: Bot):
     
     await callback.answer("❌ Перенос отклонен")
 
-async def cancel_lesson_handler(callback: types.CallbackQuery, state: FSMContext):
-    lessons = get_student_lessons(callback.from_user.id)
+async def cancel_lesson_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
+    lessons = get_student_lessons(partition, callback.from_user.id)
     
     if not lessons:
         await callback.message.edit_text(
@@ -2078,10 +4743,10 @@ async def cancel_lesson_handler(callback: types.CallbackQuery, state: FSMContext
     
     await callback.answer()
 
-async def cancel_pick_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
+async def cancel_pick_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot, partition: TutorPartition):
     lesson_id = callback.data.replace("cancel_pick_", "")
     
-    confirmed = load_json(CONFIRMED_FILE)
+    confirmed = all_lessons(partition)
     
     if lesson_id not in confirmed:
         await callback.answer("❌ Занятие не найдено", show_alert=True)
@@ -2094,51 +4759,48 @@ async def cancel_pick_handler(callback: types.CallbackQuery, state: FSMContext,
     student_info = get_student_info_from_any_source(student_id)
     
     if not student_info:
-        student_name = lesson.get("student_name", "Ученик")
-        student_class = lesson.get("student_class", "")
+        student_name = lesson.student_name or "Ученик"
+        student_class = lesson.student_class or ""
         print(f"⚠️ ВНИМАНИЕ: данные {student_id} восстановлены из lessons: {student_name} ({student_class})")
         cache_student_info(student_id, student_name, student_class)
     else:
-        student_name = student_info["name"]
-        student_class = student_info["grade"]
+        student_name = student_info.name
+        student_class = student_info.grade
     
     cancel_id = create_request_id()
     
-    pending_cancels = load_json(PENDING_CANCELS_FILE)
-    pending_cancels[cancel_id] = {
-        "lesson_id": lesson_id,
-        "student_id": student_id,
-        "student_name": student_name,
-        "student_class": student_class,
-        "subject": lesson["subject"],
-        "lesson_datetime": lesson["lesson_datetime"],
-        "timestamp": datetime.now(tz=MSK_TIMEZONE).isoformat(),
-        "status": "pending"
-    }
+    pending_cancels = partition.cancels.load()
+    pending_cancels[cancel_id] = CancelRequest(
+        lesson_id=lesson_id,
+        student_id=student_id,
+        student_name=student_name,
+        student_class=student_class,
+        subject=lesson.subject,
+        lesson_datetime=lesson.lesson_datetime,
+        timestamp=datetime.now(tz=MSK_TIMEZONE),
+        status="pending"
+    )
     
-    save_json(PENDING_CANCELS_FILE, pending_cancels)
+    partition.cancels.save()
+    track_request(partition, "cancels", cancel_id, pending_cancels[cancel_id])
     
     print(f"📝 Создан запрос на отмену занятия: {cancel_id} - {student_name}")
     
-    lesson_datetime = datetime.fromisoformat(lesson["lesson_datetime"])
-    if lesson_datetime.tzinfo is None:
-        lesson_datetime = lesson_datetime.replace(tzinfo=MSK_TIMEZONE)
-    
-    lesson_date_str = lesson_datetime.strftime("%d.%m.%Y")
-    lesson_time_str = lesson_datetime.strftime("%H:%M")
+    lesson_date_str = lesson.date_str
+    lesson_time_str = lesson.time
     
     msg_tutor = await bot.send_message(
-        TUTOR_ID,
+        partition.tutor_id,
         f"📋 Запрос на отмену занятия!\n\n"
         f"👤 Ученик: {student_name}\n"
         f"📚 Класс: {student_class}\n"
-        f"📖 Предмет: {lesson['subject']}\n"
+        f"📖 Предмет: {lesson.subject}\n"
         f"📅 Дата: {lesson_date_str}\n"
         f"⏰ Время: {lesson_time_str}",
         reply_markup=tutor_cancel_confirm_keyboard(cancel_id),
         parse_mode="HTML"
     )
-    log_message(TUTOR_ID, msg_tutor.message_id)
+    log_message(partition.tutor_id, msg_tutor.message_id)
     
     await callback.message.edit_text(
         f"✅ Запрос на отмену отправлен!\n\n"
@@ -2152,10 +4814,10 @@ async def cancel_pick_handler(callback: types.CallbackQuery, state: FSMContext,
     await state.clear()
     await callback.answer()
 
-async def confirm_cancel_handler(callback: types.CallbackQuery, bot: Bot):
+async def confirm_cancel_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
     cancel_id = callback.data.replace("confirm_cancel_", "")
     
-    pending_cancels = load_json(PENDING_CANCELS_FILE)
+    pending_cancels = partition.cancels.load()
     
     if cancel_id not in pending_cancels:
         await callback.answer("❌ Запрос не найден", show_alert=True)
@@ -2163,18 +4825,19 @@ async def confirm_cancel_handler(callback: types.CallbackQuery, bot: Bot):
     
     cancel = pending_cancels[cancel_id]
     
-    lesson_id = cancel["lesson_id"]
-    student_id = cancel["student_id"]
-    student_name = cancel["student_name"]
-    
-    confirmed = load_json(CONFIRMED_FILE)
+    lesson_id = cancel.lesson_id
+    student_id = cancel.student_id
+    student_name = cancel.student_name
     
-    if lesson_id in confirmed:
-        del confirmed[lesson_id]
-        save_json(CONFIRMED_FILE, confirmed)
+    freed_slot = remove_lesson(partition, lesson_id)
+    if freed_slot is None and lesson_id in all_lessons(partition):
+        await callback.answer("❌ Не удалось сохранить отмену - попробуйте еще раз", show_alert=True)
+        return
     
     del pending_cancels[cancel_id]
-    save_json(PENDING_CANCELS_FILE, pending_cancels)
+    partition.cancels.save()
+    if freed_slot:
+        record_stat(partition, "cancelled", cancel, freed_slot)
     
     print(f"✅ Отмена занятия подтверждена: {cancel_id} - {student_name}")
     
@@ -2194,11 +4857,12 @@ async def confirm_cancel_handler(callback: types.CallbackQuery, bot: Bot):
     )
     
     await callback.answer("✅ Отмена подтверждена")
+    await offer_freed_slot(bot, partition, freed_slot)
 
-async def reject_cancel_handler(callback: types.CallbackQuery, bot: Bot):
+async def reject_cancel_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
     cancel_id = callback.data.replace("reject_cancel_", "")
     
-    pending_cancels = load_json(PENDING_CANCELS_FILE)
+    pending_cancels = partition.cancels.load()
     
     if cancel_id not in pending_cancels:
         await callback.answer("❌ Запрос не найден", show_alert=True)
@@ -2206,11 +4870,11 @@ async def reject_cancel_handler(callback: types.CallbackQuery, bot: Bot):
     
     cancel = pending_cancels[cancel_id]
     
-    student_id = cancel["student_id"]
-    student_name = cancel["student_name"]
+    student_id = cancel.student_id
+    student_name = cancel.student_name
     
     del pending_cancels[cancel_id]
-    save_json(PENDING_CANCELS_FILE, pending_cancels)
+    partition.cancels.save()
     
     print(f"❌ Отмена занятия отклонена: {cancel_id} - {student_name}")
     
@@ -2232,6 +4896,116 @@ async def reject_cancel_handler(callback: types.CallbackQuery, bot: Bot):
     
     await callback.answer("❌ Отмена отклонена")
 
+async def waitlist_join_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
+    parts = callback.data.split("_")
+    day_name = parts[2]
+    time_str = "_".join(parts[3:])
+    
+    lesson_datetime = get_lesson_datetime(day_name, time_str)
+    if not lesson_datetime:
+        await callback.answer("❌ Ошибка: не удалось определить время занятия")
+        return
+    
+    data = await state.get_data()
+    student_id = callback.from_user.id
+    student_info = get_student_info_from_any_source(student_id)
+    student_name = data.get("student_name") or (student_info.name if student_info else "Гость")
+    student_class = data.get("class_grade") or (student_info.grade if student_info else "")
+    subject = data.get("subject", "")
+    
+    position = join_waitlist(partition, student_id, student_name, student_class, subject, lesson_datetime)
+    await state.clear()
+    
+    await callback.message.edit_text(
+        f"🔔 Вы в листе ожидания!\n\n"
+        f"📅 Дата: {lesson_datetime.strftime('%d.%m.%Y')}\n"
+        f"⏰ Время: {lesson_datetime.strftime('%H:%M')}\n"
+        f"Ваша позиция: {position}\n\n"
+        f"Если слот освободится, бот сразу предложит его вам.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📌 В главное меню", callback_data="back_to_menu")]
+        ])
+    )
+    await callback.answer()
+
+async def waitlist_accept_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
+    entry_id = callback.data.replace("waitlist_accept_", "")
+    
+    entries = partition.waitlist.load()
+    entry = entries.get(entry_id)
+    
+    if entry is None or not entry.offered_until or entry.offered_until <= datetime.now(tz=MSK_TIMEZONE):
+        await callback.answer("❌ Предложение уже недействительно", show_alert=True)
+        return
+    
+    if slot_key(entry.lesson_datetime) in get_booked_times(partition):
+        leave_waitlist(partition, entry_id)
+        await callback.answer("❌ Это время уже занято", show_alert=True)
+        return
+    
+    del entries[entry_id]
+    partition.waitlist.save()
+    
+    # Бронь предложения переходит к заявке: track_request перезаписывает ее с новым сроком
+    request_id = create_request_id()
+    pending = partition.requests.load()
+    pending[request_id] = PendingRequest(
+        student_id=entry.student_id,
+        student_name=entry.student_name,
+        student_class=entry.student_class,
+        subject=entry.subject,
+        lesson_datetime=entry.lesson_datetime,
+        timestamp=datetime.now(tz=MSK_TIMEZONE),
+        status="pending",
+        type="waitlist"
+    )
+    
+    partition.requests.save()
+    track_request(partition, "requests", request_id, pending[request_id])
+    print(f"📝 Создан запрос из листа ожидания: {request_id} - {entry.student_name}")
+    
+    lesson_date_str = entry.lesson_datetime.strftime("%d.%m.%Y")
+    lesson_time_str = entry.lesson_datetime.strftime("%H:%M")
+    
+    msg_tutor = await bot.send_message(
+        partition.tutor_id,
+        f"📋 Новый запрос на занятие (из листа ожидания)!\n\n"
+        f"👤 Ученик: {entry.student_name}\n"
+        f"📚 Класс: {entry.student_class}\n"
+        f"📖 Предмет: {entry.subject}\n"
+        f"📅 Дата: {lesson_date_str}\n"
+        f"⏰ Время: {lesson_time_str}",
+        reply_markup=tutor_confirm_keyboard(request_id),
+        parse_mode="HTML"
+    )
+    log_message(partition.tutor_id, msg_tutor.message_id)
+    
+    await callback.message.edit_text(
+        f"✅ Запрос отправлен!\n\n"
+        f"Репетитор рассмотрит ваш запрос.\n"
+        f"Время занятия: {lesson_date_str} {lesson_time_str}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📌 В главное меню", callback_data="back_to_menu")]
+        ])
+    )
+    await callback.answer()
+
+async def waitlist_decline_handler(callback: types.CallbackQuery, bot: Bot, partition: TutorPartition):
+    entry_id = callback.data.replace("waitlist_decline_", "")
+    
+    entry = leave_waitlist(partition, entry_id)
+    
+    await callback.message.edit_text(
+        "👌 Вы вышли из листа ожидания.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📌 В главное меню", callback_data="back_to_menu")]
+        ])
+    )
+    await callback.answer()
+    
+    if entry is not None:
+        await offer_freed_slot(bot, partition, entry.lesson_datetime)
+
 async def back_to_menu_handler(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     
@@ -2241,6 +5015,32 @@ async def back_to_menu_handler(callback: types.CallbackQuery, state: FSMContext)
     
     await callback.answer()
 
+async def choose_tutor_handler(callback: types.CallbackQuery):
+    await callback.message.edit_text("👩‍🏫 Выберите репетитора:", reply_markup=tutors_keyboard())
+    await callback.answer()
+
+async def choose_tutor_pick_handler(callback: types.CallbackQuery, state: FSMContext):
+    user_id = callback.from_user.id
+    
+    try:
+        tutor_id = int(callback.data.replace("choose_tutor_", ""))
+    except ValueError:
+        await callback.answer("❌ Репетитор не найден", show_alert=True)
+        return
+    
+    if tutor_id not in PARTITIONS or is_tutor(user_id):
+        await callback.answer("❌ Репетитор не найден", show_alert=True)
+        return
+    
+    route_student(user_id, tutor_id)
+    await state.clear()
+    
+    await callback.message.edit_text(
+        f"✅ Ваш репетитор: {PARTITIONS[tutor_id].name}\n\n📌 Главное меню",
+        reply_markup=main_menu_keyboard(user_id)
+    )
+    await callback.answer()
+
 # ============================================================================
 # РАСПИСАНИЕ (ИНТЕРАКТИВНОЕ РЕДАКТИРОВАНИЕ)
 # ============================================================================
@@ -2266,16 +5066,16 @@ async def interactive_day_select_handler(callback: types.CallbackQuery, state: F
     
     await callback.answer()
 
-async def interactive_save_handler(callback: types.CallbackQuery, state: FSMContext):
+async def interactive_save_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
     data = await state.get_data()
     
     interactive_schedule = data.get("interactive_schedule", {})
     
     print(f"📊 Сохраняю расписание: {interactive_schedule}")
     
-    save_json(SCHEDULE_FILE, interactive_schedule)
+    save_json(partition.schedule_file, interactive_schedule)
     
-    verification = load_json(SCHEDULE_FILE)
+    verification = load_json(partition.schedule_file)
     print(f"📊 Проверка: {verification}")
     
     await callback.message.edit_text(
@@ -2345,8 +5145,8 @@ async def interactive_time_input_handler(message: types.Message, state: FSMConte
     
     await state.set_state(InteractiveScheduleStates.choosing_day)
 
-async def edit_schedule_button_handler(callback: types.CallbackQuery, state: FSMContext):
-    current_schedule = load_json(SCHEDULE_FILE) or DEFAULT_SCHEDULE
+async def edit_schedule_button_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
+    current_schedule = load_json(partition.schedule_file) or DEFAULT_SCHEDULE
     
     print(f"📊 {current_schedule}")
     
@@ -2360,6 +5160,7 @@ async def edit_schedule_button_handler(callback: types.CallbackQuery, state: FSM
         [InlineKeyboardButton(text="📅 Пятница", callback_data="iday_Friday"),
          InlineKeyboardButton(text="📅 Суббота", callback_data="iday_Saturday")],
         [InlineKeyboardButton(text="✅ Сохранить расписание", callback_data="save_schedule")],
+        [InlineKeyboardButton(text="📆 Исключения и отпуск", callback_data="schedule_rules")],
         [InlineKeyboardButton(text="⬅️ В главное меню", callback_data="back_to_menu")]
     ])
     
@@ -2399,6 +5200,457 @@ async def back_to_schedule_menu_handler(callback: types.CallbackQuery, state: FS
     
     await callback.answer()
 
+# ============================================================================
+# ИСКЛЮЧЕНИЯ РАСПИСАНИЯ И ОТПУСК
+# ============================================================================
+
+SCHEDULE_RULES_HELP = (
+    "Отправьте правило сообщением:\n"
+    "• <code>25.12.2026 нет</code> - выходной день\n"
+    "• <code>25.12.2026 12:00</code> - в этот день занятия с 12:00\n"
+    "• <code>30.12.2026-08.01.2027</code> - отпуск\n"
+    "• <code>удалить 25.12.2026</code> - убрать исключение или отпуск с этой даты"
+)
+
+def format_schedule_rules(rules: Dict) -> str:
+    lines = []
+    for day_str, times in sorted(rules["overrides"].items()):
+        day_text = date.fromisoformat(day_str).strftime("%d.%m.%Y")
+        lines.append(f"📅 {day_text}: {'❌ нет занятий' if not isinstance(times, list) else ', '.join(times)}")
+    for start_str, end_str in sorted(rules["holidays"].items()):
+        lines.append(f"🏖 {date.fromisoformat(start_str).strftime('%d.%m.%Y')} - {date.fromisoformat(end_str).strftime('%d.%m.%Y')}")
+    
+    return "\n".join(lines) if lines else "Исключений нет."
+
+def schedule_rules_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ Вернуться в меню расписания", callback_data="edit_schedule")]
+    ])
+
+def parse_rule_date(text: str) -> Optional[date]:
+    try:
+        return datetime.strptime(text.strip(), "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+async def schedule_rules_handler(callback: types.CallbackQuery, state: FSMContext, partition: TutorPartition):
+    rules = load_schedule_rules(partition)
+    
+    await callback.message.edit_text(
+        f"📆 <b>Исключения и отпуск</b>\n\n{format_schedule_rules(rules)}\n\n{SCHEDULE_RULES_HELP}",
+        reply_markup=schedule_rules_keyboard(),
+        parse_mode="HTML"
+    )
+    await state.set_state(ScheduleRulesStates.waiting_for_rule)
+    await callback.answer()
+
+async def schedule_rule_input_handler(message: types.Message, state: FSMContext, partition: TutorPartition):
+    text = (message.text or "").strip()
+    rules = load_schedule_rules(partition)
+    affected: Tuple[Optional[date], Optional[date]] = (None, None)
+    
+    if text.lower().startswith("удалить"):
+        day = parse_rule_date(text[len("удалить"):])
+        if day is None:
+            await message.answer("❌ Не понял дату. Пример: удалить 25.12.2026")
+            return
+        removed = rules["overrides"].pop(day.isoformat(), None) is not None
+        removed = rules["holidays"].pop(day.isoformat(), None) is not None or removed
+        if not removed:
+            await message.answer("❌ С этой даты исключений нет")
+            return
+    elif "-" in text and " " not in text:
+        start_text, _, end_text = text.partition("-")
+        start, end = parse_rule_date(start_text), parse_rule_date(end_text)
+        if start is None or end is None or end < start:
+            await message.answer("❌ Не понял период. Пример: 30.12.2026-08.01.2027")
+            return
+        rules["holidays"][start.isoformat()] = end.isoformat()
+        affected = (start, end)
+    else:
+        day_text, _, time_text = text.partition(" ")
+        day = parse_rule_date(day_text)
+        time_input = parse_time_input(time_text) if time_text else "invalid"
+        if day is None or time_input == "invalid":
+            await message.answer("❌ Не понял правило.\n\n" + SCHEDULE_RULES_HELP, parse_mode="HTML")
+            return
+        if time_input is None:
+            rules["overrides"][day.isoformat()] = "нет"
+            affected = (day, day)
+        else:
+            rules["overrides"][day.isoformat()] = generate_time_slots(*time_input)
+    
+    save_json(partition.schedule_rules_file, rules)
+    print(f"📆 Правила расписания обновлены: {text}")
+    
+    warning = ""
+    if affected[0]:
+        start = datetime.combine(affected[0], datetime.min.time(), tzinfo=MSK_TIMEZONE)
+        end = datetime.combine(affected[1], datetime.min.time(), tzinfo=MSK_TIMEZONE) + timedelta(days=1)
+        clashes = [
+            lesson for lesson in all_lessons(partition).values()
+            if lesson.lesson_datetime and start <= lesson.lesson_datetime < end
+        ]
+        if clashes:
+            warning = f"\n\n⚠️ На эти даты уже есть занятия ({len(clashes)}) - их нужно перенести или отменить."
+    
+    await message.answer(
+        f"✅ Сохранено!\n\n{format_schedule_rules(rules)}{warning}",
+        reply_markup=schedule_rules_keyboard()
+    )
+
+# ============================================================================
+# КАЛЕНДАРЬ (ICS)
+# ============================================================================
+
+ICS_SEMAPHORE = asyncio.Semaphore(ICS_MAX_CONCURRENT)
+
+def ics_token(user_id: int) -> str:
+    """Токен ссылки на календарь: id пользователя и HMAC от него"""
+    signature = hmac.new(ICS_SECRET.encode(), str(user_id).encode(), hashlib.sha256).hexdigest()[:32]
+    return f"{user_id}-{signature}"
+
+def verify_ics_token(token: str) -> Optional[int]:
+    user_id_str, _, signature = token.partition("-")
+    try:
+        user_id = int(user_id_str)
+    except ValueError:
+        return None
+    
+    expected = ics_token(user_id).partition("-")[2]
+    return user_id if hmac.compare_digest(signature, expected) else None
+
+def calendar_url(user_id: int) -> Optional[str]:
+    return f"{RENDER_URL}/calendar/{ics_token(user_id)}.ics" if RENDER_URL else None
+
+def calendar_version(partition: TutorPartition) -> Tuple[tuple, float]:
+    """Версия календаря раздела: подписи файлов занятий и серий (не зависят от перезапуска)
+    и время последнего изменения для Last-Modified"""
+    signatures = (file_version(partition.confirmed_file), file_version(partition.series_file),
+                  series_window()[0].date().isoformat())
+    modified = max((signature[0] / 1e9 for signature in signatures[:2] if signature), default=0.0)
+    return signatures, modified
+
+def calendar_etag(user_id: int, version: tuple) -> str:
+    return '"' + hashlib.sha1(f"{user_id}:{version}".encode()).hexdigest() + '"'
+
+def ics_escape(text: str) -> str:
+    return (str(text).replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\n", "\\n"))
+
+def ics_line(name: str, value: str) -> str:
+    """Строка свойства со складыванием длинных строк по RFC 5545"""
+    parts = []
+    current = ""
+    size = 0
+    for char in f"{name}:{value}":
+        char_size = len(char.encode("utf-8"))
+        if size + char_size > 74:
+            parts.append(current)
+            current = " "
+            size = 1
+        current += char
+        size += char_size
+    parts.append(current)
+    return "\r\n".join(parts) + "\r\n"
+
+def ics_time(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def ics_event(lesson_id: str, lesson: Lesson, for_tutor: bool) -> str:
+    start = lesson.lesson_datetime
+    summary = f"{lesson.subject or 'Занятие'}"
+    if for_tutor:
+        summary += f" - {lesson.student_name or 'ученик'}"
+    
+    return (
+        "BEGIN:VEVENT\r\n"
+        + ics_line("UID", f"{lesson_id}@tutorbot")
+        + ics_line("DTSTAMP", ics_time(lesson.timestamp or start))
+        + ics_line("DTSTART", ics_time(start))
+        + ics_line("DTEND", ics_time(start + timedelta(minutes=SLOT_DURATION)))
+        + ics_line("SUMMARY", ics_escape(summary))
+        + "END:VEVENT\r\n"
+    )
+
+def iter_calendar_chunks(partition: TutorPartition, user_id: int) -> Iterator[str]:
+    """VCALENDAR по кускам из ICS_CHUNK_EVENTS событий - весь файл в памяти не собирается"""
+    for_tutor = user_id == partition.tutor_id
+    lessons = all_lessons(partition) if for_tutor else get_student_lessons(partition, user_id)
+    
+    yield ("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//tutorbot//RU\r\nCALSCALE:GREGORIAN\r\n"
+           + ics_line("X-WR-CALNAME", ics_escape(f"Занятия ({partition.name})")))
+    
+    chunk = []
+    for lesson_id, lesson in lessons.items():
+        if not lesson.lesson_datetime:
+            continue
+        chunk.append(ics_event(lesson_id, lesson, for_tutor))
+        if len(chunk) >= ICS_CHUNK_EVENTS:
+            yield "".join(chunk)
+            chunk = []
+    
+    chunk.append("END:VCALENDAR\r\n")
+    yield "".join(chunk)
+
+# ============================================================================
+# JSON API
+# ============================================================================
+
+class ApiCache:
+    """Готовые ответы API в памяти. Ключ записи - запрос, версия - версии данных раздела
+    в памяти: любое сохранение в этом процессе меняет версию и сбрасывает ответ.
+    Изменения других процессов подхватываются перепроверкой файлов раз в API_REVALIDATE_INTERVAL."""
+    
+    def __init__(self):
+        self.entries: Dict[tuple, Tuple[tuple, str, bytes]] = {}
+        self.checked_at: Dict[int, float] = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def data_version(self, partition: TutorPartition) -> tuple:
+        now = time.monotonic()
+        if now - self.checked_at.get(partition.tutor_id, 0.0) >= API_REVALIDATE_INTERVAL:
+            self.checked_at[partition.tutor_id] = now
+            all_lessons(partition)
+            get_active_holds(partition)
+            compile_availability(partition)
+        
+        return (partition.lessons.version, partition.series.version, partition.holds.version,
+                partition.slot_table[0], get_week_dates()["Monday"][0].date())
+    
+    def get(self, key: tuple, version: tuple, build) -> Tuple[str, bytes]:
+        entry = self.entries.get(key)
+        if entry and entry[0] == version:
+            self.hits += 1
+            return entry[1], entry[2]
+        
+        self.misses += 1
+        body = json.dumps(build(), ensure_ascii=False).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        
+        if len(self.entries) > 10000:
+            self.entries.clear()
+        self.entries[key] = (version, etag, body)
+        return etag, body
+
+API_CACHE = ApiCache()
+
+def build_availability_payload(partition: TutorPartition, week_offset: int) -> Dict:
+    week = get_week_dates(week_offset=week_offset)
+    availability = week_availability(partition, week_offset, None)
+    
+    return {
+        "tutor_id": partition.tutor_id,
+        "week": week_offset,
+        "start": week["Monday"][0].date().isoformat(),
+        "days": [
+            {"date": date_obj.date().isoformat(), "day": day_name, "times": availability.get(day_name, [])}
+            for day_name, (date_obj, _) in week.items()
+        ],
+        "prev": f"/api/availability?week={week_offset - 1}" if week_offset > 0 else None,
+        "next": f"/api/availability?week={week_offset + 1}" if week_offset + 1 < BOOKING_HORIZON_WEEKS else None
+    }
+
+def build_lessons_payload(partition: TutorPartition, student_id: int, page: int, per_page: int) -> Dict:
+    lessons = sorted(
+        ((lesson_id, lesson) for lesson_id, lesson in get_student_lessons(partition, student_id).items()
+         if lesson.lesson_datetime),
+        key=lambda item: item[1].lesson_datetime
+    )
+    start = (page - 1) * per_page
+    items = lessons[start:start + per_page]
+    has_next = start + per_page < len(lessons)
+    
+    return {
+        "student_id": student_id,
+        "total": len(lessons),
+        "page": page,
+        "per_page": per_page,
+        "items": [
+            {
+                "id": lesson_id,
+                "datetime": lesson.lesson_datetime.isoformat(),
+                "subject": lesson.subject,
+                "status": lesson.status,
+                "series_id": lesson.extra.get("series_id")
+            }
+            for lesson_id, lesson in items
+        ],
+        "next": f"/api/lessons?student_id={student_id}&page={page + 1}&per_page={per_page}" if has_next else None
+    }
+
+def build_stats_payload(data: Dict, tutor_id: int, weeks: int, student_id: int = None) -> Dict:
+    payload = {
+        "tutor_id": tutor_id,
+        "updated_at": data.get("updated_at"),
+        "totals": {**data["totals"], **stat_rates(data["totals"])},
+        "students": len(data["students"]),
+        "subjects": {subject: {**counters, **stat_rates(counters)} for subject, counters in data["subjects"].items()},
+        "weeks": [{"week": key, **counters} for key, counters in recent_weeks(data, weeks)]
+    }
+    if student_id is not None:
+        counters = data["students"].get(str(student_id))
+        payload["student"] = {"id": student_id, **counters, **stat_rates(counters)} if counters else None
+    return payload
+
+# ============================================================================
+# ВЫГРУЗКА ДЛЯ БУХГАЛТЕРИИ
+# ============================================================================
+
+LESSON_EXPORT_FIELDS = ("id", "date", "time", "student_id", "student_name", "student_class",
+                        "subject", "status", "series_id", "archived")
+STUDENT_EXPORT_FIELDS = ("id", "name", "grade", "confirmed", "rescheduled", "cancelled")
+
+def iter_export_lessons(partition: TutorPartition, start: datetime = None, end: datetime = None,
+                        student_id: int = None) -> Iterator[Tuple[str, Lesson, bool]]:
+    """Занятия по возрастанию даты: сначала архив (по месяцам, потоково), затем занятия в работе
+    и занятия серий за весь запрошенный период, а не только в окне записи"""
+    for lesson_id, lesson in iter_archived_lessons(partition, start, end, student_id):
+        yield lesson_id, lesson, True
+    
+    def wanted(lesson: Lesson) -> bool:
+        return bool(lesson.lesson_datetime) \
+            and (student_id is None or lesson.student_id == student_id) \
+            and (start is None or lesson.lesson_datetime >= start) \
+            and (end is None or lesson.lesson_datetime < end)
+    
+    live = [(lesson_id, lesson) for lesson_id, lesson in partition.lessons.load().items() if wanted(lesson)]
+    series_end = end or series_window()[1]
+    for series_id, series in partition.series.load().items():
+        if student_id is not None and series.student_id != student_id:
+            continue
+        series_start = start or series.start_date or series_end
+        live.extend(item for item in series_occurrences(series_id, series, series_start, series_end) if wanted(item[1]))
+    
+    for lesson_id, lesson in sorted(live, key=lambda item: item[1].lesson_datetime):
+        yield lesson_id, lesson, False
+
+def lesson_export_rows(items: Iterator[Tuple[str, Lesson, bool]]) -> Iterator[Dict]:
+    for lesson_id, lesson, archived in items:
+        yield {
+            "id": lesson_id,
+            "date": lesson.lesson_datetime.strftime("%Y-%m-%d") if lesson.lesson_datetime else None,
+            "time": lesson.time,
+            "student_id": lesson.student_id,
+            "student_name": lesson.student_name,
+            "student_class": lesson.student_class,
+            "subject": lesson.subject,
+            "status": lesson.status,
+            "series_id": lesson.extra.get("series_id"),
+            "archived": archived
+        }
+
+def student_export_rows(partition: TutorPartition, student_id: int = None) -> Iterator[Dict]:
+    """Ученики репетитора со счетчиками занятий из статистики"""
+    counters = partition_stats(partition)["students"]
+    students = STUDENT_DIRECTORY.all_recipients(partition.tutor_id)
+    
+    for sid, student in sorted(students.items()):
+        if student_id is not None and sid != student_id:
+            continue
+        stats = counters.get(str(sid)) or TutorStats.counters()
+        yield {"id": sid, "name": student.name, "grade": student.grade,
+               **{event: stats.get(event, 0) for event in STAT_EVENTS}}
+
+def iter_csv(rows: Iterator[Dict], fields: Tuple[str, ...]) -> Iterator[str]:
+    """CSV кусками по EXPORT_CHUNK_ROWS строк; BOM - чтобы Excel открыл кириллицу"""
+    buffer = io.StringIO()
+    buffer.write("\ufeff")
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    yield buffer.getvalue()
+
+def iter_jsonl(rows: Iterator[Dict]) -> Iterator[str]:
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(row, ensure_ascii=False) + "\n")
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+    yield "".join(chunk)
+
+def iter_export(partition: TutorPartition, kind: str, fmt: str, start: datetime = None, end: datetime = None,
+                student_id: int = None) -> Iterator[str]:
+    if kind == "students":
+        rows, fields = student_export_rows(partition, student_id), STUDENT_EXPORT_FIELDS
+    else:
+        rows, fields = lesson_export_rows(iter_export_lessons(partition, start, end, student_id)), LESSON_EXPORT_FIELDS
+    return iter_csv(rows, fields) if fmt == "csv" else iter_jsonl(rows)
+
+def export_filename(kind: str, fmt: str, start: datetime = None, end: datetime = None) -> str:
+    if start and end:
+        return f"{kind}_{start.strftime('%Y%m%d')}-{(end - timedelta(days=1)).strftime('%Y%m%d')}.{fmt}"
+    return f"{kind}.{fmt}"
+
+def export_range(first: Optional[date], last: Optional[date]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """Даты включительно -> [start, end) в московском времени"""
+    start = datetime(first.year, first.month, first.day, tzinfo=MSK_TIMEZONE) if first else None
+    end = datetime(last.year, last.month, last.day, tzinfo=MSK_TIMEZONE) + timedelta(days=1) if last else None
+    return start, end
+
+def parse_export_args(args: str) -> Optional[Dict]:
+    """/export [занятия|ученики] [csv|jsonl] [ДД.ММ.ГГГГ[-ДД.ММ.ГГГГ]] [id ученика]"""
+    options = {"kind": "lessons", "fmt": "csv", "start": None, "end": None, "student_id": None}
+    dates = []
+    
+    for token in (args or "").split():
+        word = token.lower()
+        if word in ("lessons", "занятия"):
+            options["kind"] = "lessons"
+        elif word in ("students", "ученики"):
+            options["kind"] = "students"
+        elif word in ("csv", "jsonl"):
+            options["fmt"] = word
+        elif word.isdigit():
+            options["student_id"] = int(word)
+        else:
+            parsed = [parse_rule_date(part) for part in token.split("-")]
+            if None in parsed or len(parsed) > 2:
+                return None
+            dates.extend(parsed)
+    
+    if len(dates) > 2:
+        return None
+    if dates:
+        options["start"], options["end"] = export_range(dates[0], dates[-1])
+    return options
+
+async def export_command_handler(message: types.Message, command: CommandObject, partition: TutorPartition):
+    if not is_tutor(message.from_user.id):
+        await message.answer("❌ Выгрузка доступна только репетитору.")
+        return
+    
+    options = parse_export_args(command.args)
+    if options is None:
+        await message.answer(
+            "📤 Выгрузка занятий и учеников.\n\n"
+            "Формат: /export [занятия|ученики] [csv|jsonl] [ДД.ММ.ГГГГ-ДД.ММ.ГГГГ] [id ученика]\n"
+            "Например: /export занятия csv 01.09.2025-30.09.2025"
+        )
+        return
+    
+    filename = export_filename(options["kind"], options["fmt"], options["start"], options["end"])
+    with tempfile.TemporaryDirectory(prefix="tutorbot-export-") as tmp:
+        path = Path(tmp) / filename
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            for chunk in iter_export(partition, options["kind"], options["fmt"], options["start"],
+                                     options["end"], options["student_id"]):
+                f.write(chunk)
+                await asyncio.sleep(0)
+        
+        await message.answer_document(FSInputFile(path, filename=filename), caption=f"📤 Выгрузка: {filename}")
+    
+    print(f"📤 Выгрузка {filename} отправлена репетитору {partition.tutor_id}")
+
 # ============================================================================
 # HTTP ОБРАБОТЧИКИ
 # ============================================================================
@@ -2412,12 +5664,170 @@ async def root_handler(request):
 async def ping_handler(request):
     return web.Response(text="pong", status=200)
 
+async def webhook_handler(request):
+    if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    
+    payload = await request.text()
+    
+    try:
+        update = Update.model_validate_json(payload)
+        user = getattr(update.event, "from_user", None)
+    except Exception as e:
+        print(f"⚠️ Некорректный апдейт от вебхука: {e}")
+        return web.Response(status=200)
+    
+    reload_routes_if_changed()
+    shard = get_partition(user.id if user else TUTOR_ID).tutor_id
+    await asyncio.to_thread(COORDINATOR.enqueue, shard, payload)
+    
+    return web.Response(status=200)
+
+async def calendar_feed_handler(request):
+    user_id = verify_ics_token(request.match_info["token"])
+    if user_id is None:
+        return web.Response(status=404)
+    
+    reload_routes_if_changed()
+    partition = get_partition(user_id)
+    version, modified = calendar_version(partition)
+    etag = calendar_etag(user_id, version)
+    last_modified = datetime.fromtimestamp(modified, tz=timezone.utc)
+    headers = {"ETag": etag, "Last-Modified": last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT"),
+               "Cache-Control": "private, max-age=300"}
+    
+    if_none_match = request.headers.get("If-None-Match")
+    if_modified_since = request.if_modified_since
+    if (if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]) or \
+            (not if_none_match and if_modified_since and last_modified.replace(microsecond=0) <= if_modified_since):
+        return web.Response(status=304, headers=headers)
+    
+    # Календари опрашиваются часто - не даем им занять цикл событий бота
+    if ICS_SEMAPHORE.locked():
+        return web.Response(status=503, headers={"Retry-After": "30"})
+    
+    async with ICS_SEMAPHORE:
+        response = web.StreamResponse(headers={**headers, "Content-Type": "text/calendar; charset=utf-8"})
+        await response.prepare(request)
+        for chunk in iter_calendar_chunks(partition, user_id):
+            await response.write(chunk.encode("utf-8"))
+        await response.write_eof()
+    
+    return response
+
+def api_int(request, name: str, default: int) -> int:
+    try:
+        return int(request.query.get(name, default))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be an integer")
+
+def api_partition(request) -> TutorPartition:
+    tutor_id = api_int(request, "tutor_id", TUTOR_ID)
+    if tutor_id not in PARTITIONS:
+        raise web.HTTPNotFound(text="unknown tutor_id")
+    return PARTITIONS[tutor_id]
+
+def api_response(request, etag: str, body: bytes) -> web.Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, headers=headers, content_type="application/json", charset="utf-8")
+
+async def api_availability_handler(request):
+    partition = api_partition(request)
+    week_offset = api_int(request, "week", 0)
+    if not 0 <= week_offset < BOOKING_HORIZON_WEEKS:
+        raise web.HTTPBadRequest(text=f"week must be in 0..{BOOKING_HORIZON_WEEKS - 1}")
+    
+    version = API_CACHE.data_version(partition)
+    etag, body = API_CACHE.get(
+        ("availability", partition.tutor_id, week_offset), version,
+        lambda: build_availability_payload(partition, week_offset)
+    )
+    return api_response(request, etag, body)
+
+def api_require_token(request):
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ") or request.query.get("token", "")
+    if not API_TOKEN or not hmac.compare_digest(token, API_TOKEN):
+        raise web.HTTPForbidden(text="API_TOKEN required")
+
+async def api_lessons_handler(request):
+    api_require_token(request)
+    
+    student_id = api_int(request, "student_id", 0)
+    page = max(1, api_int(request, "page", 1))
+    per_page = min(API_MAX_PAGE_SIZE, max(1, api_int(request, "per_page", API_PAGE_SIZE)))
+    
+    reload_routes_if_changed()
+    partition = get_partition(student_id)
+    version = API_CACHE.data_version(partition)
+    etag, body = API_CACHE.get(
+        ("lessons", partition.tutor_id, student_id, page, per_page), version,
+        lambda: build_lessons_payload(partition, student_id, page, per_page)
+    )
+    return api_response(request, etag, body)
+
+async def api_stats_handler(request):
+    api_require_token(request)
+    partition = api_partition(request)
+    weeks = min(52, max(1, api_int(request, "weeks", STATS_ROLLING_WEEKS)))
+    student_id = api_int(request, "student_id", 0) if "student_id" in request.query else None
+    
+    return web.json_response(build_stats_payload(partition_stats(partition), partition.tutor_id, weeks, student_id))
+
+def api_date(request, name: str) -> Optional[date]:
+    value = request.query.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be YYYY-MM-DD")
+
+async def api_export_handler(request):
+    api_require_token(request)
+    partition = api_partition(request)
+    kind = request.query.get("kind", "lessons")
+    fmt = request.query.get("format", "csv")
+    if kind not in ("lessons", "students") or fmt not in ("csv", "jsonl"):
+        raise web.HTTPBadRequest(text="kind must be lessons|students, format must be csv|jsonl")
+    
+    start, end = export_range(api_date(request, "from"), api_date(request, "to"))
+    student_id = api_int(request, "student_id", 0) if "student_id" in request.query else None
+    filename = export_filename(kind, fmt, start, end)
+    content_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    
+    response = web.StreamResponse(headers={
+        "Content-Type": f"{content_type}; charset=utf-8",
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Cache-Control": "no-store"
+    })
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    for chunk in iter_export(partition, kind, fmt, start, end, student_id):
+        await response.write(chunk.encode("utf-8"))
+    await response.write_eof()
+    return response
+
+def build_http_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get('/', root_handler)
+    app.router.add_get('/health', health_handler)
+    app.router.add_get('/ping', ping_handler)
+    app.router.add_get('/calendar/{token}.ics', calendar_feed_handler)
+    app.router.add_get('/api/availability', api_availability_handler)
+    app.router.add_get('/api/lessons', api_lessons_handler)
+    app.router.add_get('/api/stats', api_stats_handler)
+    app.router.add_get('/api/export', api_export_handler)
+    
+    if BOT_MODE == "webhook":
+        app.router.add_post(WEBHOOK_PATH, webhook_handler)
+    
+    return app
+
 async def run_http_server():
     try:
-        app = web.Application()
-        app.router.add_get('/', root_handler)
-        app.router.add_get('/health', health_handler)
-        app.router.add_get('/ping', ping_handler)
+        app = build_http_app()
         
         runner = web.AppRunner(app)
         await runner.setup()
@@ -2462,12 +5872,98 @@ async def keep_alive_task():
 # ОСНОВНОЙ БОТ
 # ============================================================================
 
+def register_handlers(dispatcher: Dispatcher):
+    if RECORD_UPDATES and RECORD_UPDATES != '0':
+        dispatcher.update.outer_middleware(UpdateRecorderMiddleware(RECORD_FILE))
+    dispatcher.update.outer_middleware(PartitionMiddleware())
+    
+    # Регистрация обработчиков сообщений
+    dispatcher.message.register(start_handler, Command("start"))
+    dispatcher.message.register(export_command_handler, Command("export"))
+    dispatcher.message.register(menu_button_handler, F.text == "☰ Меню")
+    dispatcher.message.register(first_lesson_name_handler, FirstLessonStates.waiting_for_name)
+    dispatcher.message.register(first_lesson_class_handler, FirstLessonStates.waiting_for_class)
+    dispatcher.message.register(interactive_time_input_handler, InteractiveScheduleStates.waiting_for_start_time)
+    dispatcher.message.register(broadcast_text_handler, BroadcastMessageStates.waiting_for_message)
+    dispatcher.message.register(schedule_rule_input_handler, ScheduleRulesStates.waiting_for_rule)
+    
+    # Регистрация callback обработчиков
+    dispatcher.callback_query.register(first_lesson_handler, F.data == "first_lesson")
+    dispatcher.callback_query.register(repeat_lesson_handler, F.data == "repeat_lesson")
+    dispatcher.callback_query.register(reschedule_lesson_handler, F.data == "reschedule_lesson")
+    dispatcher.callback_query.register(cancel_lesson_handler, F.data == "cancel_lesson")
+    dispatcher.callback_query.register(my_schedule_handler, F.data == "my_schedule")
+    dispatcher.callback_query.register(back_to_menu_handler, F.data == "back_to_menu")
+    dispatcher.callback_query.register(subject_single_handler, F.data.startswith("subject_single_"))
+    dispatcher.callback_query.register(time_select_handler, F.data.startswith("time_"), FirstLessonStates.waiting_for_time)
+    dispatcher.callback_query.register(confirm_time_handler, F.data.startswith("confirm_time_"))
+    dispatcher.callback_query.register(repeat_time_select_handler, F.data.startswith("repeat_time_"), RepeatLessonStates.waiting_for_time)
+    dispatcher.callback_query.register(repeat_confirm_handler, F.data.startswith("repeat_confirm_"))
+    dispatcher.callback_query.register(reschedule_pick_handler, F.data.startswith("reschedule_pick_"), RescheduleStates.choosing_lesson)
+    dispatcher.callback_query.register(reschedule_day_handler, F.data.startswith("reschedule_day_"))
+    dispatcher.callback_query.register(reschedule_confirm_handler, F.data.startswith("reschedule_confirm_"))
+    dispatcher.callback_query.register(cancel_pick_handler, F.data.startswith("cancel_pick_"), CancelLessonStates.choosing_lesson)
+    dispatcher.callback_query.register(edit_schedule_button_handler, F.data == "edit_schedule")
+    dispatcher.callback_query.register(schedule_rules_handler, F.data == "schedule_rules")
+    dispatcher.callback_query.register(interactive_day_select_handler, F.data.startswith("iday_"))
+    dispatcher.callback_query.register(interactive_save_handler, F.data == "save_schedule")
+    dispatcher.callback_query.register(back_to_schedule_menu_handler, F.data == "back_to_schedule_menu")
+    dispatcher.callback_query.register(confirm_reschedule_handler, F.data.startswith("confirm_reschedule_"))
+    dispatcher.callback_query.register(reject_reschedule_handler, F.data.startswith("reject_reschedule_"))
+    dispatcher.callback_query.register(confirm_cancel_handler, F.data.startswith("confirm_cancel_"))
+    dispatcher.callback_query.register(reject_cancel_handler, F.data.startswith("reject_cancel_"))
+    dispatcher.callback_query.register(confirm_request_handler, F.data.startswith("confirm_") & ~F.data.startswith("confirm_reschedule_") & ~F.data.startswith("confirm_cancel_"))
+    dispatcher.callback_query.register(reject_request_handler, F.data.startswith("reject_") & ~F.data.startswith("reject_reschedule_") & ~F.data.startswith("reject_cancel_"))
+    dispatcher.callback_query.register(tutor_reschedule_request_handler, F.data == "tutor_reschedule_request")
+    dispatcher.callback_query.register(tutor_reschedule_pick_handler, F.data.startswith("tutor_reschedule_pick_"))
+    dispatcher.callback_query.register(tutor_reschedule_day_handler, F.data.startswith("tutor_reschedule_day_"))
+    dispatcher.callback_query.register(tutor_reschedule_confirm_handler, F.data.startswith("tutor_reschedule_confirm_"))
+    dispatcher.callback_query.register(student_reschedule_agree_handler, F.data.startswith("student_reschedule_agree_"))
+    dispatcher.callback_query.register(student_reschedule_decline_handler, F.data.startswith("student_reschedule_decline_"))
+    dispatcher.callback_query.register(broadcast_message_handler, F.data == "broadcast_message")
+    dispatcher.callback_query.register(choose_tutor_pick_handler, F.data.startswith("choose_tutor_"))
+    dispatcher.callback_query.register(choose_tutor_handler, F.data == "choose_tutor")
+    dispatcher.callback_query.register(series_confirm_handler, F.data.startswith("series_confirm_"))
+    dispatcher.callback_query.register(series_back_handler, F.data.startswith("series_back_"))
+    dispatcher.callback_query.register(series_weeks_handler, F.data.startswith("series_weeks_"))
+    dispatcher.callback_query.register(series_list_handler, F.data == "series_list")
+    dispatcher.callback_query.register(series_end_handler, F.data.startswith("series_end_"))
+    dispatcher.callback_query.register(stats_handler, F.data == "tutor_stats")
+    dispatcher.callback_query.register(day_shift_handler, F.data == "day_shift")
+    dispatcher.callback_query.register(day_shift_pick_handler, F.data.startswith("day_shift_pick_"))
+    dispatcher.callback_query.register(day_shift_send_handler, F.data.startswith("day_shift_send_"))
+    dispatcher.callback_query.register(day_shift_cancel_handler, F.data.startswith("day_shift_cancel_"))
+    dispatcher.callback_query.register(pending_list_handler, F.data == "pending_list")
+    dispatcher.callback_query.register(pending_page_handler, F.data.startswith("pending_page_"))
+    dispatcher.callback_query.register(pending_toggle_handler, F.data.startswith("pending_toggle_"))
+    dispatcher.callback_query.register(pending_bulk_handler, F.data.startswith("pending_bulk_"))
+    dispatcher.callback_query.register(calendar_page_handler, F.data.startswith("calendar_"))
+    dispatcher.callback_query.register(waitlist_join_handler, F.data.startswith("waitlist_join_"))
+    dispatcher.callback_query.register(waitlist_accept_handler, F.data.startswith("waitlist_accept_"))
+    dispatcher.callback_query.register(waitlist_decline_handler, F.data.startswith("waitlist_decline_"))
+    
+    print(f"✅ Зарегистрировано {len(dispatcher.message.handlers)} message handlers")
+    print(f"✅ Зарегистрировано {len(dispatcher.callback_query.handlers)} callback handlers")
+
+def start_background_jobs(bot: Bot):
+    asyncio.create_task(send_reminders(bot))
+    asyncio.create_task(send_daily_schedule(bot))
+    asyncio.create_task(cleanup_task(bot))
+    asyncio.create_task(request_expiry_task(bot))
+    asyncio.create_task(stats_flush_task())
+    asyncio.create_task(keep_alive_task())
+    asyncio.create_task(delete_old_messages(bot))
+
 async def start_bot():
-    global dp
-    
     retry_count = 0
     max_retries = 10
     
+    print("📝 Registering handlers...")
+    register_handlers(dp)
+    
+    # Запускаем фоновые задачи
+    start_background_jobs(bot)
+    
     while retry_count < max_retries:
         try:
             print("🤖 Initializing Telegram bot...")
@@ -2478,62 +5974,8 @@ async def start_bot():
             await bot.delete_webhook(drop_pending_updates=True)
             print("✅ Вебхук удалён")
             
-            print("📝 Registering handlers...")
-            
-            # Регистрация обработчиков сообщений
-            dp.message.register(start_handler, Command("start"))
-            dp.message.register(menu_button_handler, F.text == "☰ Меню")
-            dp.message.register(first_lesson_name_handler, FirstLessonStates.waiting_for_name)
-            dp.message.register(first_lesson_class_handler, FirstLessonStates.waiting_for_class)
-            dp.message.register(interactive_time_input_handler, InteractiveScheduleStates.waiting_for_start_time)
-            dp.message.register(broadcast_text_handler, BroadcastMessageStates.waiting_for_message)
-            
-            # Регистрация callback обработчиков
-            dp.callback_query.register(first_lesson_handler, F.data == "first_lesson")
-            dp.callback_query.register(repeat_lesson_handler, F.data == "repeat_lesson")
-            dp.callback_query.register(reschedule_lesson_handler, F.data == "reschedule_lesson")
-            dp.callback_query.register(cancel_lesson_handler, F.data == "cancel_lesson")
-            dp.callback_query.register(my_schedule_handler, F.data == "my_schedule")
-            dp.callback_query.register(back_to_menu_handler, F.data == "back_to_menu")
-            dp.callback_query.register(subject_single_handler, F.data.startswith("subject_single_"))
-            dp.callback_query.register(time_select_handler, F.data.startswith("time_"), FirstLessonStates.waiting_for_time)
-            dp.callback_query.register(confirm_time_handler, F.data.startswith("confirm_time_"))
-            dp.callback_query.register(repeat_time_select_handler, F.data.startswith("repeat_time_"), RepeatLessonStates.waiting_for_time)
-            dp.callback_query.register(repeat_confirm_handler, F.data.startswith("repeat_confirm_"))
-            dp.callback_query.register(reschedule_pick_handler, F.data.startswith("reschedule_pick_"), RescheduleStates.choosing_lesson)
-            dp.callback_query.register(reschedule_day_handler, F.data.startswith("reschedule_day_"))
-            dp.callback_query.register(reschedule_confirm_handler, F.data.startswith("reschedule_confirm_"))
-            dp.callback_query.register(cancel_pick_handler, F.data.startswith("cancel_pick_"), CancelLessonStates.choosing_lesson)
-            dp.callback_query.register(edit_schedule_button_handler, F.data == "edit_schedule")
-            dp.callback_query.register(interactive_day_select_handler, F.data.startswith("iday_"))
-            dp.callback_query.register(interactive_save_handler, F.data == "save_schedule")
-            dp.callback_query.register(back_to_schedule_menu_handler, F.data == "back_to_schedule_menu")
-            dp.callback_query.register(confirm_reschedule_handler, F.data.startswith("confirm_reschedule_"))
-            dp.callback_query.register(reject_reschedule_handler, F.data.startswith("reject_reschedule_"))
-            dp.callback_query.register(confirm_cancel_handler, F.data.startswith("confirm_cancel_"))
-            dp.callback_query.register(reject_cancel_handler, F.data.startswith("reject_cancel_"))
-            dp.callback_query.register(confirm_request_handler, F.data.startswith("confirm_") & ~F.data.startswith("confirm_reschedule_") & ~F.data.startswith("confirm_cancel_"))
-            dp.callback_query.register(reject_request_handler, F.data.startswith("reject_") & ~F.data.startswith("reject_reschedule_") & ~F.data.startswith("reject_cancel_"))
-            dp.callback_query.register(tutor_reschedule_request_handler, F.data == "tutor_reschedule_request")
-            dp.callback_query.register(tutor_reschedule_pick_handler, F.data.startswith("tutor_reschedule_pick_"))
-            dp.callback_query.register(tutor_reschedule_day_handler, F.data.startswith("tutor_reschedule_day_"))
-            dp.callback_query.register(tutor_reschedule_confirm_handler, F.data.startswith("tutor_reschedule_confirm_"))
-            dp.callback_query.register(student_reschedule_agree_handler, F.data.startswith("student_reschedule_agree_"))
-            dp.callback_query.register(student_reschedule_decline_handler, F.data.startswith("student_reschedule_decline_"))
-            dp.callback_query.register(broadcast_message_handler, F.data == "broadcast_message")
-            
-            print(f"✅ Зарегистрировано {len(dp.message.handlers)} message handlers")
-            print(f"✅ Зарегистрировано {len(dp.callback_query.handlers)} callback handlers")
-            
             retry_count = 0
             
-            # Запускаем фоновые задачи
-            asyncio.create_task(send_reminders(bot))
-            asyncio.create_task(send_daily_schedule(bot))
-            asyncio.create_task(cleanup_task(bot))
-            asyncio.create_task(keep_alive_task())
-            asyncio.create_task(delete_old_messages(bot))
-            
             print("⏳ Starting polling...")
             sys.stdout.flush()
             
@@ -2560,10 +6002,46 @@ async def start_bot():
         print(f"❌ КРИТИЧЕСКАЯ ОШИБКА: {max_retries} попыток не удалось подключиться")
         sys.exit(1)
 
+async def run_workers():
+    """Режимы webhook и worker: несколько процессов делят разделы через общую очередь"""
+    global COORDINATOR
+    
+    COORDINATOR = Coordinator(COORDINATION_DB_FILE, WORKER_ID)
+    print(f"👷 Процесс {WORKER_ID} в режиме {BOT_MODE}")
+    
+    print("📝 Registering handlers...")
+    register_handlers(dp)
+    
+    if BOT_MODE == "webhook":
+        asyncio.create_task(run_http_server())
+        if RENDER_URL:
+            await bot.set_webhook(f"{RENDER_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET)
+            print(f"✅ Вебхук установлен: {RENDER_URL}{WEBHOOK_PATH}")
+        else:
+            print("⚠️ RENDER_URL не задан - вебхук не установлен")
+    
+    asyncio.create_task(coordination_task())
+    start_background_jobs(bot)
+    
+    try:
+        await consume_updates(bot)
+    finally:
+        COORDINATOR.release_all()
+        print(f"✅ {WORKER_ID}: аренды разделов освобождены")
+
 # ============================================================================
 # MAIN
 # ============================================================================
 
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
 async def main():
     print("=" * 70)
     print("INITIALIZING APPLICATION - FIXED VERSION")
@@ -2579,39 +6057,62 @@ async def main():
     print("=" * 70)
     sys.stdout.flush()
     
-    lockfile = Path('./.botrunning.lock')
+    print(f"👷 Mode: {BOT_MODE}")
     
-    if lockfile.exists():
-        print("⚠️ Обнаружена старая блокировка. Попытка удаления...")
-        try:
-            lockfile.unlink()
-        except Exception as e:
-            print(f"⚠️ Warning: Could not delete old lock file: {e}")
+    lockfile = Path('./.botrunning.lock')
+    owns_lock = False
     
-    lockfile.write_text(str(os.getpid()))
-    print(f"✅ Lock file created: {lockfile}")
+    if BOT_MODE == "polling":
+        if lockfile.exists():
+            try:
+                other_pid = int(lockfile.read_text().strip())
+            except ValueError:
+                other_pid = None
+            
+            if other_pid and other_pid != os.getpid() and is_process_alive(other_pid):
+                print(f"❌ Бот уже запущен (PID {other_pid}). Для нескольких процессов используйте BOT_MODE=webhook/worker")
+                return
+            
+            print("⚠️ Обнаружена старая блокировка. Попытка удаления...")
+            try:
+                lockfile.unlink()
+            except Exception as e:
+                print(f"⚠️ Warning: Could not delete old lock file: {e}")
+        
+        lockfile.write_text(str(os.getpid()))
+        owns_lock = True
+        print(f"✅ Lock file created: {lockfile}")
     
     print("\n🧹 Performing startup cleanup...")
-    cleanup_stale_requests()
-    restore_cache_from_files()
-    
-    print(f"✅ STUDENT_CACHE восстановлен: {len(STUDENT_CACHE)} записей")
-    
-    print(f"📊 Расписание: {load_json(SCHEDULE_FILE)}")
-    print(f"📊 Подтвержденные занятия: {len(load_json(CONFIRMED_FILE))} записей")
-    print(f"📊 Ученики в students.json: {len(load_json(STUDENTS_FILE))} записей")
-    print(f"📊 Лог сообщений: {len(load_json(MESSAGE_LOG_FILE))} записей")
-    
-    SENT_REMINDERS.clear()
-    print("🧹 Очищены старые напоминания при запуске")
+    timings = {"импорт и разделы": time.perf_counter() - STARTUP_STARTED}
+    # В многопроцессном режиме очисткой занимается владелец раздела
+    timings.update(load_startup_data(cleanup=BOT_MODE == "polling"))
+    
+    started = time.perf_counter()
+    print(f"👩‍🏫 Репетиторов: {len(PARTITIONS)}")
+    for partition in PARTITIONS.values():
+        log_size = partition.message_log_file.stat().st_size if partition.message_log_file.exists() else 0
+        print(f"📊 [{partition.tutor_id}] Расписание: {load_json(partition.schedule_file)}")
+        print(f"📊 [{partition.tutor_id}] Подтвержденные занятия: {len(partition.lessons.load())} записей")
+        print(f"📊 [{partition.tutor_id}] Лог сообщений: {log_size} байт (загрузится при первом обращении)")
+    print(f"📊 Ученики в students.json: {len(STUDENT_DIRECTORY.stored)} записей")
+    timings["статистика"] = time.perf_counter() - started
     print("✅ Startup cleanup completed\n")
     
+    total = time.perf_counter() - STARTUP_STARTED
+    print("⏱ Время запуска: " + ", ".join(f"{name} {seconds * 1000:.1f} мс" for name, seconds in timings.items()))
+    print(f"⏱ Готов к работе через {total * 1000:.1f} мс; прочитано файлов: {len(FILE_READS)}, "
+          f"повторных чтений: {sum(FILE_READS.values()) - len(FILE_READS)}")
+    
     sys.stdout.flush()
     
     try:
-        http_task = asyncio.create_task(run_http_server())
-        await start_bot()
-        await http_task
+        if BOT_MODE == "polling":
+            http_task = asyncio.create_task(run_http_server())
+            await start_bot()
+            await http_task
+        else:
+            await run_workers()
     
     except KeyboardInterrupt:
         print("⏸ Application interrupted by user")
@@ -2620,12 +6121,21 @@ async def main():
         import traceback
         traceback.print_exc()
     finally:
-        if lockfile.exists():
+        if owns_lock and lockfile.exists():
             try:
                 lockfile.unlink()
             except:
                 pass
         
+        try:
+            await storage.close()
+        except Exception as e:
+            print(f"⚠️ Не удалось закрыть FSM-хранилище: {e}")
+        
+        for partition in PARTITIONS.values():
+            partition.stats.flush()
+        STUDENT_DIRECTORY.flush()
+        
         print("✅ Bot stopped correctly")
 
 if __name__ == '__main__':
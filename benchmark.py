@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк горячих путей бота на синтетических данных.
+
+Каждый размер набора данных прогоняется в отдельном процессе со своим DATA_DIR,
+результаты печатаются (или пишутся в файл) в виде JSON, чтобы сравнивать версии
+и строить кривые масштабирования.
+
+Пример:
+    python benchmark.py --students 200 --lessons 2000 --pending 100 --scales 1,2,4 --output bench.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+NAMES = ["Иван", "Мария", "Петр", "Анна", "Олег", "Елена", "Дмитрий", "Ольга", "Сергей", "Наталья"]
+SURNAMES = ["Иванов", "Петрова", "Сидоров", "Кузнецова", "Смирнов", "Попова", "Волков", "Соколова"]
+GRADES = [str(g) for g in range(5, 12)]
+
+
+def generate_dataset(data_dir: Path, students: int, lessons: int, pending: int, seed: int = 42) -> dict:
+    """Пишет в data_dir синтетические students.json, confirmed_lessons.json и pending_*.json"""
+    import app
+
+    rng = random.Random(seed)
+    now = datetime.now(tz=app.MSK_TIMEZONE)
+    week = app.get_week_dates(now)
+
+    student_ids = [100_000 + i for i in range(students)]
+    students_data = {
+        str(student_id): {
+            "name": f"{rng.choice(NAMES)} {rng.choice(SURNAMES)}",
+            "grade": rng.choice(GRADES)
+        }
+        for student_id in student_ids
+    }
+
+    # Слоты текущей недели по расписанию по умолчанию
+    week_slots = []
+    for day_name, times in app.DEFAULT_SCHEDULE.items():
+        if day_name in week:
+            for time_str in times:
+                week_slots.append(app.get_lesson_datetime(day_name, time_str))
+    rng.shuffle(week_slots)
+
+    confirmed = {}
+    for i in range(lessons):
+        student_id = rng.choice(student_ids)
+        if week_slots and i < len(week_slots) // 2:
+            lesson_dt = week_slots[i]
+        else:
+            lesson_dt = now - timedelta(days=rng.randint(7, 365), hours=rng.randint(0, 6))
+            lesson_dt = lesson_dt.replace(minute=rng.choice([0, 15, 30]), second=0, microsecond=0)
+        info = students_data[str(student_id)]
+        confirmed[f"L{i:07d}"] = {
+            "student_id": student_id,
+            "student_name": info["name"],
+            "student_class": info["grade"],
+            "subject": rng.choice(app.SUBJECTS),
+            "lesson_datetime": lesson_dt.isoformat(),
+            "date_str": lesson_dt.strftime("%d.%m.%Y"),
+            "time": lesson_dt.strftime("%H:%M"),
+            "status": "confirmed",
+            "timestamp": (lesson_dt - timedelta(days=2)).isoformat()
+        }
+
+    pending_requests = {}
+    for i in range(pending):
+        student_id = rng.choice(student_ids)
+        info = students_data[str(student_id)]
+        lesson_dt = now + timedelta(days=rng.randint(0, 6))
+        pending_requests[f"P{i:07d}"] = {
+            "student_id": student_id,
+            "student_name": info["name"],
+            "student_class": info["grade"],
+            "subject": rng.choice(app.SUBJECTS),
+            "lesson_datetime": lesson_dt.replace(hour=18, minute=0, second=0, microsecond=0).isoformat(),
+            # половина заявок старше суток - их удаляет cleanup_stale_requests
+            "timestamp": (now - timedelta(hours=rng.randint(0, 48))).isoformat(),
+            "status": "pending"
+        }
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for name, data in [
+        ("students.json", students_data),
+        ("confirmed_lessons.json", confirmed),
+        ("pending_requests.json", pending_requests),
+        ("schedule.json", app.DEFAULT_SCHEDULE),
+    ]:
+        with open(data_dir / name, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    return {"student_ids": student_ids, "pending": pending_requests}
+
+
+def measure(func, repeat: int, setup=None) -> dict:
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    return {
+        "runs": repeat,
+        "min_ms": round(timings[0], 4),
+        "median_ms": round(statistics.median(timings), 4),
+        "mean_ms": round(statistics.fmean(timings), 4),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+        "max_ms": round(timings[-1], 4)
+    }
+
+
+def run_benchmarks(students: int, lessons: int, pending: int, repeat: int) -> dict:
+    """Выполняется в дочернем процессе: DATA_DIR уже указывает на временную папку"""
+    import app
+    import fake_bot
+
+    data_dir = app.DATA_DIR
+    dataset = generate_dataset(data_dir, students, lessons, pending)
+    pending_raw = json.dumps(dataset["pending"], ensure_ascii=False)
+    partition = app.PARTITIONS[app.TUTOR_ID]
+    schedule = app.load_json(partition.schedule_file)
+    student_ids = dataset["student_ids"]
+    rng = random.Random(7)
+
+    app.restore_cache_from_files()
+    bot = fake_bot.make_fake_bot()
+    loop = asyncio.new_event_loop()
+
+    def reset_pending():
+        partition.pending_file.write_text(pending_raw, encoding="utf-8")
+
+    def add_request():
+        lesson_dt = app.get_lesson_datetime("Saturday", "20:30")
+        request_id = app.create_request_id()
+        requests_data = partition.requests.load()
+        requests_data[request_id] = app.PendingRequest(
+            student_id=rng.choice(student_ids),
+            student_name="Бенчмарк",
+            student_class="9",
+            subject=app.SUBJECTS[0],
+            lesson_datetime=lesson_dt,
+            timestamp=datetime.now(tz=app.MSK_TIMEZONE),
+            status="pending"
+        )
+        partition.requests.save()
+        state["callback"] = fake_bot.make_callback(bot, app.TUTOR_ID, f"confirm_{request_id}")
+
+    state = {}
+    tutor_lessons = app.get_tutor_lessons(partition)
+
+    benchmarks = {
+        "get_available_times": (lambda: [app.get_available_times(partition, day, schedule) for day in app.DAYS_RU], None),
+        "get_booked_times": (lambda: app.get_booked_times(partition), None),
+        "get_student_lessons": (lambda: app.get_student_lessons(partition, rng.choice(student_ids)), None),
+        "get_tutor_lessons": (lambda: app.get_tutor_lessons(partition), None),
+        "get_all_students": (lambda: app.get_all_students(partition), None),
+        "format_tutor_schedule_message": (lambda: app.format_tutor_schedule_message(tutor_lessons), None),
+        "cleanup_stale_requests": (lambda: app.cleanup_stale_requests(partition), reset_pending),
+        "confirm_request_handler": (
+            lambda: loop.run_until_complete(app.confirm_request_handler(state["callback"], bot, partition)),
+            add_request
+        ),
+    }
+
+    results = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name, (func, setup) in benchmarks.items():
+            results[name] = measure(func, repeat, setup)
+
+    loop.run_until_complete(app.storage.close())
+    loop.close()
+
+    return {
+        "students": students,
+        "lessons": lessons,
+        "pending": pending,
+        "bot_api_calls": dict(bot.session.calls),
+        "benchmarks": results
+    }
+
+
+def run_scale(args, scale: int) -> dict:
+    with tempfile.TemporaryDirectory(prefix="tutorbot-bench-") as tmp:
+        env = dict(os.environ, DATA_DIR=tmp)
+        cmd = [
+            sys.executable, __file__, "--child",
+            "--students", str(args.students * scale),
+            "--lessons", str(args.lessons * scale),
+            "--pending", str(args.pending * scale),
+            "--repeat", str(args.repeat),
+        ]
+        output = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["scale"] = scale
+        return result
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).parent
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк горячих путей tutor_bot")
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--lessons", type=int, default=2000)
+    parser.add_argument("--pending", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--scales", default="1", help="множители размера данных через запятую, например 1,2,4,8")
+    parser.add_argument("--output", help="файл для JSON-результата (по умолчанию stdout)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_benchmarks(args.students, args.lessons, args.pending, args.repeat)))
+        return
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": []
+    }
+
+    for scale in [int(s) for s in args.scales.split(",") if s.strip()]:
+        print(f"⏱ Масштаб x{scale}...", file=sys.stderr)
+        report["results"].append(run_scale(args, scale))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        print(f"✅ Результаты сохранены в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
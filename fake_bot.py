@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Фейковый Bot без обращений к Telegram: для бенчмарков, реплея апдейтов и проверки отказов"""
+
+import asyncio
+import itertools
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage, EditMessageText
+from aiogram.types import Message, Chat, User, Update, CallbackQuery
+
+FAKE_TOKEN = "42:FAKE-TOKEN"
+
+
+class FakeSession(BaseSession):
+    """Сессия, которая отвечает на методы Bot API правдоподобными объектами"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self.sent = []
+        self.keep_sent = False
+        self.message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.keep_sent:
+            self.sent.append(method)
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        return fake_result(method, next(self.message_ids))
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError("FakeSession не умеет скачивать файлы")
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def fake_result(method, message_id: int):
+    if isinstance(method, (SendMessage, EditMessageText)):
+        chat_id = method.chat_id if isinstance(method.chat_id, int) else 0
+        return Message(
+            message_id=method.message_id if getattr(method, "message_id", None) else message_id,
+            date=datetime.now(),
+            chat=Chat(id=chat_id, type="private"),
+            text=method.text
+        )
+    return True
+
+
+def make_fake_bot(latency: float = 0.0) -> Bot:
+    return Bot(token=FAKE_TOKEN, session=FakeSession(latency))
+
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1_000_000)
+
+
+def make_user(user_id: int, first_name: str = "Ученик") -> User:
+    return User(id=user_id, is_bot=False, first_name=first_name)
+
+
+def make_message_update(user_id: int, text: str, update_id: Optional[int] = None) -> Update:
+    return Update(
+        update_id=update_id or next(_update_ids),
+        message=Message(
+            message_id=next(_message_ids),
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=make_user(user_id),
+            text=text
+        )
+    )
+
+
+def make_callback_update(user_id: int, data: str, update_id: Optional[int] = None) -> Update:
+    user = make_user(user_id)
+    return Update(
+        update_id=update_id or next(_update_ids),
+        callback_query=CallbackQuery(
+            id=str(next(_update_ids)),
+            from_user=user,
+            chat_instance=str(user_id),
+            message=Message(
+                message_id=next(_message_ids),
+                date=datetime.now(),
+                chat=Chat(id=user_id, type="private"),
+                from_user=user,
+                text="..."
+            ),
+            data=data
+        )
+    )
+
+
+def make_callback(bot: Bot, user_id: int, data: str) -> CallbackQuery:
+    """CallbackQuery, привязанный к фейковому боту - для прямого вызова обработчиков"""
+    update = make_callback_update(user_id, data)
+    return Update.model_validate(update.model_dump(), context={"bot": bot}).callback_query
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Локальная замена Telegram Bot API для нагрузочных тестов.
+
+Поддерживает getUpdates (long polling), sendMessage, editMessageText,
+answerCallbackQuery, deleteMessage и служебные getMe/deleteWebhook/setWebhook.
+Умеет добавлять задержку и отвечать 429 Too Many Requests с заданной вероятностью.
+
+Запуск отдельно:
+    python fake_telegram.py --port 8081 --latency 0.05 --error-rate 0.01
+и бот с TELEGRAM_API_URL=http://127.0.0.1:8081 (см. load_test.py).
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+BOT_INFO = {"id": 42, "is_bot": True, "first_name": "FakeTutorBot", "username": "fake_tutor_bot"}
+
+# Методы, на которые сервер может ответить 429
+THROTTLED_METHODS = {"sendMessage", "editMessageText", "answerCallbackQuery", "deleteMessage"}
+
+
+class FakeTelegramServer:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 retry_after: int = 1, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+
+        self.updates: List[Dict] = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.new_updates = asyncio.Event()
+
+        # chat_id -> очередь действий бота в этом чате (для симуляторов пользователей)
+        self.chat_queues: Dict[int, asyncio.Queue] = {}
+        self.callback_chats: Dict[str, int] = {}
+        self.stats = Counter()
+
+        self.runner: Optional[web.AppRunner] = None
+
+    # ------------------------------------------------------------------
+    # API для симуляторов
+    # ------------------------------------------------------------------
+
+    def subscribe(self, chat_id: int) -> asyncio.Queue:
+        return self.chat_queues.setdefault(chat_id, asyncio.Queue())
+
+    def push_update(self, update: Dict) -> int:
+        update_id = next(self.update_ids)
+        update["update_id"] = update_id
+
+        callback = update.get("callback_query")
+        if callback:
+            self.callback_chats[callback["id"]] = callback["from"]["id"]
+
+        self.updates.append(update)
+        self.new_updates.set()
+        self.stats["updates_pushed"] += 1
+        return update_id
+
+    def push_message(self, user_id: int, text: str, first_name: str = "Ученик") -> int:
+        return self.push_update({
+            "message": {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": first_name},
+                "text": text,
+                **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}
+                   if text.startswith("/") else {})
+            }
+        })
+
+    def push_callback(self, user_id: int, data: str, message_id: int = 1) -> str:
+        callback_id = f"cb{next(self.update_ids)}"
+        self.push_update({
+            "callback_query": {
+                "id": callback_id,
+                "from": {"id": user_id, "is_bot": False, "first_name": "Ученик"},
+                "chat_instance": str(user_id),
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "..."
+                },
+                "data": data
+            }
+        })
+        return callback_id
+
+    # ------------------------------------------------------------------
+    # HTTP
+    # ------------------------------------------------------------------
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.runner = web.AppRunner(self.build_app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def read_params(self, request: web.Request) -> Dict:
+        if request.content_type == "application/json":
+            return await request.json()
+
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str) and value[:1] in "{[":
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        params.update(request.query)
+        return params
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self.read_params(request)
+        self.stats[f"calls.{method}"] += 1
+
+        if method == "getUpdates":
+            return self.ok(await self.get_updates(params))
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+
+        if method in THROTTLED_METHODS and self.error_rate and self.rng.random() < self.error_rate:
+            self.stats["errors.429"] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            })
+
+        if method == "getMe":
+            return self.ok(BOT_INFO)
+        if method in ("sendMessage", "editMessageText"):
+            return self.ok(self.record_message(method, params))
+        if method == "answerCallbackQuery":
+            chat_id = self.callback_chats.pop(params.get("callback_query_id"), None)
+            self.notify(chat_id, {"method": method, **params})
+            return self.ok(True)
+        if method == "deleteMessage":
+            return self.ok(True)
+        if method in ("deleteWebhook", "setWebhook", "close", "logOut"):
+            return self.ok(True)
+
+        self.stats["errors.unknown_method"] += 1
+        return web.json_response({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+
+    async def get_updates(self, params: Dict) -> List[Dict]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        if offset:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return self.updates[:limit]
+
+    def record_message(self, method: str, params: Dict) -> Dict:
+        chat_id = int(params.get("chat_id") or 0)
+        message_id = int(params.get("message_id") or next(self.message_ids))
+
+        self.notify(chat_id, {"method": method, **params})
+
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", "")
+        }
+        if isinstance(params.get("reply_markup"), dict) and "inline_keyboard" in params["reply_markup"]:
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+    def notify(self, chat_id: Optional[int], action: Dict):
+        if chat_id is None:
+            return
+        action["at"] = time.perf_counter()
+        queue = self.chat_queues.get(chat_id)
+        if queue is not None:
+            queue.put_nowait(action)
+
+    @staticmethod
+    def ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+
+async def serve(args):
+    server = FakeTelegramServer(args.latency, args.jitter, args.error_rate, args.retry_after)
+    url = await server.start(args.host, args.port)
+    print(f"✅ Фейковый Bot API запущен: {url}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="разброс задержки, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
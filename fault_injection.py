@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+"""Проверка бота на отказах Telegram API и диска.
+
+Фейковый Bot (fake_bot.FakeSession) и запись файлов в DATA_DIR оборачиваются
+инъекцией сбоев: таймаут (сообщение дошло, ответ потерян), 429 с retry_after,
+403 от заблокировавших бота учеников, ENOSPC и частичная запись файла. По раундам
+работают настоящие функции бота: ученики оставляют заявки, репетитор подтверждает
+их через confirm_request_handler, send_partition_reminders рассылает напоминания,
+send_batch - объявления.
+
+Прогон идет в три фазы: без сбоев, со сбоями и восстановление. После каждого
+раунда проверяются инварианты:
+    - нет двух занятий в одном слоте (в памяти и на диске);
+    - подтверждение, о котором узнал ученик, есть на диске и переживает перезапуск;
+    - никто не получил одно напоминание или объявление дважды.
+Время восстановления - от конца фазы сбоев до момента, когда файлы на диске совпали
+с памятью, все заявки обработаны и все напоминания доставлены.
+Код выхода 1, если хотя бы один инвариант нарушен.
+
+Пример:
+    python fault_injection.py --rounds 30 --timeout-rate 0.05 --retry-after-rate 0.05 \\
+        --blocked-share 0.1 --enospc-rate 0.05 --partial-rate 0.05 --output faults.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import errno
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Optional
+
+import fake_bot
+
+class FaultPlan:
+    """Вероятности сбоев; сбои выпадают только пока active"""
+
+    def __init__(self, rates: Dict[str, float], retry_after: int, rng: random.Random):
+        self.rates = rates
+        self.retry_after = retry_after
+        self.rng = rng
+        self.active = False
+        self.blocked = set()
+        self.injected = Counter()
+
+    def draw(self, *kinds: str) -> Optional[str]:
+        if not self.active:
+            return None
+        for kind in kinds:
+            if self.rng.random() < self.rates[kind]:
+                self.injected[kind] += 1
+                return kind
+        return None
+
+
+class FaultySession(fake_bot.FakeSession):
+    """FakeSession со сбоями; delivered - то, что действительно дошло до чатов"""
+
+    def __init__(self, plan: FaultPlan):
+        super().__init__()
+        self.plan = plan
+        self.delivered = []
+
+    async def make_request(self, bot, method, timeout=None):
+        from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+        from aiogram.methods import SendMessage
+
+        chat_id = getattr(method, "chat_id", None)
+        if isinstance(method, SendMessage) and chat_id in self.plan.blocked:
+            self.plan.injected["blocked"] += 1
+            raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+
+        fault = self.plan.draw("retry_after", "timeout")
+        if fault == "retry_after":
+            raise TelegramRetryAfter(method, f"Too Many Requests: retry after {self.plan.retry_after}",
+                                     self.plan.retry_after)
+
+        result = await super().make_request(bot, method, timeout)
+        if isinstance(method, SendMessage):
+            self.delivered.append((chat_id, method.text))
+
+        if fault == "timeout":
+            raise TelegramNetworkError(method, "Request timeout error")
+        return result
+
+
+class FaultyFile:
+    """Файл на запись, которому «не хватает места»: ENOSPC сразу или после части данных"""
+
+    def __init__(self, f, fail_after: int):
+        self.f = f
+        self.left = fail_after
+
+    def write(self, data: str) -> int:
+        if len(data) > self.left:
+            self.f.write(data[:self.left])
+            self.f.flush()
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        self.left -= len(data)
+        return self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+        return False
+
+
+def install_storage_faults(app, plan: FaultPlan, data_dir: Path):
+    """Подменяет open в модуле app: запись в DATA_DIR может упасть"""
+    real_open = open
+
+    def faulty_open(file, mode="r", *args, **kwargs):
+        f = real_open(file, mode, *args, **kwargs)
+        if "w" in mode and Path(file).parent == data_dir:
+            fault = plan.draw("enospc", "partial")
+            if fault == "enospc":
+                return FaultyFile(f, 0)
+            if fault == "partial":
+                return FaultyFile(f, plan.rng.randint(1, 200))
+        return f
+
+    app.open = faulty_open
+
+
+def read_disk(path: Path) -> Optional[dict]:
+    """Файл так, как его увидит бот после перезапуска; None - файл испорчен"""
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except ValueError:
+        return None
+
+
+class Harness:
+    def __init__(self, app, args, plan: FaultPlan, bot):
+        self.app = app
+        self.args = args
+        self.plan = plan
+        self.bot = bot
+        self.session: FaultySession = bot.session
+        self.partition = app.PARTITIONS[app.TUTOR_ID]
+        self.rng = random.Random(args.seed)
+        self.students = [800_000 + i for i in range(args.students)]
+        # Подтверждения, о которых ученик узнал: (ученик, слот)
+        self.acknowledged = set()
+        # Доставленные напоминания: (чат, слот занятия) -> сколько раз
+        self.reminders = Counter()
+        self.broadcasts = 0
+        self.handler_errors = Counter()
+        self.violations = Counter()
+        self.divergent_rounds = 0
+
+    def write_schedule(self):
+        schedule = {day: [f"{h:02d}:00" for h in range(8, 21)] for day in self.app.DAYS_RU}
+        self.app.save_json(self.partition.schedule_file, schedule)
+        return schedule
+
+    def book(self, schedule: dict, student_id: int) -> bool:
+        """Заявка ученика на случайный свободный слот следующих недель"""
+        app = self.app
+        days = [(day_name, week) for week in (1, 2, 3) for day_name in app.DAYS_RU]
+        self.rng.shuffle(days)
+        for day_name, week in days:
+            token = app.day_token(day_name, week)
+            times = app.get_available_times(self.partition, token, schedule)
+            if not times:
+                continue
+
+            request_id = app.create_request_id()
+            request = app.PendingRequest(
+                student_id=student_id,
+                student_name=f"Ученик {student_id}",
+                student_class="9",
+                subject=app.SUBJECTS[0],
+                lesson_datetime=app.get_lesson_datetime(token, self.rng.choice(times)),
+                timestamp=app.datetime.now(tz=app.MSK_TIMEZONE),
+                status="pending"
+            )
+            self.partition.requests.load()[request_id] = request
+            self.partition.requests.save()
+            app.track_request(self.partition, "requests", request_id, request)
+            return True
+        return False
+
+    async def confirm_pending(self):
+        app = self.app
+        for request_id, request in list(self.partition.requests.load().items()):
+            delivered = len(self.session.delivered)
+            callback = fake_bot.make_callback(self.bot, app.TUTOR_ID, f"confirm_{request_id}")
+            try:
+                await app.confirm_request_handler(callback, self.bot, self.partition)
+            except Exception as e:
+                self.handler_errors[type(e).__name__] += 1
+
+            for chat_id, text in self.session.delivered[delivered:]:
+                if chat_id == request.student_id and text.startswith("✅"):
+                    self.acknowledged.add((request.student_id, request.lesson_datetime))
+
+    async def send_reminders(self):
+        """Каждый раунд - тик send_reminders для каждого занятия за час до начала"""
+        app = self.app
+        slots = {lesson.lesson_datetime for lesson in self.partition.lessons.load().values()}
+        for slot in sorted(slots):
+            delivered = len(self.session.delivered)
+            await app.send_partition_reminders(self.bot, self.partition, slot - timedelta(hours=1))
+            for chat_id, text in self.session.delivered[delivered:]:
+                if text.startswith("⏰"):
+                    self.reminders[(chat_id, slot)] += 1
+
+    async def broadcast(self):
+        self.broadcasts += 1
+        text = f"📢 Объявление №{self.broadcasts}"
+        await self.app.send_batch(self.bot, self.partition, [(s, text, None) for s in self.students])
+
+    async def run_round(self, schedule: dict, number: int):
+        for student_id in self.rng.sample(self.students, min(self.args.bookings, len(self.students))):
+            self.book(schedule, student_id)
+        await self.confirm_pending()
+        await self.send_reminders()
+        if self.args.broadcast_every and number % self.args.broadcast_every == 0:
+            await self.broadcast()
+
+    # ------------------------------------------------------------------
+    # Инварианты
+    # ------------------------------------------------------------------
+
+    def lesson_slots(self, lessons: dict) -> Counter:
+        return Counter(
+            (lesson["student_id"], self.app.parse_datetime(lesson["lesson_datetime"]))
+            for lesson in lessons.values() if isinstance(lesson, dict) and lesson.get("lesson_datetime")
+        )
+
+    def check(self) -> Dict[str, int]:
+        """Нарушения на текущий момент; disk_divergent - диск отстает от памяти"""
+        memory = {key: record.to_dict() for key, record in self.partition.lessons.load().items()}
+        disk = read_disk(self.partition.lessons.path)
+
+        found = Counter()
+        for source, lessons in (("memory", memory), ("disk", disk or {})):
+            per_slot = Counter(dt for _, dt in self.lesson_slots(lessons))
+            found[f"double_booking.{source}"] = sum(n - 1 for n in per_slot.values() if n > 1)
+
+        on_disk = set(self.lesson_slots(disk or {}))
+        found["lost_confirmations"] = len(self.acknowledged - on_disk)
+        found["corrupt_files"] = sum(
+            read_disk(path) is None for path in self.partition.data_dir.glob("*.json")
+        )
+
+        found["duplicate_reminders"] = sum(n - 1 for n in self.reminders.values() if n > 1)
+        broadcasts = Counter(message for message in self.session.delivered if message[1].startswith("📢"))
+        found["duplicate_broadcasts"] = sum(n - 1 for n in broadcasts.values() if n > 1)
+        return +found
+
+    def converged(self) -> bool:
+        """Диск совпадает с памятью, заявок нет, каждое занятие напомнено ученику и репетитору"""
+        app = self.app
+        for store in (self.partition.lessons, self.partition.requests):
+            disk = read_disk(store.path)
+            memory = {key: record.to_dict() for key, record in store.load().items()}
+            if disk != json.loads(json.dumps(memory, ensure_ascii=False)):
+                return False
+        if self.partition.requests.load():
+            return False
+
+        for lesson in self.partition.lessons.load().values():
+            if not self.reminders[(app.TUTOR_ID, lesson.lesson_datetime)]:
+                return False
+            if lesson.student_id not in self.plan.blocked and not self.reminders[(lesson.student_id, lesson.lesson_datetime)]:
+                return False
+        return True
+
+    def restart_check(self) -> Dict[str, int]:
+        """Перезапуск: файлы читаются заново, как при старте бота"""
+        app = self.app
+        lessons = app.RecordFile(self.partition.lessons.path, app.Lesson).load()
+        requests = app.RecordFile(self.partition.requests.path, app.PendingRequest).load()
+        booked = {(lesson.student_id, lesson.lesson_datetime) for lesson in lessons.values()}
+
+        return +Counter({
+            "restart.lost_confirmations": len(self.acknowledged - booked),
+            # Заявка осталась на диске вместе с уже созданным по ней занятием - ее подтвердят второй раз
+            "restart.resurrected_requests": sum(
+                (request.student_id, request.lesson_datetime) in booked for request in requests.values()
+            )
+        })
+
+    def observe(self):
+        found = self.check()
+        if found.pop("lost_confirmations", 0) or found.pop("corrupt_files", 0):
+            self.divergent_rounds += 1
+        for key, value in found.items():
+            self.violations[key] = max(self.violations[key], value)
+
+
+async def run_harness(args) -> Dict:
+    import app
+    from aiogram import Bot
+
+    plan = FaultPlan({
+        "timeout": args.timeout_rate,
+        "retry_after": args.retry_after_rate,
+        "enospc": args.enospc_rate,
+        "partial": args.partial_rate
+    }, args.retry_after, random.Random(args.seed + 1))
+    bot = Bot(token=fake_bot.FAKE_TOKEN, session=FaultySession(plan))
+    install_storage_faults(app, plan, app.PARTITIONS[app.TUTOR_ID].data_dir)
+
+    harness = Harness(app, args, plan, bot)
+    schedule = harness.write_schedule()
+    rounds = Counter()
+    started = time.perf_counter()
+
+    for number in range(args.warmup):
+        await harness.run_round(schedule, number)
+        harness.observe()
+        rounds["warmup"] += 1
+
+    plan.active = True
+    plan.blocked = set(harness.rng.sample(harness.students, int(len(harness.students) * args.blocked_share)))
+    for number in range(args.rounds):
+        await harness.run_round(schedule, number)
+        harness.observe()
+        rounds["faulty"] += 1
+    plan.active = False
+
+    recovery_started = time.perf_counter()
+    recovery_s = None
+    for number in range(args.max_recovery_rounds):
+        await harness.run_round(schedule, number)
+        harness.observe()
+        rounds["recovery"] += 1
+        if harness.converged():
+            recovery_s = time.perf_counter() - recovery_started
+            break
+
+    final = harness.check() + harness.restart_check()
+    for key, value in final.items():
+        harness.violations[key] = max(harness.violations[key], value)
+    harness.violations.pop("lost_confirmations", None)
+    harness.violations.pop("corrupt_files", None)
+    for key in ("lost_confirmations", "corrupt_files"):
+        if final.get(key):
+            harness.violations[f"final.{key}"] = final[key]
+
+    await app.storage.close()
+
+    return {
+        "rounds": dict(rounds),
+        "elapsed_s": round(time.perf_counter() - started, 3),
+        "recovered": recovery_s is not None,
+        "recovery_s": round(recovery_s, 3) if recovery_s is not None else None,
+        "recovery_rounds": rounds["recovery"] if recovery_s is not None else None,
+        "disk_divergent_rounds": harness.divergent_rounds,
+        "lessons": len(harness.partition.lessons.load()),
+        "acknowledged": len(harness.acknowledged),
+        "blocked_students": len(plan.blocked),
+        "injected": dict(plan.injected),
+        "handler_errors": dict(harness.handler_errors),
+        "violations": dict(+harness.violations),
+        "bot_api_calls": dict(bot.session.calls)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Инъекция сбоев Telegram API и диска для tutor_bot")
+    parser.add_argument("--students", type=int, default=30)
+    parser.add_argument("--bookings", type=int, default=3, help="новых заявок за раунд")
+    parser.add_argument("--warmup", type=int, default=3, help="раундов без сбоев")
+    parser.add_argument("--rounds", type=int, default=20, help="раундов со сбоями")
+    parser.add_argument("--max-recovery-rounds", type=int, default=20)
+    parser.add_argument("--broadcast-every", type=int, default=5, help="объявление каждые N раундов (0 - без)")
+    parser.add_argument("--timeout-rate", type=float, default=0.05)
+    parser.add_argument("--retry-after-rate", type=float, default=0.05)
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, сек")
+    parser.add_argument("--blocked-share", type=float, default=0.1, help="доля учеников, заблокировавших бота")
+    parser.add_argument("--enospc-rate", type=float, default=0.05)
+    parser.add_argument("--partial-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="файл для JSON-отчета (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="tutorbot-faults-") as tmp:
+        os.environ["DATA_DIR"] = tmp
+        os.environ["BOT_MODE"] = "polling"
+        os.environ.pop("RECORD_UPDATES", None)
+
+        print(f"💥 Инъекция сбоев: {args.rounds} раундов...", file=sys.stderr)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+                contextlib.redirect_stderr(devnull):
+            report = asyncio.run(run_harness(args))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        print(f"✅ Отчет сохранен в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if report["violations"]:
+        print(f"❌ Нарушены инварианты: {', '.join(report['violations'])}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
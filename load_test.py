@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""Нагрузочный тест: тысячи учеников против настоящего Dispatcher через фейковый Bot API.
+
+Бот работает в режиме polling против fake_telegram.py, ученики параллельно проходят
+сценарии «первое занятие», «повторное занятие», «перенос» и «отмена», репетитор
+автоматически подтверждает все запросы. В конце печатается JSON с перцентилями
+сквозной задержки (от отправки апдейта до ответа бота) и пропускной способностью.
+
+Пример:
+    python load_test.py --students 2000 --concurrency 200 --latency 0.02 --error-rate 0.005
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from fake_telegram import FakeTelegramServer
+
+FLOWS = ["repeat", "reschedule", "cancel"]
+
+
+class StepTimeout(Exception):
+    pass
+
+
+def percentiles(values: List[float]) -> Dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 2)
+
+    return {
+        "count": len(values),
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(values[-1] * 1000, 2)
+    }
+
+
+def iter_buttons(markup) -> List[str]:
+    """Все callback_data из inline-клавиатуры (в том числе из вложенных списков)"""
+    result = []
+
+    def walk(node):
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+        elif isinstance(node, dict) and node.get("callback_data"):
+            result.append(node["callback_data"])
+
+    if isinstance(markup, dict):
+        walk(markup.get("inline_keyboard", []))
+    return result
+
+
+class Report:
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.first_response = []
+        self.outcomes = Counter()
+        self.errors = Counter()
+
+    def to_dict(self) -> Dict:
+        return {
+            "steps": {name: percentiles(values) for name, values in sorted(self.latency.items())},
+            "all_steps": percentiles([v for values in self.latency.values() for v in values]),
+            "first_response": percentiles(self.first_response),
+            "outcomes": dict(self.outcomes),
+            "errors": dict(self.errors)
+        }
+
+
+class SimulatedStudent:
+    def __init__(self, server: FakeTelegramServer, report: Report, user_id: int,
+                 rng: random.Random, step_timeout: float, confirm_timeout: float):
+        self.server = server
+        self.report = report
+        self.user_id = user_id
+        self.rng = rng
+        self.step_timeout = step_timeout
+        self.confirm_timeout = confirm_timeout
+        self.queue = server.subscribe(user_id)
+        self.keyboard: List[str] = []
+        self.last_text = ""
+
+    async def wait_for(self, name: str, started: float, done: Callable[[Dict], bool], timeout: float) -> Dict:
+        deadline = time.perf_counter() + timeout
+        first = True
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self.report.errors[f"timeout.{name}"] += 1
+                raise StepTimeout(name)
+            try:
+                action = await asyncio.wait_for(self.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                continue
+
+            if first:
+                self.report.first_response.append(action["at"] - started)
+                first = False
+
+            if action["method"] in ("sendMessage", "editMessageText"):
+                self.last_text = action.get("text", "")
+                buttons = iter_buttons(action.get("reply_markup"))
+                if buttons:
+                    self.keyboard = buttons
+
+            if done(action):
+                self.report.latency[name].append(action["at"] - started)
+                return action
+
+    async def send_text(self, name: str, text: str, replies: int = 1):
+        """Сообщение от ученика; шаг завершается после replies ответов бота"""
+        counter = {"left": replies}
+
+        def done(action):
+            if action["method"] == "sendMessage":
+                counter["left"] -= 1
+            return counter["left"] <= 0
+
+        started = time.perf_counter()
+        self.server.push_message(self.user_id, text)
+        return await self.wait_for(name, started, done, self.step_timeout)
+
+    async def click(self, name: str, data: str) -> Dict:
+        """Нажатие кнопки; шаг завершается ответом на callback"""
+        started = time.perf_counter()
+        self.server.push_callback(self.user_id, data)
+        return await self.wait_for(name, started, lambda a: a["method"] == "answerCallbackQuery", self.step_timeout)
+
+    async def wait_tutor_decision(self, name: str):
+        started = time.perf_counter()
+        action = await self.wait_for(
+            name, started,
+            lambda a: a["method"] == "sendMessage" and a.get("text", "")[:1] in ("✅", "❌"),
+            self.confirm_timeout
+        )
+        return action.get("text", "").startswith("✅")
+
+    def pick(self, prefix: str) -> Optional[str]:
+        options = [data for data in self.keyboard if data.startswith(prefix)]
+        return self.rng.choice(options) if options else None
+
+    async def choose_slot(self, flow: str, day_prefix: str, time_prefix: str) -> bool:
+        """Выбор дня и времени; False - свободных слотов нет"""
+        day = self.pick(day_prefix)
+        if not day:
+            self.report.outcomes[f"{flow}.no_slots"] += 1
+            return False
+        await self.click(f"{flow}.day", day)
+
+        slot = self.pick(time_prefix)
+        if not slot:
+            self.report.outcomes[f"{flow}.no_slots"] += 1
+            return False
+        action = await self.click(f"{flow}.time", slot)
+        if action.get("show_alert"):
+            self.report.outcomes[f"{flow}.slot_taken"] += 1
+            return False
+        return True
+
+    async def first_lesson(self) -> bool:
+        await self.send_text("start", "/start", replies=2)
+        await self.click("first_lesson.open", "first_lesson")
+        await self.send_text("first_lesson.name", f"Ученик {self.user_id}")
+        await self.send_text("first_lesson.class", str(self.rng.randint(5, 11)))
+        await self.click("first_lesson.subject", self.pick("subject_single_"))
+
+        if not await self.choose_slot("first_lesson", "time_", "confirm_time_"):
+            return False
+
+        confirmed = await self.wait_tutor_decision("first_lesson.tutor_decision")
+        self.report.outcomes[f"first_lesson.{'confirmed' if confirmed else 'rejected'}"] += 1
+        return confirmed
+
+    async def repeat(self):
+        await self.click("repeat.open", "repeat_lesson")
+        subject = self.pick("subject_single_")
+        if not subject:
+            self.report.outcomes["repeat.no_lessons"] += 1
+            return
+        await self.click("repeat.subject", subject)
+
+        if not await self.choose_slot("repeat", "repeat_time_", "repeat_confirm_"):
+            return
+
+        confirmed = await self.wait_tutor_decision("repeat.tutor_decision")
+        self.report.outcomes[f"repeat.{'confirmed' if confirmed else 'rejected'}"] += 1
+
+    async def reschedule(self):
+        await self.click("reschedule.open", "reschedule_lesson")
+        lesson = self.pick("reschedule_pick_")
+        if not lesson:
+            self.report.outcomes["reschedule.no_lessons"] += 1
+            return
+        await self.click("reschedule.pick", lesson)
+
+        if not await self.choose_slot("reschedule", "reschedule_day_", "reschedule_confirm_"):
+            return
+
+        confirmed = await self.wait_tutor_decision("reschedule.tutor_decision")
+        self.report.outcomes[f"reschedule.{'confirmed' if confirmed else 'rejected'}"] += 1
+
+    async def cancel(self):
+        await self.click("cancel.open", "cancel_lesson")
+        lesson = self.pick("cancel_pick_")
+        if not lesson:
+            self.report.outcomes["cancel.no_lessons"] += 1
+            return
+        await self.click("cancel.pick", lesson)
+
+        confirmed = await self.wait_tutor_decision("cancel.tutor_decision")
+        self.report.outcomes[f"cancel.{'confirmed' if confirmed else 'rejected'}"] += 1
+
+    async def run(self, flows: int):
+        try:
+            if not await self.first_lesson():
+                return
+            for _ in range(flows):
+                await self.click("menu", "back_to_menu")
+                await getattr(self, self.rng.choice(FLOWS))()
+        except StepTimeout:
+            pass
+        except Exception as e:
+            self.report.errors[type(e).__name__] += 1
+
+
+async def tutor_loop(server: FakeTelegramServer, tutor_id: int, report: Report):
+    """Репетитор подтверждает каждый пришедший запрос"""
+    queue = server.subscribe(tutor_id)
+    while True:
+        action = await queue.get()
+        if action["method"] != "sendMessage":
+            continue
+        for data in iter_buttons(action.get("reply_markup")):
+            if data.startswith("confirm_"):
+                report.outcomes["tutor.clicks"] += 1
+                server.push_callback(tutor_id, data)
+                break
+
+
+def write_schedule(app):
+    """Плотное расписание, чтобы ученикам было из чего выбирать"""
+    schedule = {day: [f"{h}:00" for h in range(8, 21)] for day in app.DAYS_RU}
+    partition = app.PARTITIONS[app.TUTOR_ID]
+    app.save_json(partition.schedule_file, schedule)
+
+
+async def run_load(args) -> Dict:
+    import app
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    server = FakeTelegramServer(args.latency, args.jitter, args.error_rate, args.retry_after, seed=args.seed)
+    url = await server.start()
+
+    bot = Bot(token=app.TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+    app.register_handlers(app.dp)
+    write_schedule(app)
+
+    report = Report()
+    rng = random.Random(args.seed)
+    polling = asyncio.create_task(app.dp.start_polling(bot, handle_signals=False, polling_timeout=1))
+    tutor = asyncio.create_task(tutor_loop(server, app.TUTOR_ID, report))
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def student(i):
+        async with semaphore:
+            user_id = 500_000 + i
+            await SimulatedStudent(
+                server, report, user_id, random.Random(rng.random()), args.step_timeout, args.confirm_timeout
+            ).run(args.flows)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(student(i) for i in range(args.students)))
+    elapsed = time.perf_counter() - started
+
+    await app.dp.stop_polling()
+    tutor.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await asyncio.gather(polling, tutor, return_exceptions=True)
+    await bot.session.close()
+    await app.storage.close()
+    await server.stop()
+
+    result = report.to_dict()
+    result.update({
+        "students": args.students,
+        "concurrency": args.concurrency,
+        "flows_per_student": args.flows,
+        "api_latency_s": args.latency,
+        "error_rate": args.error_rate,
+        "elapsed_s": round(elapsed, 3),
+        "updates": server.stats["updates_pushed"],
+        "updates_per_s": round(server.stats["updates_pushed"] / elapsed, 1) if elapsed else 0,
+        "server": {k: v for k, v in server.stats.items() if k != "updates_pushed"}
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест tutor_bot через фейковый Bot API")
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="одновременно активных учеников")
+    parser.add_argument("--flows", type=int, default=2, help="сценариев после первого занятия")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка фейкового API, сек")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--step-timeout", type=float, default=15.0)
+    parser.add_argument("--confirm-timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="файл для JSON-результата (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="tutorbot-load-") as tmp:
+        os.environ["DATA_DIR"] = tmp
+        os.environ.setdefault("BOT_MODE", "polling")
+        print(f"🚀 {args.students} учеников, параллельно {args.concurrency}...", file=sys.stderr)
+
+        # Логи бота не нужны - они сильно искажают время
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = asyncio.run(run_load(args))
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        print(f"✅ Результаты сохранены в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
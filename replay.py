@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Реплей записанных апдейтов через настоящий Dispatcher с фейковым ботом.
+
+Файл записывает сам бот при RECORD_UPDATES=1 (по умолчанию DATA_DIR/requests.jsonl).
+Апдейты одного пользователя обрабатываются строго по порядку, разных - параллельно,
+как при polling. В конце печатается JSON с временем каждого обработчика.
+Кнопки репетитора ссылаются на id заявок на момент записи, поэтому для точного
+воспроизведения передайте снимок данных, сделанный перед записью (--data-dir).
+
+Примеры:
+    python replay.py bot_data/requests.jsonl                 # в реальном темпе
+    python replay.py bot_data/requests.jsonl --speed 10      # в 10 раз быстрее
+    python replay.py bot_data/requests.jsonl --speed max --data-dir snapshot/
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+
+def summarize(timings: List[float]) -> Dict:
+    timings = sorted(timings)
+    return {
+        "count": len(timings),
+        "total_ms": round(sum(timings) * 1000, 2),
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 3),
+        "max_ms": round(timings[-1] * 1000, 3)
+    }
+
+
+def read_records(path: Path) -> List[Dict]:
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    # t - unix-время записи: сессии и воркеры, дописавшие один файл, сливаются в общий порядок
+    records.sort(key=lambda r: r.get("t", 0))
+    return records
+
+
+def update_user_id(update: Dict) -> int:
+    for kind in ("message", "callback_query", "edited_message"):
+        event = update.get(kind)
+        if event and event.get("from"):
+            return event["from"]["id"]
+    return 0
+
+
+async def replay(args) -> Dict:
+    import app
+    import fake_bot
+    from aiogram.dispatcher.event.bases import UNHANDLED
+    from aiogram.types import Update
+
+    bot = fake_bot.make_fake_bot(args.latency)
+    app.register_handlers(app.dp)
+    app.restore_cache_from_files()
+
+    handler_timings = defaultdict(list)
+
+    async def timing_middleware(handler, event, data):
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_timings[name].append(time.perf_counter() - started)
+
+    app.dp.message.middleware(timing_middleware)
+    app.dp.callback_query.middleware(timing_middleware)
+
+    records = read_records(Path(args.file))
+    speed = 0.0 if args.speed == "max" else float(args.speed)
+    update_timings = []
+    lags = []
+    errors = defaultdict(int)
+    unhandled = 0
+    last_task: Dict[int, asyncio.Task] = {}
+
+    async def feed(record, previous, scheduled):
+        nonlocal unhandled
+        if previous:
+            await asyncio.gather(previous, return_exceptions=True)
+        lags.append(max(0.0, time.perf_counter() - scheduled))
+
+        started = time.perf_counter()
+        try:
+            update = Update.model_validate(record["update"], context={"bot": bot})
+            result = await app.dp.feed_update(bot, update)
+            if result is UNHANDLED:
+                unhandled += 1
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        finally:
+            update_timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    first_t = records[0]["t"] if records else 0
+    tasks = []
+
+    for record in records:
+        scheduled = started + ((record["t"] - first_t) / speed if speed else 0)
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        user_id = update_user_id(record["update"])
+        task = asyncio.create_task(feed(record, last_task.get(user_id), scheduled))
+        last_task[user_id] = task
+        tasks.append(task)
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await app.storage.close()
+
+    return {
+        "file": str(args.file),
+        "speed": args.speed,
+        "updates": len(records),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(records) / elapsed, 1) if elapsed else 0,
+        "recorded_span_s": round(records[-1]["t"] - first_t, 3) if records else 0,
+        "update": summarize(update_timings) if update_timings else {},
+        "schedule_lag": summarize(lags) if lags else {},
+        "handlers": {name: summarize(values) for name, values in sorted(handler_timings.items())},
+        "unhandled": unhandled,
+        "errors": dict(errors),
+        "bot_api_calls": dict(bot.session.calls)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Реплей записанных апдейтов tutor_bot")
+    parser.add_argument("file", help="JSON lines, записанный UpdateRecorderMiddleware")
+    parser.add_argument("--speed", default="1", help="множитель скорости (1, 10, ...) или max")
+    parser.add_argument("--data-dir", help="снимок данных бота; копируется во временную папку")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка фейкового Bot API, сек")
+    parser.add_argument("--output", help="файл для JSON-отчета (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    if args.speed != "max" and float(args.speed) <= 0:
+        parser.error("--speed должен быть больше 0 или max")
+
+    with tempfile.TemporaryDirectory(prefix="tutorbot-replay-") as tmp:
+        if args.data_dir:
+            shutil.copytree(args.data_dir, tmp, dirs_exist_ok=True)
+        os.environ["DATA_DIR"] = tmp
+        os.environ["BOT_MODE"] = "polling"
+        os.environ.pop("RECORD_UPDATES", None)
+
+        print(f"▶️ Реплей {args.file} (скорость: {args.speed})...", file=sys.stderr)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            report = asyncio.run(replay(args))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        print(f"✅ Отчет сохранен в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
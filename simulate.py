@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""Офлайн-симулятор загрузки расписания: сколько слотов заполнится и сколько учеников
+не найдут времени при заданном расписании и спросе.
+
+Каждая симулированная неделя проходит через настоящие функции бота: свободное время
+берется из get_available_times, заявки бронируют слоты через track_request и
+подтверждаются approve_requests, отмены - remove_lesson. Недели делятся на куски и
+считаются в пуле процессов, у каждого процесса свой временный DATA_DIR.
+
+Сценарий - JSON (все поля необязательные):
+    {
+      "schedule": {"Monday": "16:00", "Saturday": ["12:00", "13:00"]},
+      "slot_duration": 60,
+      "max_work_hour": 21,
+      "demand": {
+        "students": 30,
+        "lessons_per_student": 1.0,
+        "days": {"Monday": 2, "Saturday": 1},
+        "times": {"18:00": 3, "19:00": 1},
+        "flexible_days": 2,
+        "cancel_rate": 0.1
+      }
+    }
+Строка вместо списка времен - время начала: слоты строит generate_time_slots
+с учетом slot_duration и max_work_hour.
+
+Пример:
+    python simulate.py --scenario scenario.json --weeks 2000 --workers 4 --output sim.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+DEFAULT_DEMAND = {
+    "students": 30,
+    "lessons_per_student": 1.0,
+    "days": {},
+    "times": {},
+    "flexible_days": 2,
+    "cancel_rate": 0.1
+}
+
+
+def init_worker(root: str):
+    """DATA_DIR задается до импорта app - у каждого процесса своя папка внутри root.
+    Процессы пула завершаются через os._exit, поэтому root удаляет родитель."""
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(dir=root)
+    os.environ["BOT_MODE"] = "polling"
+    os.environ.pop("RECORD_UPDATES", None)
+
+
+def build_schedule(app, scenario: dict) -> dict:
+    schedule = {}
+    for day_name, value in (scenario.get("schedule") or app.DEFAULT_SCHEDULE).items():
+        if day_name not in app.DAYS_RU:
+            continue
+        if isinstance(value, str):
+            start = app.parse_time_input(value)
+            schedule[day_name] = app.generate_time_slots(*start) if start else []
+        else:
+            schedule[day_name] = list(value)
+    return schedule
+
+
+def weighted_choice(rng: random.Random, weights: dict):
+    keys = list(weights)
+    return rng.choices(keys, weights=[weights[key] for key in keys])[0]
+
+
+def draw_demand(app, demand: dict, schedule: dict, rng: random.Random) -> list:
+    """Заявки недели в случайном порядке: (ученик, дни по убыванию предпочтения, желаемое время)"""
+    day_weights = {day: w for day, w in (demand["days"] or dict.fromkeys(app.DAYS_RU, 1)).items() if day in app.DAYS_RU}
+    all_times = sorted({t for times in schedule.values() for t in times}) or ["18:00"]
+    time_weights = demand["times"] or dict.fromkeys(all_times, 1)
+
+    requests = []
+    for student_index in range(demand["students"]):
+        mean = demand["lessons_per_student"]
+        count = int(mean) + (1 if rng.random() < mean - int(mean) else 0)
+        for _ in range(count):
+            days = []
+            remaining = dict(day_weights)
+            while remaining and len(days) <= demand["flexible_days"]:
+                day = weighted_choice(rng, remaining)
+                days.append(day)
+                del remaining[day]
+            requests.append((700_000 + student_index, days, weighted_choice(rng, time_weights)))
+
+    rng.shuffle(requests)
+    return requests
+
+
+def minutes(app, time_str: str) -> int:
+    hour, minute = app.parse_time(time_str)
+    return hour * 60 + minute
+
+
+def reset_partition(app, partition):
+    partition.lessons.save({}, allow_empty=True)
+    partition.requests.save({})
+    partition.holds.save({})
+    app.REQUEST_EXPIRY.heap.clear()
+    app.REQUEST_EXPIRY.tracked.clear()
+
+
+def simulate_week(app, partition, schedule: dict, demand: dict, rng: random.Random) -> dict:
+    """Одна неделя: заявки по очереди выбирают свободное время, репетитор подтверждает все разом"""
+    reset_partition(app, partition)
+    # Следующая неделя: в текущей часть слотов уже в прошлом
+    tokens = {day_name: app.day_token(day_name, 1) for day_name in app.DAYS_RU}
+    capacity = sum(len(times) for times in app.week_availability(partition, 1, schedule).values())
+    day_index = {day_name: i for i, day_name in enumerate(app.DAYS_RU)}
+
+    requests = draw_demand(app, demand, schedule, rng)
+    no_slot = 0
+    displaced = 0
+    shift_minutes = 0
+
+    for student_id, days, preferred_time in requests:
+        choice = None
+        for day_name in days:
+            times = app.get_available_times(partition, tokens[day_name], schedule)
+            if times:
+                choice = (day_name, min(times, key=lambda t: abs(minutes(app, t) - minutes(app, preferred_time))))
+                break
+
+        if choice is None:
+            no_slot += 1
+            continue
+
+        day_name, time_str = choice
+        if (day_name, time_str) != (days[0], preferred_time):
+            displaced += 1
+            shift_minutes += abs(day_index[day_name] - day_index[days[0]]) * 1440 + \
+                abs(minutes(app, time_str) - minutes(app, preferred_time))
+
+        request_id = app.create_request_id()
+        request = app.PendingRequest(
+            student_id=student_id,
+            student_name=f"Ученик {student_id}",
+            student_class="9",
+            subject=app.SUBJECTS[0],
+            lesson_datetime=app.get_lesson_datetime(tokens[day_name], time_str),
+            timestamp=datetime.now(tz=app.MSK_TIMEZONE),
+            status="pending"
+        )
+        partition.requests.load()[request_id] = request
+        partition.requests.save()
+        app.track_request(partition, "requests", request_id, request)
+
+    approved, conflicts = app.approve_requests(partition, list(partition.requests.load()))
+
+    cancelled = 0
+    for lesson_id in list(partition.lessons.load()):
+        if rng.random() < demand["cancel_rate"]:
+            app.remove_lesson(partition, lesson_id)
+            cancelled += 1
+
+    held = len(partition.lessons.load())
+    return {
+        "capacity": capacity,
+        "demand": len(requests),
+        "booked": len(approved),
+        "rejected": no_slot + len(conflicts),
+        "cancelled": cancelled,
+        "held": held,
+        "displaced": displaced,
+        "shift_minutes": shift_minutes,
+        "utilization": held / capacity if capacity else 0.0
+    }
+
+
+def simulate_chunk(task: dict) -> dict:
+    """Выполняется в процессе пула: task - сценарий, число недель и seed куска"""
+    started_cpu = time.process_time()
+    started = time.perf_counter()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import app
+
+        scenario = task["scenario"]
+        app.SLOT_DURATION = scenario.get("slot_duration", app.SLOT_DURATION)
+        app.MAX_WORK_HOUR = scenario.get("max_work_hour", app.MAX_WORK_HOUR)
+        demand = {**DEFAULT_DEMAND, **scenario.get("demand", {})}
+
+        partition = app.PARTITIONS[app.TUTOR_ID]
+        schedule = build_schedule(app, scenario)
+        app.save_json(partition.schedule_file, schedule)
+
+        rng = random.Random(task["seed"])
+        weeks = [simulate_week(app, partition, schedule, demand, rng) for _ in range(task["weeks"])]
+
+    return {
+        "schedule": schedule,
+        "weeks": weeks,
+        "cpu_s": time.process_time() - started_cpu,
+        "wall_s": time.perf_counter() - started
+    }
+
+
+def percentile(values: list, share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def summarize(chunks: list, wall_s: float) -> dict:
+    weeks = [week for chunk in chunks for week in chunk["weeks"]]
+    total = {key: sum(week[key] for week in weeks) for key in
+             ("capacity", "demand", "booked", "rejected", "cancelled", "held", "displaced", "shift_minutes")}
+    utilization = [week["utilization"] for week in weeks]
+    placed = total["demand"] - total["rejected"]
+
+    return {
+        "weeks": len(weeks),
+        "slots_per_week": round(total["capacity"] / len(weeks), 2) if weeks else 0,
+        "demand_per_week": round(total["demand"] / len(weeks), 2) if weeks else 0,
+        "utilization": {
+            "mean": round(statistics.fmean(utilization), 4) if utilization else 0.0,
+            "p5": round(percentile(utilization, 0.05), 4),
+            "p50": round(percentile(utilization, 0.5), 4),
+            "p95": round(percentile(utilization, 0.95), 4)
+        },
+        "rejection_rate": round(total["rejected"] / total["demand"], 4) if total["demand"] else 0.0,
+        "displaced_rate": round(total["displaced"] / placed, 4) if placed else 0.0,
+        "mean_shift_hours": round(total["shift_minutes"] / 60 / total["displaced"], 2) if total["displaced"] else 0.0,
+        "cancel_rate": round(total["cancelled"] / total["booked"], 4) if total["booked"] else 0.0,
+        "compute": {
+            "wall_s": round(wall_s, 3),
+            "cpu_s": round(sum(chunk["cpu_s"] for chunk in chunks), 3),
+            "weeks_per_s": round(len(weeks) / wall_s, 1) if wall_s else 0,
+            "cpu_ms_per_week": round(sum(chunk["cpu_s"] for chunk in chunks) * 1000 / len(weeks), 3) if weeks else 0
+        }
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).parent
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def load_scenario(args) -> dict:
+    scenario = json.loads(Path(args.scenario).read_text(encoding="utf-8")) if args.scenario else {}
+    demand = scenario.setdefault("demand", {})
+
+    if args.slot_duration:
+        scenario["slot_duration"] = args.slot_duration
+    if args.max_work_hour:
+        scenario["max_work_hour"] = args.max_work_hour
+    if args.students is not None:
+        demand["students"] = args.students
+    if args.cancel_rate is not None:
+        demand["cancel_rate"] = args.cancel_rate
+    return scenario
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симулятор загрузки расписания tutor_bot")
+    parser.add_argument("--scenario", help="JSON со schedule, slot_duration, max_work_hour и demand")
+    parser.add_argument("--weeks", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk", type=int, default=50, help="недель на одну задачу пула")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--students", type=int, help="переопределяет demand.students")
+    parser.add_argument("--cancel-rate", type=float, help="переопределяет demand.cancel_rate")
+    parser.add_argument("--slot-duration", type=int, help="переопределяет SLOT_DURATION, мин (для дней, заданных временем начала)")
+    parser.add_argument("--max-work-hour", type=int, help="переопределяет MAX_WORK_HOUR (для дней, заданных временем начала)")
+    parser.add_argument("--output", help="файл для JSON-отчета (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    scenario = load_scenario(args)
+    tasks = []
+    for index, start in enumerate(range(0, args.weeks, args.chunk)):
+        tasks.append({"scenario": scenario, "weeks": min(args.chunk, args.weeks - start), "seed": args.seed * 100_003 + index})
+
+    print(f"🎲 Симуляция {args.weeks} недель в {args.workers} процессах...", file=sys.stderr)
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="tutorbot-sim-") as root, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(root,)) as pool:
+        chunks = list(pool.map(simulate_chunk, tasks))
+    wall_s = time.perf_counter() - started
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "scenario": scenario,
+        "schedule": chunks[0]["schedule"] if chunks else {},
+        "workers": args.workers,
+        **summarize(chunks, wall_s)
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        print(f"✅ Результаты сохранены в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()